@@ -1,11 +1,13 @@
 # app/api/routes/devices.py
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List, Dict, Any
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import List, Dict, Any, Optional
 import logging
+import time
 
 from app.api.models.schemas import DeviceIDs
 from app.integration.registry import device_registry
-from app.core.devices_manager import load_devices, update_device_status
+from app.repositories.device_repository import device_repository
+from app.services.telemetry_service import telemetry_service, ROLLUP_TIERS
 
 # Import device-specific API routers
 from app.integration.producers.shelly.ShellyDuoRGBW.api import router as shelly_duorgbw_router
@@ -17,7 +19,7 @@ logger = logging.getLogger(__name__)
 router.include_router(shelly_duorgbw_router, prefix="/shelly/duorgbw")
 
 @router.get("/")
-def get_all_devices():
+async def get_all_devices():
     """Get all devices (legacy method)"""
     # You can choose to either:
     # 1. Return devices from the registry (recommended for new code)
@@ -32,13 +34,13 @@ def get_all_devices():
     ]
     
     # 2. Or keep using the old method for backward compatibility
-    devices_from_json = load_devices()
+    devices_from_json = await device_repository.get_all()
     
     # Return either the new or old format based on your needs
     return devices_from_json  # or devices_from_registry
 
 @router.get("/{device_id}")
-def get_device(device_id: str):
+async def get_device(device_id: str):
     """Get a single device by ID (legacy method)"""
     # Try to get from registry first (new approach)
     device_from_registry = device_registry.get_device(device_id)
@@ -51,12 +53,46 @@ def get_device(device_id: str):
         }
     
     # Fall back to old method if not found in registry
-    devices = load_devices()
-    device = next((d for d in devices if d["device_id"] == device_id or d["shelly_id"] == device_id), None)
+    device = await device_repository.get(device_id)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
     return device
 
+@router.get("/{device_id}/energy")
+async def get_device_energy(
+    device_id: str,
+    from_ts: Optional[float] = Query(None, alias="from", description="Start (Unix seconds), default 24h ago"),
+    to_ts: Optional[float] = Query(None, alias="to", description="End (Unix seconds), default now"),
+    step: str = Query("1h", description="Bucket size: 1m, 1h, 1d or seconds"),
+):
+    """Get power and energy history for a device, aggregated from rollups"""
+    resolved_id = await device_repository.resolve(device_id)
+    if not resolved_id:
+        raise HTTPException(status_code=404, detail="Device not found")
+
+    try:
+        step_seconds = ROLLUP_TIERS[step] if step in ROLLUP_TIERS else int(step)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid step: {step}")
+    if step_seconds <= 0:
+        raise HTTPException(status_code=400, detail=f"Invalid step: {step}")
+    # Buckets are built from whole rollup buckets, so the step is rounded up to fit them
+    step_seconds = telemetry_service.effective_step(step_seconds)
+
+    to_ts = to_ts if to_ts is not None else time.time()
+    from_ts = from_ts if from_ts is not None else to_ts - 86400
+    if from_ts > to_ts:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+
+    return {
+        "device_id": resolved_id,
+        "from": from_ts,
+        "to": to_ts,
+        "step": step_seconds,
+        "power": telemetry_service.query(resolved_id, "power", from_ts, to_ts, step_seconds),
+        "energy": telemetry_service.query(resolved_id, "energy", from_ts, to_ts, step_seconds),
+    }
+
 @router.get("/status")
 async def get_all_devices_status():
     """Get all devices with their current status"""
@@ -74,8 +110,7 @@ async def get_all_devices_status():
     
     # If no devices in registry, try loading from JSON
     if not registry_devices:
-        from app.core.devices_manager import load_devices
-        registry_devices = load_devices()
+        registry_devices = await device_repository.get_all()
     
     return registry_devices
 
@@ -0,0 +1,55 @@
+# app/api/routes/metrics.py
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.core.io_executor import get_io_stats, loop_lag_monitor
+from app.services.ack_tracker import ack_tracker
+from app.services.command_metrics import command_metrics
+from app.services.command_queue_service import command_queue
+from app.services.mqtt_service import mqtt_service
+from app.services.rate_limiter import rate_limiter
+from app.services.warm_start import warm_start
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+@router.get("/loop")
+async def get_loop_metrics():
+    """Event loop lag and blocking I/O executor statistics"""
+    return {
+        "loop_lag": loop_lag_monitor.stats(),
+        "io_executor": get_io_stats(),
+    }
+
+
+@router.get("/rate-limits")
+async def get_rate_limit_metrics():
+    """Current command rate and acknowledgement latency per device"""
+    return rate_limiter.get_stats()
+
+@router.get("/acks")
+async def get_ack_metrics():
+    """Command-to-acknowledgement latency percentiles per device and command type"""
+    return ack_tracker.get_stats()
+
+@router.get("/commands")
+async def get_command_metrics():
+    """Command queue depth, wait and execution time histograms and error rates"""
+    return command_metrics.summary(command_queue.get_stats())
+
+@router.get("/mqtt")
+async def get_mqtt_metrics():
+    """MQTT connection state and ingest buffer counters"""
+    return mqtt_service.get_stats()
+
+@router.get("/warm-start")
+async def get_warm_start_metrics():
+    """Startup readiness and time-to-accurate-state"""
+    return warm_start.get_stats()
+
+@router.get("/prometheus", response_class=PlainTextResponse)
+async def get_prometheus_metrics():
+    """Command queue metrics in Prometheus text exposition format"""
+    return PlainTextResponse(
+        command_metrics.prometheus(command_queue.get_stats()),
+        media_type="text/plain; version=0.0.4"
+    )
\ No newline at end of file
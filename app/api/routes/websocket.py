@@ -10,7 +10,7 @@ async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     try:
         # Send initial device states
-        devices = device_service.get_all_devices()
+        devices = await device_service.get_all_devices()
         for device in devices:
             await manager.broadcast_device_status(
                 device["device_id"], 
@@ -0,0 +1,112 @@
+# app/core/command_journal.py
+import json
+import logging
+import os
+import threading
+from typing import Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+class CommandJournal:
+    """Append-only log of queued commands for at-least-once delivery across restarts.
+
+    Each line is ``{"op": "add", "id": ..., "command": {...}}`` when a command
+    is queued (or replaced by coalescing) and ``{"op": "done", "id": ...}``
+    once it ran, expired or was cleared. Replaying the log yields the commands
+    that were still pending. The pending set is tracked in memory so the log
+    can be compacted down to it.
+    """
+
+    def __init__(self, file_path: str, fsync: bool = True):
+        self.file_path = file_path
+        self.fsync = fsync
+        self.entries = 0  # Lines written since the last compaction
+        self.pending: Dict[str, Dict[str, Any]] = {}  # {id: command record}
+        self._lock = threading.Lock()  # Appends and compaction run on I/O threads
+
+    def append(self, records: List[Dict[str, Any]]) -> bool:
+        """Write a batch of add/done records in a single write"""
+        lines = []
+        written = []
+        for record in records:
+            try:
+                lines.append(json.dumps(record, separators=(",", ":")) + "\n")
+                written.append(record)
+            except (TypeError, ValueError) as e:
+                logger.error(f"Command {record.get('id')} cannot be persisted: {e}")
+        if not lines:
+            return True
+        with self._lock:
+            try:
+                with open(self.file_path, 'a') as f:
+                    f.write("".join(lines))
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+            except Exception as e:
+                logger.error(f"Error appending to command journal: {e}")
+                return False
+
+            self.entries += len(written)
+            for record in written:
+                self._apply(record)
+        return True
+
+    def replay(self) -> List[Dict[str, Any]]:
+        """Read the log and return the pending command records in queue order"""
+        self.pending = {}
+        if not os.path.exists(self.file_path):
+            return []
+
+        entries = 0
+        with open(self.file_path, 'r') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn write from a crash can only affect the tail
+                    logger.warning(f"Skipping corrupt command journal entry at line {line_number}")
+                    continue
+                self._apply(record)
+                entries += 1
+
+        self.entries = entries
+        if self.pending:
+            logger.info(f"Found {len(self.pending)} pending commands in {self.file_path}")
+        return list(self.pending.values())
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        if record.get("op") == "add" and record.get("id"):
+            # A coalesced command keeps its id and its original place in line
+            self.pending[record["id"]] = record["command"]
+        elif record.get("op") == "done":
+            self.pending.pop(record.get("id"), None)
+
+    def should_compact(self, threshold: int) -> bool:
+        """Compact once the log is large and mostly finished commands"""
+        return self.entries >= threshold and self.entries >= 2 * len(self.pending)
+
+    def compact(self) -> bool:
+        """Rewrite the log with only the pending commands"""
+        with self._lock:
+            return self._compact()
+
+    def _compact(self) -> bool:
+        tmp_path = f"{self.file_path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                for command_id, command in self.pending.items():
+                    f.write(json.dumps({"op": "add", "id": command_id, "command": command}, separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+        except Exception as e:
+            logger.error(f"Error compacting command journal: {e}")
+            return False
+
+        self.entries = len(self.pending)
+        logger.debug(f"Compacted command journal to {self.entries} pending commands")
+        return True
@@ -24,12 +24,76 @@ class Settings(BaseSettings):
     MQTT_BROKER_PORT: int = 1883
     MQTT_CLIENT_ID: str = "smart-home-client"
     MQTT_KEEPALIVE: int = 60
+    MQTT_NARROW_SUBSCRIPTIONS: bool = True  # Subscribe only to the topics of known devices instead of shellies/#
+    WARM_START_WINDOW: float = 5.0  # Seconds to wait for devices to report after startup before declaring ready
+    MQTT_TRANSPORT_MODE: str = "thread"  # "thread" (paho loop_start) or "asyncio" (socket driven by the event loop)
+    MQTT_INGEST_BUFFER: int = 10000  # Messages buffered between the paho thread and the event loop
+    MQTT_INGEST_BATCH: int = 500  # Messages handled per drain step
+    MQTT_INGEST_WINDOW: float = 0.005  # Seconds to let a burst accumulate before draining (0 disables)
 
     # Paths
     BASE_DIR: str = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     DATA_DIR: str = os.path.join(BASE_DIR, "data")
     DEVICES_FILE: str = os.path.join(DATA_DIR, "devices.json")
     
+    # Device storage backend: "json" (snapshot + journal) or "sqlite"
+    DEVICES_BACKEND: str = "json"
+    DATABASE_URL: str = f"sqlite:///{os.path.join(BASE_DIR, 'smart_home.db')}"
+    
+    # Device store write-behind settings
+    DEVICES_FLUSH_INTERVAL: float = 5.0  # Seconds between flushes of dirty devices
+    DEVICES_FLUSH_THRESHOLD: int = 50  # Flush early once this many devices are dirty
+    DEVICES_JOURNAL_FILE: Optional[str] = None  # Defaults to devices.journal next to DEVICES_FILE
+    DEVICES_JOURNAL_FSYNC: bool = True  # fsync every journal append
+    DEVICES_COMPACT_THRESHOLD: int = 1000  # Journal entries before compacting into a snapshot
+    DEVICES_WATCH: bool = True  # Reload when the devices file is edited externally
+    
+    # Command queue
+    COMMAND_STARVATION_TIMEOUT: float = 2.0  # Seconds before a lower-priority lane is served first
+    COMMAND_WORKERS: int = 8  # Shared workers executing commands for all devices
+    COMMAND_QUEUE_IDLE_TTL: float = 60.0  # Seconds before an empty device queue is dropped
+    # Queue depth limits and what happens when they are reached:
+    # "reject" (429 to API callers), "drop_oldest", "drop_newest" or "coalesce"
+    COMMAND_QUEUE_MAX_DEPTH: int = 100  # Pending commands per device
+    COMMAND_QUEUE_MAX_TOTAL: int = 10000  # Pending commands across all devices
+    COMMAND_QUEUE_OVERFLOW: str = "reject"
+    # Default time-to-live per command lane; older commands are dropped unexecuted (0 = never)
+    COMMAND_TTL_INTERACTIVE: float = 10.0
+    COMMAND_TTL_AUTOMATION: float = 30.0
+    COMMAND_TTL_BACKGROUND: float = 120.0
+    COMMAND_FAN_OUT_MAX_DELAY: float = 5.0  # Furthest ahead (seconds) a bulk command may be scheduled with 'at'
+    # Durable command queue (append-only log replayed on startup)
+    COMMAND_QUEUE_DURABLE: bool = False
+    COMMAND_QUEUE_FILE: str = os.path.join(DATA_DIR, "commands.journal")
+    COMMAND_QUEUE_FLUSH_INTERVAL: float = 0.05  # Seconds between batched log writes
+    COMMAND_QUEUE_FSYNC: bool = True
+    COMMAND_QUEUE_COMPACT_THRESHOLD: int = 10000  # Log lines before rewriting it with pending commands only
+    
+    # Adaptive per-device rate limiting (commands per second)
+    RATE_LIMIT_INITIAL: float = 2.5  # Starting rate for a device (400ms spacing)
+    RATE_LIMIT_MIN: float = 0.5
+    RATE_LIMIT_MAX: float = 10.0
+    RATE_LIMIT_BURST: float = 1.0  # Token bucket capacity
+    RATE_LIMIT_TARGET_LATENCY: float = 0.5  # Seconds; slower acknowledgements trigger backoff
+    
+    # Command acknowledgement tracking
+    COMMAND_ACK_TIMEOUT: float = 5.0  # Seconds before an unacknowledged command counts as lost
+    COMMAND_ACK_WINDOW: int = 500  # Latency samples kept per device and per command type
+    
+    # Telemetry retention (seconds) for raw samples and each rollup tier.
+    # Raw samples and 1m rollups are memory-only; 1h and 1d rollups survive
+    # restarts through TELEMETRY_FILE.
+    TELEMETRY_RAW_RETENTION: float = 3600
+    TELEMETRY_1M_RETENTION: float = 2 * 86400
+    TELEMETRY_1H_RETENTION: float = 90 * 86400
+    TELEMETRY_1D_RETENTION: float = 5 * 365 * 86400
+    TELEMETRY_FILE: str = os.path.join(DATA_DIR, "telemetry.json")
+    TELEMETRY_SNAPSHOT_INTERVAL: float = 300  # Seconds between snapshots of the 1h/1d rollups
+    
+    # Blocking I/O executor and event loop monitoring
+    IO_EXECUTOR_WORKERS: int = 4
+    LOOP_LAG_INTERVAL: float = 0.25  # Seconds between event loop lag samples
+    
     # Logging
     LOG_LEVEL: str = "INFO"
     
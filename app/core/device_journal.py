@@ -0,0 +1,90 @@
+# app/core/device_journal.py
+import json
+import logging
+import os
+from typing import Dict, Any
+
+logger = logging.getLogger(__name__)
+
+class DeviceJournal:
+    """Append-only journal of per-device state deltas.
+
+    Each line is a JSON object ``{"device_id": ..., "delta": {...}}``. Deltas
+    hold absolute field values, so replaying a journal on top of a snapshot
+    that already contains some of its entries is harmless.
+
+    Deltas only update devices that exist in the snapshot. Adding or removing
+    devices goes through a compaction, so a delta for a device the snapshot
+    does not know (e.g. one deleted since) is skipped on replay.
+    """
+
+    def __init__(self, file_path: str, fsync: bool = True):
+        self.file_path = file_path
+        self.fsync = fsync
+        self.entries = 0  # Entries appended since the last compaction
+
+    def append(self, deltas: Dict[str, Dict[str, Any]]) -> bool:
+        """Append one delta per device in a single write"""
+        if not deltas:
+            return True
+        lines = "".join(
+            json.dumps({"device_id": device_id, "delta": delta}, separators=(",", ":")) + "\n"
+            for device_id, delta in deltas.items()
+        )
+        try:
+            with open(self.file_path, 'a') as f:
+                f.write(lines)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            self.entries += len(deltas)
+            return True
+        except Exception as e:
+            logger.error(f"Error appending to device journal: {e}")
+            return False
+
+    def replay(self, devices: Dict[str, Dict[str, Any]]) -> int:
+        """Apply journaled deltas to ``devices`` in place; returns entries applied"""
+        if not os.path.exists(self.file_path):
+            return 0
+
+        applied = 0
+        skipped = set()
+        with open(self.file_path, 'r') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn write from a crash can only affect the tail
+                    logger.warning(f"Skipping corrupt journal entry at line {line_number}")
+                    continue
+                device_id = entry.get("device_id")
+                delta = entry.get("delta") or {}
+                if not device_id:
+                    continue
+                device = devices.get(device_id)
+                if device is None:
+                    skipped.add(device_id)
+                    continue
+                device.update(delta)
+                applied += 1
+
+        if skipped:
+            logger.warning(f"Skipped journal entries for {len(skipped)} devices not in the snapshot: {sorted(skipped)}")
+        self.entries = applied
+        if applied:
+            logger.info(f"Replayed {applied} journal entries from {self.file_path}")
+        return applied
+
+    def truncate(self) -> None:
+        """Discard all entries (after they were compacted into a snapshot)"""
+        try:
+            with open(self.file_path, 'w') as f:
+                if self.fsync:
+                    os.fsync(f.fileno())
+            self.entries = 0
+        except Exception as e:
+            logger.error(f"Error truncating device journal: {e}")
@@ -0,0 +1,361 @@
+# app/core/device_store.py
+import asyncio
+import logging
+import os
+from typing import Dict, Any, Callable, List, Optional
+
+from app.core.config import settings
+from app.core.io_executor import run_io
+from app.core.json_backend import JsonDeviceBackend
+from app.integration.producers.shelly.common import MQTT_TOPIC_PREFIX
+
+logger = logging.getLogger(__name__)
+
+class DeviceStore:
+    """Authoritative in-memory device store with write-behind persistence.
+
+    Devices are loaded from the configured backend once; reads and updates
+    only touch memory. Changed fields are coalesced per device and written
+    by a background task, either every ``DEVICES_FLUSH_INTERVAL`` seconds or
+    as soon as ``DEVICES_FLUSH_THRESHOLD`` devices are dirty. The backend
+    writes run in the I/O thread pool, never on the event loop.
+
+    ``DEVICES_BACKEND`` selects the persistence: ``json`` appends deltas to a
+    journal next to the devices file and compacts it into a snapshot,
+    ``sqlite`` upserts dirty rows into the ``devices`` table.
+
+    Records are keyed by ``device_id``; an alias index resolves Shelly IDs
+    and MQTT topic prefixes (``shellies/<shelly_id>``) in O(1).
+
+    When ``DEVICES_WATCH`` is enabled, external edits to the devices file are
+    picked up by a watcher and reloaded without losing pending changes.
+    """
+
+    def __init__(self, file_path: Optional[str] = None, backend=None):
+        self.file_path = file_path or settings.DEVICES_FILE
+        self.backend = backend or self._create_backend()
+        self._devices: Dict[str, Dict[str, Any]] = {}  # {device_id: record}
+        self._pending: Dict[str, Dict[str, Any]] = {}  # {device_id: changed fields}
+        self._aliases: Dict[str, str] = {}  # {shelly_id: device_id}
+        self._topic_prefixes: Dict[str, str] = {}  # {"shellies/<shelly_id>": device_id}
+        self._index_listeners: List[Callable[[], None]] = []
+        self._io_lock = asyncio.Lock()  # Serializes backend writes, compactions and reloads
+        self._needs_compaction = False
+        self._loaded = False
+        self._flush_interval = settings.DEVICES_FLUSH_INTERVAL
+        self._flush_threshold = settings.DEVICES_FLUSH_THRESHOLD
+        self._flush_event: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._watch_task: Optional[asyncio.Task] = None
+        self._watch_stop: Optional[asyncio.Event] = None
+
+    def _create_backend(self):
+        backend = settings.DEVICES_BACKEND.lower()
+        if backend == "sqlite":
+            from app.core.sqlite_backend import SQLiteDeviceBackend
+            return SQLiteDeviceBackend(import_file=self.file_path)
+        if backend != "json":
+            logger.warning(f"Unknown devices backend '{settings.DEVICES_BACKEND}', using json")
+        return JsonDeviceBackend(self.file_path)
+
+    def load(self) -> None:
+        """Load all devices from the backend into memory (done once at startup)"""
+        try:
+            self._devices = self.backend.load()
+        except Exception as e:
+            logger.error(f"Error loading devices: {e}")
+            self._devices = {}
+        self._rebuild_index()
+        self._pending.clear()
+        self._needs_compaction = False
+        self._loaded = True
+        logger.info(f"Loaded {len(self._devices)} devices into memory from {type(self.backend).__name__}")
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def _rebuild_index(self):
+        self._aliases.clear()
+        self._topic_prefixes.clear()
+        for device in self._devices.values():
+            self._index(device)
+        self._notify_index_change()
+
+    def add_index_listener(self, callback: Callable[[], None]) -> None:
+        """Call ``callback()`` whenever the set of devices or their Shelly IDs may have changed.
+
+        May be called from the I/O executor (initial load); callbacks must be thread-safe.
+        """
+        self._index_listeners.append(callback)
+
+    def _notify_index_change(self):
+        for callback in self._index_listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Device index listener failed: {e}")
+
+    def shelly_ids(self) -> List[str]:
+        """Shelly IDs of all known devices"""
+        self._ensure_loaded()
+        return list(self._aliases)
+
+    def _index(self, device: Dict[str, Any]):
+        device_id = device["device_id"]
+        shelly_id = device.get("shelly_id") or device_id
+        self._aliases[shelly_id] = device_id
+        self._topic_prefixes[f"{MQTT_TOPIC_PREFIX}/{shelly_id}"] = device_id
+
+    def _unindex(self, device: Dict[str, Any]):
+        shelly_id = device.get("shelly_id") or device["device_id"]
+        if self._aliases.get(shelly_id) == device["device_id"]:
+            del self._aliases[shelly_id]
+            self._topic_prefixes.pop(f"{MQTT_TOPIC_PREFIX}/{shelly_id}", None)
+
+    def resolve(self, key: str) -> Optional[str]:
+        """Resolve a device ID or Shelly ID to the device ID"""
+        self._ensure_loaded()
+        if key in self._devices:
+            return key
+        return self._aliases.get(key)
+
+    def resolve_topic(self, topic: str) -> Optional[str]:
+        """Resolve an MQTT topic such as ``shellies/<shelly_id>/...`` to the device ID"""
+        self._ensure_loaded()
+        first = topic.find("/")
+        second = topic.find("/", first + 1)
+        prefix = topic if second == -1 else topic[:second]
+        return self._topic_prefixes.get(prefix)
+
+    def _find(self, device_id: str) -> Optional[Dict[str, Any]]:
+        """Find a device record by device ID or Shelly ID"""
+        device = self._devices.get(device_id)
+        if device is None:
+            alias = self._aliases.get(device_id)
+            device = self._devices.get(alias) if alias else None
+        return device
+
+    def all(self) -> List[Dict[str, Any]]:
+        """Get a copy of all device records"""
+        self._ensure_loaded()
+        return [dict(d) for d in self._devices.values()]
+
+    def get(self, device_id: str) -> Optional[Dict[str, Any]]:
+        """Get a copy of a device record by device ID or Shelly ID"""
+        self._ensure_loaded()
+        device = self._find(device_id)
+        return dict(device) if device is not None else None
+
+    def put(self, device: Dict[str, Any]) -> None:
+        """Insert or replace a device record"""
+        self._ensure_loaded()
+        previous = self._devices.get(device["device_id"])
+        if previous is not None:
+            self._unindex(previous)
+        self._devices[device["device_id"]] = dict(device)
+        self._index(device)
+        if previous is None:
+            # Journal deltas only update known devices; a new one needs a snapshot
+            self._needs_compaction = True
+            self._request_flush(force=True)
+        else:
+            self._mark_dirty(device["device_id"], device)
+        self._notify_index_change()
+
+    def update(self, device_id: str, status_data: Dict[str, Any]) -> bool:
+        """Merge status data into a device record; returns False if not found"""
+        self._ensure_loaded()
+        device = self._find(device_id)
+        if device is None:
+            return False
+        if "shelly_id" in status_data:
+            self._unindex(device)
+            device.update(status_data)
+            self._index(device)
+            self._notify_index_change()
+        else:
+            device.update(status_data)
+        self._mark_dirty(device["device_id"], status_data)
+        return True
+
+    def replace_all(self, devices: List[Dict[str, Any]]) -> None:
+        """Replace every device record (used by bulk saves)"""
+        self._devices = {d["device_id"]: dict(d) for d in devices if d.get("device_id")}
+        self._rebuild_index()
+        self._loaded = True
+        # A full replacement can drop devices, which deltas cannot express
+        self._pending.clear()
+        self._needs_compaction = True
+        self._request_flush(force=True)
+
+    def _mark_dirty(self, device_id: str, delta: Dict[str, Any]):
+        self._pending.setdefault(device_id, {}).update(delta)
+        self._request_flush()
+
+    def _request_flush(self, force: bool = False):
+        if self._flush_task is None:
+            # No background writer (e.g. scripts, tests): persist immediately
+            self.flush()
+        elif force or len(self._pending) >= self._flush_threshold:
+            self._flush_event.set()
+
+    def flush(self) -> bool:
+        """Write pending deltas to the backend, compacting when it asks for it"""
+        if self._needs_compaction:
+            return self.compact()
+        if not self._pending:
+            return True
+
+        pending, self._pending = self._pending, {}
+        if not self.backend.write(pending, self._devices):
+            # Put the deltas back (newer changes win) so the next flush retries
+            for device_id, delta in pending.items():
+                self._pending[device_id] = {**delta, **self._pending.get(device_id, {})}
+            return False
+
+        logger.debug(f"Wrote {len(pending)} dirty devices")
+        if self.backend.should_compact():
+            return self.compact()
+        return True
+
+    def compact(self) -> bool:
+        """Rewrite the backend from the full in-memory state"""
+        if not self.backend.compact(self._devices):
+            self._needs_compaction = True
+            return False
+
+        # Everything pending is now part of the persisted state
+        self._pending.clear()
+        self._needs_compaction = False
+        return True
+
+    async def flush_async(self) -> bool:
+        """Like flush(), but runs the backend I/O in the I/O thread pool.
+
+        Pending deltas and the affected records are copied on the event loop,
+        so updates arriving while the write is in progress are never lost.
+        """
+        async with self._io_lock:
+            return await self._flush_locked()
+
+    async def _flush_locked(self) -> bool:
+        if self._needs_compaction:
+            return await self._compact_async()
+        if not self._pending:
+            return True
+
+        pending, self._pending = self._pending, {}
+        records = {device_id: dict(self._devices[device_id]) for device_id in pending if device_id in self._devices}
+        if not await run_io(self.backend.write, pending, records):
+            for device_id, delta in pending.items():
+                self._pending[device_id] = {**delta, **self._pending.get(device_id, {})}
+            return False
+
+        logger.debug(f"Wrote {len(pending)} dirty devices")
+        if self.backend.should_compact():
+            return await self._compact_async()
+        return True
+
+    async def _compact_async(self) -> bool:
+        snapshot = {device_id: dict(device) for device_id, device in self._devices.items()}
+        # Changes made from here on are not in the snapshot and stay pending
+        self._pending.clear()
+        self._needs_compaction = False
+        if not await run_io(self.backend.compact, snapshot):
+            self._needs_compaction = True
+            return False
+        return True
+
+    async def reload_async(self) -> None:
+        """Reload all devices from the backend, re-applying changes not yet written.
+
+        Pending changes for devices that the reloaded data no longer contains
+        are dropped.
+        """
+        async with self._io_lock:
+            # load() may compact the journal, so no write may run alongside it
+            devices = await run_io(self.backend.load)
+            dropped = [device_id for device_id in self._pending if device_id not in devices]
+            for device_id in dropped:
+                del self._pending[device_id]
+            if dropped:
+                logger.warning(f"Dropped pending changes for devices removed externally: {dropped}")
+            for device_id, delta in self._pending.items():
+                devices[device_id].update(delta)
+            self._devices = devices
+            self._rebuild_index()
+        logger.info(f"Reloaded {len(self._devices)} devices from {type(self.backend).__name__}")
+
+    async def start(self):
+        """Start the background write-behind task and the file watcher"""
+        self._ensure_loaded()
+        if self._flush_task is None:
+            self._stopping = False
+            self._flush_event = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+            logger.info(
+                f"Device store flusher started (interval={self._flush_interval}s, "
+                f"threshold={self._flush_threshold})"
+            )
+        if settings.DEVICES_WATCH and self._watch_task is None and hasattr(self.backend, "watch_path"):
+            self._watch_stop = asyncio.Event()
+            self._watch_task = asyncio.create_task(self._watch_loop())
+
+    async def stop(self):
+        """Stop the background tasks and persist any pending changes"""
+        if self._watch_task is not None:
+            self._watch_stop.set()
+            await self._watch_task
+            self._watch_task = None
+            self._watch_stop = None
+        if self._flush_task is not None:
+            # Let an in-progress write finish instead of cancelling it mid-way
+            self._stopping = True
+            self._flush_event.set()
+            await self._flush_task
+            self._flush_task = None
+            self._flush_event = None
+        await self.flush_async()
+        await run_io(self.backend.close, self._devices)
+        logger.info("Device store stopped")
+
+    async def _flush_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            if self._stopping:
+                break
+            try:
+                await self.flush_async()
+            except Exception as e:
+                logger.error(f"Error flushing device store: {e}")
+
+    async def _watch_loop(self):
+        try:
+            from watchfiles import awatch
+        except ImportError:
+            logger.warning("watchfiles not installed, external edits to the devices file will not be picked up")
+            return
+
+        path = os.path.abspath(self.backend.watch_path)
+        logger.info(f"Watching {path} for external changes")
+        try:
+            async for _ in awatch(
+                os.path.dirname(path),
+                stop_event=self._watch_stop,
+                watch_filter=lambda change, changed_path: os.path.abspath(changed_path) == path,
+            ):
+                # Our own snapshot writes also trigger events; only reload on foreign edits
+                if self.backend.changed_externally():
+                    logger.info(f"{path} changed externally, reloading devices")
+                    await self.reload_async()
+        except Exception as e:
+            logger.error(f"Error watching devices file: {e}")
+
+# Create a singleton instance
+device_store = DeviceStore()
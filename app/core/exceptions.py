@@ -0,0 +1,20 @@
+# app/core/exceptions.py
+
+class QueueFullError(Exception):
+    """A command was rejected because a command queue is at its depth limit"""
+
+    def __init__(self, device_id: str, depth: int, limit: int, retry_after: float, scope: str = "device"):
+        self.device_id = device_id
+        self.depth = depth
+        self.limit = limit
+        self.retry_after = retry_after
+        self.scope = scope  # "device" or "global"
+        super().__init__(f"Command queue full for {device_id} ({scope} limit {limit}, depth {depth})")
+
+class ScheduleTooFarError(Exception):
+    """A bulk command was scheduled further ahead than COMMAND_FAN_OUT_MAX_DELAY allows"""
+
+    def __init__(self, at: float, max_delay: float):
+        self.at = at
+        self.max_delay = max_delay
+        super().__init__(f"'at' must be at most {max_delay:g}s in the future")
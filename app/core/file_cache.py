@@ -0,0 +1,55 @@
+# app/core/file_cache.py
+import json
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+FileSignature = Tuple[int, int, int]  # (st_mtime_ns, st_size, st_ino)
+
+def file_signature(path: str) -> Optional[FileSignature]:
+    """Get the (mtime, size, inode) signature of a file, or None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+class JsonFileCache:
+    """Parse cache for JSON files, invalidated only when the file actually changes.
+
+    Cached structures are shared between callers and must be treated as
+    read-only; copy before mutating.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[FileSignature, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def read(self, path: str) -> Any:
+        """Get the parsed contents of ``path``, re-parsing only if its signature changed"""
+        signature = file_signature(path)
+        if signature is None:
+            self._entries.pop(path, None)
+            raise FileNotFoundError(path)
+
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == signature:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        with open(path, 'r') as f:
+            data = json.load(f)
+        # Re-stat after reading so a write racing with the read is not cached as current
+        if file_signature(path) == signature:
+            self._entries[path] = (signature, data)
+        return data
+
+    def invalidate(self, path: str) -> None:
+        self._entries.pop(path, None)
+
+# Create a singleton instance
+json_file_cache = JsonFileCache()
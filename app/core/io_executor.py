@@ -0,0 +1,113 @@
+# app/core/io_executor.py
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Bounded pool for blocking file and SQLite I/O so it never runs on the event loop
+_executor = ThreadPoolExecutor(max_workers=settings.IO_EXECUTOR_WORKERS, thread_name_prefix="io")
+
+_io_stats = {
+    "submitted": 0,
+    "completed": 0,
+    "failed": 0,
+    "in_flight": 0,
+    "total_time": 0.0,
+    "max_time": 0.0,
+}
+
+async def run_io(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking function in the I/O thread pool and await its result"""
+    loop = asyncio.get_running_loop()
+    _io_stats["submitted"] += 1
+    _io_stats["in_flight"] += 1
+    started = time.perf_counter()
+    try:
+        result = await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+        _io_stats["completed"] += 1
+        return result
+    except Exception:
+        _io_stats["failed"] += 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        _io_stats["in_flight"] -= 1
+        _io_stats["total_time"] += elapsed
+        _io_stats["max_time"] = max(_io_stats["max_time"], elapsed)
+
+def get_io_stats() -> Dict[str, Any]:
+    """Get I/O executor counters"""
+    finished = _io_stats["completed"] + _io_stats["failed"]
+    return {
+        "workers": settings.IO_EXECUTOR_WORKERS,
+        "submitted": _io_stats["submitted"],
+        "completed": _io_stats["completed"],
+        "failed": _io_stats["failed"],
+        "in_flight": _io_stats["in_flight"],
+        "avg_ms": round(_io_stats["total_time"] / finished * 1000, 3) if finished else 0.0,
+        "max_ms": round(_io_stats["max_time"] * 1000, 3),
+    }
+
+def shutdown_io_executor():
+    """Wait for pending I/O and stop the thread pool"""
+    _executor.shutdown(wait=True)
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a fixed-interval sleep"""
+
+    def __init__(self, interval: float = None, window: int = 240):
+        self._interval = interval or settings.LOOP_LAG_INTERVAL
+        self._samples = deque(maxlen=window)
+        self._max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Event loop lag monitor started (interval={self._interval}s)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self._interval
+            await asyncio.sleep(self._interval)
+            lag = max(0.0, loop.time() - expected)
+            self._samples.append(lag)
+            self._max_lag = max(self._max_lag, lag)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get loop lag statistics in milliseconds over the recent window"""
+        samples = sorted(self._samples)
+        if not samples:
+            return {"samples": 0}
+
+        def percentile(p: float) -> float:
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3)
+
+        return {
+            "samples": len(samples),
+            "last_ms": round(self._samples[-1] * 1000, 3),
+            "p50_ms": percentile(0.50),
+            "p99_ms": percentile(0.99),
+            "window_max_ms": round(samples[-1] * 1000, 3),
+            "max_ms": round(self._max_lag * 1000, 3),
+        }
+
+# Create a singleton instance
+loop_lag_monitor = LoopLagMonitor()
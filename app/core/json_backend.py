@@ -0,0 +1,90 @@
+# app/core/json_backend.py
+import json
+import logging
+import os
+from typing import Dict, Any
+
+from app.core.config import settings
+from app.core.device_journal import DeviceJournal
+from app.core.file_cache import file_signature, json_file_cache
+
+logger = logging.getLogger(__name__)
+
+class JsonDeviceBackend:
+    """Device persistence as a JSON snapshot plus an append-only delta journal"""
+
+    def __init__(self, file_path: str, journal_path: str = None):
+        self.file_path = file_path
+        self.journal = DeviceJournal(
+            journal_path or settings.DEVICES_JOURNAL_FILE or f"{os.path.splitext(file_path)[0]}.journal",
+            fsync=settings.DEVICES_JOURNAL_FSYNC,
+        )
+        self._compact_threshold = settings.DEVICES_COMPACT_THRESHOLD
+        # Signature of the snapshot as last read or written by us
+        self.last_signature = None
+
+    @property
+    def watch_path(self) -> str:
+        """File whose external modification should trigger a reload"""
+        return self.file_path
+
+    def changed_externally(self) -> bool:
+        """Check whether the snapshot was modified by someone else since we last touched it"""
+        return file_signature(self.file_path) != self.last_signature
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Load the snapshot and replay the journal on top of it"""
+        devices = []
+        try:
+            if os.path.exists(self.file_path):
+                devices = json_file_cache.read(self.file_path)
+                self.last_signature = file_signature(self.file_path)
+            else:
+                # Create empty file if it doesn't exist
+                with open(self.file_path, 'w') as f:
+                    json.dump([], f)
+                self.last_signature = file_signature(self.file_path)
+        except Exception as e:
+            logger.error(f"Error loading devices: {e}")
+
+        # Copy the records: the parsed list is shared through the file cache
+        records = {d["device_id"]: dict(d) for d in devices if d.get("device_id")}
+        try:
+            replayed = self.journal.replay(records)
+        except Exception as e:
+            logger.error(f"Error replaying device journal: {e}")
+            replayed = 0
+        if replayed:
+            # Fold the replayed entries into a fresh snapshot right away
+            self.compact(records)
+        return records
+
+    def write(self, pending: Dict[str, Dict[str, Any]], devices: Dict[str, Dict[str, Any]]) -> bool:
+        """Append the changed fields of each dirty device to the journal"""
+        return self.journal.append(pending)
+
+    def should_compact(self) -> bool:
+        return self.journal.entries >= self._compact_threshold
+
+    def compact(self, devices: Dict[str, Dict[str, Any]]) -> bool:
+        """Write a full snapshot of all devices and truncate the journal"""
+        tmp_path = f"{self.file_path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(list(devices.values()), f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+            self.last_signature = file_signature(self.file_path)
+        except Exception as e:
+            logger.error(f"Error saving devices snapshot: {e}")
+            return False
+
+        self.journal.truncate()
+        logger.debug(f"Compacted {len(devices)} devices into {self.file_path}")
+        return True
+
+    def close(self, devices: Dict[str, Dict[str, Any]]) -> None:
+        """Leave a compacted snapshot behind on shutdown"""
+        if self.journal.entries:
+            self.compact(devices)
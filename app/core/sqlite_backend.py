@@ -0,0 +1,92 @@
+# app/core/sqlite_backend.py
+import json
+import logging
+import os
+from typing import Dict, Any
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.schemas.database import DeviceModel, engine, init_db
+
+logger = logging.getLogger(__name__)
+
+# Columns that map one-to-one onto device record fields
+DEVICE_COLUMNS = [
+    column.name for column in DeviceModel.__table__.columns
+    if column.name not in ("id", "extra")
+]
+
+def _to_row(device: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a device record into a table row"""
+    row = {column: device.get(column) for column in DEVICE_COLUMNS}
+    extra = {key: value for key, value in device.items() if key not in row}
+    row["extra"] = json.dumps(extra) if extra else None
+    return row
+
+def _from_row(row) -> Dict[str, Any]:
+    """Convert a table row back into a device record"""
+    device = {column: getattr(row, column) for column in DEVICE_COLUMNS if getattr(row, column) is not None}
+    if row.extra:
+        device.update(json.loads(row.extra))
+    return device
+
+class SQLiteDeviceBackend:
+    """Device persistence in the ``devices`` table of smart_home.db (WAL mode)"""
+
+    def __init__(self, import_file: str = None):
+        # JSON file to seed the table from when it is empty
+        self.import_file = import_file
+        self._upsert = sqlite_insert(DeviceModel)
+        self._upsert = self._upsert.on_conflict_do_update(
+            index_elements=[DeviceModel.device_id],
+            set_={column: self._upsert.excluded[column] for column in DEVICE_COLUMNS + ["extra"]},
+        )
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Load every device row"""
+        init_db()
+        with engine.connect() as conn:
+            rows = conn.execute(select(DeviceModel.__table__)).fetchall()
+        devices = {row.device_id: _from_row(row) for row in rows if row.device_id}
+
+        if not devices and self.import_file and os.path.exists(self.import_file):
+            try:
+                with open(self.import_file, 'r') as f:
+                    devices = {d["device_id"]: d for d in json.load(f) if d.get("device_id")}
+                self.write(devices, devices)
+                logger.info(f"Imported {len(devices)} devices from {self.import_file} into SQLite")
+            except Exception as e:
+                logger.error(f"Error importing devices from {self.import_file}: {e}")
+        return devices
+
+    def write(self, pending: Dict[str, Dict[str, Any]], devices: Dict[str, Dict[str, Any]]) -> bool:
+        """Upsert every dirty device in a single transaction"""
+        rows = [_to_row(devices[device_id]) for device_id in pending if device_id in devices]
+        if not rows:
+            return True
+        try:
+            with engine.begin() as conn:
+                conn.execute(self._upsert, rows)
+            return True
+        except Exception as e:
+            logger.error(f"Error writing devices to SQLite: {e}")
+            return False
+
+    def should_compact(self) -> bool:
+        return False
+
+    def compact(self, devices: Dict[str, Dict[str, Any]]) -> bool:
+        """Make the table match ``devices`` exactly"""
+        try:
+            with engine.begin() as conn:
+                conn.execute(delete(DeviceModel).where(DeviceModel.device_id.not_in(list(devices.keys()))))
+                if devices:
+                    conn.execute(self._upsert, [_to_row(device) for device in devices.values()])
+            return True
+        except Exception as e:
+            logger.error(f"Error replacing devices in SQLite: {e}")
+            return False
+
+    def close(self, devices: Dict[str, Dict[str, Any]]) -> None:
+        engine.dispose()
@@ -0,0 +1,114 @@
+# app/core/topic_trie.py
+from typing import Any, Dict, List, Optional
+
+class _Node:
+    __slots__ = ("children", "handlers", "multi")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}  # Literal levels and "+"
+        self.handlers: List[Any] = []  # Handlers whose filter ends at this node
+        self.multi: List[Any] = []  # Handlers whose filter ends with "#" below this node
+
+class TopicTrie:
+    """MQTT topic filters (with ``+`` and ``#`` wildcards) mapped to handlers.
+
+    Matching walks one level per topic segment, so its cost depends on the
+    topic depth rather than on the number of registered filters. Results are
+    memoized per concrete topic, since devices keep publishing on the same
+    topics; the cache is cleared whenever a filter is added or removed.
+    """
+
+    def __init__(self, cache_size: int = 4096):
+        self._root = _Node()
+        self._cache: Dict[str, List[Any]] = {}
+        self._cache_size = cache_size
+
+    @staticmethod
+    def _validate(topic_filter: str) -> List[str]:
+        levels = topic_filter.split("/")
+        for i, level in enumerate(levels):
+            if "#" in level and (level != "#" or i != len(levels) - 1):
+                raise ValueError(f"'#' must be the last level of a topic filter: {topic_filter}")
+            if "+" in level and level != "+":
+                raise ValueError(f"'+' must occupy a whole level of a topic filter: {topic_filter}")
+        return levels
+
+    def add(self, topic_filter: str, handler: Any) -> None:
+        """Register ``handler`` for every topic matching ``topic_filter``"""
+        levels = self._validate(topic_filter)
+        node = self._root
+        for level in levels:
+            if level == "#":
+                node.multi.append(handler)
+                break
+            node = node.children.setdefault(level, _Node())
+        else:
+            node.handlers.append(handler)
+        self._cache.clear()
+
+    def remove(self, topic_filter: str, handler: Any) -> bool:
+        """Unregister a handler; returns False if it was not registered for this filter"""
+        node: Optional[_Node] = self._root
+        levels = self._validate(topic_filter)
+        for level in levels:
+            if level == "#":
+                break
+            node = node.children.get(level)
+            if node is None:
+                return False
+        handlers = node.multi if levels[-1] == "#" else node.handlers
+        if handler not in handlers:
+            return False
+        handlers.remove(handler)
+        self._cache.clear()
+        return True
+
+    def filters(self) -> List[str]:
+        """Topic filters that have at least one handler"""
+        found = []
+
+        def walk(node: _Node, levels: List[str]):
+            if node.handlers:
+                found.append("/".join(levels))
+            if node.multi:
+                found.append("/".join(levels + ["#"]))
+            for level, child in node.children.items():
+                walk(child, levels + [level])
+
+        walk(self._root, [])
+        return found
+
+    def match(self, topic: str) -> List[Any]:
+        """Handlers whose filter matches ``topic``"""
+        handlers = self._cache.get(topic)
+        if handlers is not None:
+            return handlers
+
+        handlers = []
+        # "#" also matches the parent level itself ("a/#" matches "a")
+        nodes = [self._root]
+        levels = topic.split("/")
+        for depth, level in enumerate(levels):
+            next_nodes = []
+            for node in nodes:
+                # Wildcards do not match topics starting with "$" at the first level
+                if node.multi and not (depth == 0 and level.startswith("$")):
+                    handlers.extend(node.multi)
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+                child = node.children.get("+")
+                if child is not None and not (depth == 0 and level.startswith("$")):
+                    next_nodes.append(child)
+            nodes = next_nodes
+            if not nodes:
+                break
+        else:
+            for node in nodes:
+                handlers.extend(node.handlers)
+                handlers.extend(node.multi)
+
+        if len(self._cache) >= self._cache_size:
+            self._cache.clear()
+        self._cache[topic] = handlers
+        return handlers
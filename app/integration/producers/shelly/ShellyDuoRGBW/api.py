@@ -2,7 +2,6 @@ from fastapi import APIRouter, HTTPException, Depends
 from typing import List, Dict, Any
 import logging
 
-from app.services.mqtt_service import mqtt_client  
 from app.integration.registry import device_registry
 from app.integration.producers.shelly.ShellyDuoRGBW.schemas import (
     ColorBulbStatus, 
@@ -16,12 +15,14 @@ from app.integration.producers.shelly.ShellyDuoRGBW.schemas import (
     BulkWhitePayload,
     WhitePayload
 )
-from app.core.devices_manager import update_device_status
+from app.core.exceptions import QueueFullError, ScheduleTooFarError
+from app.repositories.device_repository import device_repository
 from app.integration.producers.shelly.ShellyDuoRGBW.device import (
     getStatus, 
     turn_off, 
     turn_on, 
-    load_devices, 
+    turn_on_multiple,
+    turn_off_multiple,
     set_color,
     set_color_multiple,
     set_white,    
@@ -35,10 +36,21 @@ router = APIRouter()
 router = APIRouter(tags=["shelly", "duorgbw"])
 logger = logging.getLogger(__name__)
 
+def queue_full(e: QueueFullError) -> HTTPException:
+    """429 telling the client when the device's command queue should have room again"""
+    return HTTPException(
+        status_code=429,
+        detail=f"Too many pending commands for device {e.device_id}, retry later",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+def schedule_too_far(e: ScheduleTooFarError) -> HTTPException:
+    """400 for a bulk command scheduled beyond COMMAND_FAN_OUT_MAX_DELAY"""
+    return HTTPException(status_code=400, detail=str(e))
+
 async def get_bulb_duo(device_id: str) -> str:
     """Get device ID if it exists"""
-    devices = load_devices()
-    device = next((d for d in devices if d["device_id"] == device_id), None)
+    device = await device_repository.get(device_id)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
     return device_id
@@ -68,7 +80,7 @@ async def get_all_devices_status():
     
     # If no devices in registry, try loading from JSON
     if not shelly_devices:
-        devices = load_devices()
+        devices = await device_repository.get_all()
         shelly_devices = [
             device for device in devices
             if device.get("manufacturer", "shelly") == "shelly"
@@ -77,91 +89,80 @@ async def get_all_devices_status():
     return shelly_devices
 
 @router.post("/{device_id}/turn_on")
-async def turn_on_bulb_duo(device_id: str):
-    """Turn on a device"""
+async def turn_on_bulb_duo(device_id: str, wait_for_ack: bool = False):
+    """Turn on a device (with wait_for_ack, only succeed once the device reports it is on)"""
     try:
         # Just make sure device exists
         _ = await get_bulb_duo(device_id)
         
         # Use the function directly with error handling
-        success = await turn_on(device_id)
+        success = await turn_on(device_id, wait_for_ack)
         
         if not success:
-            raise HTTPException(status_code=500, detail=f"Failed to turn on device {device_id}")
+            raise HTTPException(status_code=504 if wait_for_ack else 500, detail=f"Failed to turn on device {device_id}")
             
         return {"message": f"Device {device_id} turned on successfully"}
     except HTTPException:
         raise
+    except QueueFullError as e:
+        raise queue_full(e)
     except Exception as e:
         logger.error(f"Error turning on device {device_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/{device_id}/turn_off")
-async def turn_off_bulb_duo(device_id: str):
-    """Turn off a device"""
+async def turn_off_bulb_duo(device_id: str, wait_for_ack: bool = False):
+    """Turn off a device (with wait_for_ack, only succeed once the device reports it is off)"""
     try:
         # Just make sure device exists
         _ = await get_bulb_duo(device_id)
         
         # Use the function directly with error handling
-        success = await turn_off(device_id)
+        success = await turn_off(device_id, wait_for_ack)
         
         if not success:
-            raise HTTPException(status_code=500, detail=f"Failed to turn off device {device_id}")
+            raise HTTPException(status_code=504 if wait_for_ack else 500, detail=f"Failed to turn off device {device_id}")
             
         return {"message": f"Device {device_id} turned off successfully"}
     except HTTPException:
         raise
+    except QueueFullError as e:
+        raise queue_full(e)
     except Exception as e:
         logger.error(f"Error turning off device {device_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     
 @router.post("/on_multiple")
-async def turn_on_multiple_bulb_duo(payload: DeviceIDs):
+async def turn_on_multiple_bulb_duo(payload: DeviceIDs, wait_for_ack: bool = False):
     """Turn on multiple devices at once"""
     try:
         results = []
         success_count = 0
         failure_count = 0
         
-        # Process each device ID
+        # Publish to all devices in one burst (missing devices are reported as failed)
+        devices = await device_repository.get_many(payload.device_ids)
+        results_dict = await turn_on_multiple(payload.device_ids, at=payload.at, wait_for_ack=wait_for_ack)
+        
         for device_id in payload.device_ids:
-            try:
-                # Verify device exists
-                try:
-                    _ = await get_bulb_duo(device_id)
-                except HTTPException:
-                    results.append({
-                        "device_id": device_id,
-                        "success": False,
-                        "error": "Device not found"
-                    })
-                    failure_count += 1
-                    continue
-                
-                # Turn on the device
-                device_success = await turn_on(device_id)
-                
-                if device_success:
-                    results.append({
-                        "device_id": device_id,
-                        "success": True
-                    })
-                    success_count += 1
-                else:
-                    results.append({
-                        "device_id": device_id,
-                        "success": False,
-                        "error": "Failed to turn on device"
-                    })
-                    failure_count += 1
-            
-            except Exception as e:
-                logger.error(f"Error processing device {device_id}: {e}")
+            if not devices.get(device_id):
                 results.append({
                     "device_id": device_id,
                     "success": False,
-                    "error": str(e)
+                    "error": "Device not found"
+                })
+                failure_count += 1
+            elif results_dict.get(device_id):
+                results.append({
+                    "device_id": device_id,
+                    "success": True
+                })
+                success_count += 1
+            else:
+                results.append({
+                    "device_id": device_id,
+                    "success": False,
+                    "error": "Failed to turn on device"
                 })
                 failure_count += 1
         
@@ -173,56 +174,47 @@ async def turn_on_multiple_bulb_duo(payload: DeviceIDs):
             "results": results
         }
         
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise queue_full(e)
+    except ScheduleTooFarError as e:
+        raise schedule_too_far(e)
     except Exception as e:
         logger.error(f"Error in turn_on_multiple_bulb_duo: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/off_multiple")
-async def turn_off_multiple_bulb_duo(payload: DeviceIDs):
+async def turn_off_multiple_bulb_duo(payload: DeviceIDs, wait_for_ack: bool = False):
     """Turn off multiple devices at once"""
     try:
         results = []
         success_count = 0
         failure_count = 0
         
-        # Process each device ID
+        # Publish to all devices in one burst (missing devices are reported as failed)
+        devices = await device_repository.get_many(payload.device_ids)
+        results_dict = await turn_off_multiple(payload.device_ids, at=payload.at, wait_for_ack=wait_for_ack)
+        
         for device_id in payload.device_ids:
-            try:
-                # Verify device exists
-                try:
-                    _ = await get_bulb_duo(device_id)
-                except HTTPException:
-                    results.append({
-                        "device_id": device_id,
-                        "success": False,
-                        "error": "Device not found"
-                    })
-                    failure_count += 1
-                    continue
-                
-                # Turn off the device
-                device_success = await turn_off(device_id)
-                
-                if device_success:
-                    results.append({
-                        "device_id": device_id,
-                        "success": True
-                    })
-                    success_count += 1
-                else:
-                    results.append({
-                        "device_id": device_id,
-                        "success": False,
-                        "error": "Failed to turn off device"
-                    })
-                    failure_count += 1
-            
-            except Exception as e:
-                logger.error(f"Error processing device {device_id}: {e}")
+            if not devices.get(device_id):
+                results.append({
+                    "device_id": device_id,
+                    "success": False,
+                    "error": "Device not found"
+                })
+                failure_count += 1
+            elif results_dict.get(device_id):
+                results.append({
+                    "device_id": device_id,
+                    "success": True
+                })
+                success_count += 1
+            else:
                 results.append({
                     "device_id": device_id,
                     "success": False,
-                    "error": str(e)
+                    "error": "Failed to turn off device"
                 })
                 failure_count += 1
         
@@ -234,12 +226,18 @@ async def turn_off_multiple_bulb_duo(payload: DeviceIDs):
             "results": results
         }
         
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise queue_full(e)
+    except ScheduleTooFarError as e:
+        raise schedule_too_far(e)
     except Exception as e:
         logger.error(f"Error in turn_off_multiple_bulb_duo: {e}")
-        raise HTTPException(status_code=500, detail=str(e))   
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/{device_id}/color")
-async def set_device_color(device_id: str, payload: ColorPayload):
+async def set_device_color(device_id: str, payload: ColorPayload, wait_for_ack: bool = False):
     """Set the color of a device"""
     try:
         # Just make sure device exists
@@ -252,21 +250,24 @@ async def set_device_color(device_id: str, payload: ColorPayload):
             payload.green, 
             payload.blue, 
             payload.gain,
-            payload.white
+            payload.white,
+            wait_for_ack=wait_for_ack
         )
             
         if not success:
-            raise HTTPException(status_code=500, detail=f"Failed to set color for device {device_id}")
+            raise HTTPException(status_code=504 if wait_for_ack else 500, detail=f"Failed to set color for device {device_id}")
             
         return {"message": f"Color set for device {device_id}"}
     except HTTPException:
         raise
+    except QueueFullError as e:
+        raise queue_full(e)
     except Exception as e:
         logger.error(f"Error setting color for device {device_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     
 @router.post("/{device_id}/white")
-async def set_device_white(device_id: str, payload: WhitePayload):
+async def set_device_white(device_id: str, payload: WhitePayload, wait_for_ack: bool = False):
     """Set the white level of a device"""
     try:
         # Just make sure device exists
@@ -281,21 +282,24 @@ async def set_device_white(device_id: str, payload: WhitePayload):
             payload.green,
             payload.blue,  
             payload.brightness,
-            payload.temp
+            payload.temp,
+            wait_for_ack=wait_for_ack
         )
             
         if not success:
-            raise HTTPException(status_code=500, detail=f"Failed to set white level for device {device_id}")
+            raise HTTPException(status_code=504 if wait_for_ack else 500, detail=f"Failed to set white level for device {device_id}")
             
         return {"message": f"White level set for device {device_id}"}
     except HTTPException:
         raise
+    except QueueFullError as e:
+        raise queue_full(e)
     except Exception as e:
         logger.error(f"Error setting white level for device {device_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/white_multiple")
-async def set_white_multiple_bulb_duo(payload: BulkWhitePayload):
+async def set_white_multiple_bulb_duo(payload: BulkWhitePayload, wait_for_ack: bool = False):
     """Set the white level for multiple devices at once"""
     try:
         # Extract white values from payload
@@ -307,21 +311,15 @@ async def set_white_multiple_bulb_duo(payload: BulkWhitePayload):
         brightness = payload.brightness
         temp = payload.temp
         
-        # Validate that devices exist
-        valid_device_ids = []
-        for device_id in payload.device_ids:
-            try:
-                _ = await get_bulb_duo(device_id)
-                valid_device_ids.append(device_id)
-            except HTTPException:
-                # Skip invalid devices
-                continue
+        # Validate that devices exist with one batched lookup
+        devices = await device_repository.get_many(payload.device_ids)
+        valid_device_ids = [device_id for device_id, device in devices.items() if device]
         
         if not valid_device_ids:
             raise HTTPException(status_code=404, detail="No valid devices found")
         
         # Use the bulk operation
-        results_dict = await set_white_multiple(valid_device_ids, white, gain, red, green, blue, brightness, temp)
+        results_dict = await set_white_multiple(valid_device_ids, white, gain, red, green, blue, brightness, temp, at=payload.at, wait_for_ack=wait_for_ack)
             
         # Format results
         results = [
@@ -362,12 +360,18 @@ async def set_white_multiple_bulb_duo(payload: BulkWhitePayload):
             "results": results
         }
         
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise queue_full(e)
+    except ScheduleTooFarError as e:
+        raise schedule_too_far(e)
     except Exception as e:
         logger.error(f"Error in set_white_multiple_bulb_duo: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     
 @router.post("/{device_id}/temperature")
-async def set_device_temperature(device_id: str, payload: TemperaturePayload):
+async def set_device_temperature(device_id: str, payload: TemperaturePayload, wait_for_ack: bool = False):
     """Set the color temperature of a device"""
     try:
         # Just make sure device exists
@@ -376,41 +380,38 @@ async def set_device_temperature(device_id: str, payload: TemperaturePayload):
         # Use the imported set_temperature function from device.py
         success = await set_temperature(
             device_id, 
-            payload.temperature
+            payload.temp,
+            wait_for_ack=wait_for_ack
         )
             
         if not success:
-            raise HTTPException(status_code=500, detail=f"Failed to set temperature for device {device_id}")
+            raise HTTPException(status_code=504 if wait_for_ack else 500, detail=f"Failed to set temperature for device {device_id}")
             
-        return {"message": f"Temperature set to {payload.temperature}K for device {device_id}"}
+        return {"message": f"Temperature set to {payload.temp}K for device {device_id}"}
     except HTTPException:
         raise
+    except QueueFullError as e:
+        raise queue_full(e)
     except Exception as e:
         logger.error(f"Error setting temperature for device {device_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/temperature_multiple")
-async def set_temperature_multiple_bulb_duo(payload: BulkTemperaturePayload):
+async def set_temperature_multiple_bulb_duo(payload: BulkTemperaturePayload, wait_for_ack: bool = False):
     """Set the color temperature for multiple devices at once"""
     try:
         # Extract temperature value from payload
-        temperature = payload.temperature
+        temperature = payload.temp
         
-        # Validate that devices exist
-        valid_device_ids = []
-        for device_id in payload.device_ids:
-            try:
-                _ = await get_bulb_duo(device_id)
-                valid_device_ids.append(device_id)
-            except HTTPException:
-                # Skip invalid devices
-                continue
+        # Validate that devices exist with one batched lookup
+        devices = await device_repository.get_many(payload.device_ids)
+        valid_device_ids = [device_id for device_id, device in devices.items() if device]
         
         if not valid_device_ids:
             raise HTTPException(status_code=404, detail="No valid devices found")
         
         # Use the bulk operation
-        results_dict = await set_temperature_multiple(valid_device_ids, temperature)
+        results_dict = await set_temperature_multiple(valid_device_ids, temperature, at=payload.at, wait_for_ack=wait_for_ack)
             
         # Format results
         results = [
@@ -434,12 +435,18 @@ async def set_temperature_multiple_bulb_duo(payload: BulkTemperaturePayload):
             "results": results
         }
         
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise queue_full(e)
+    except ScheduleTooFarError as e:
+        raise schedule_too_far(e)
     except Exception as e:
         logger.error(f"Error in set_temperature_multiple_bulb_duo: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/{device_id}/brightness")
-async def set_device_brightness(device_id: str, payload: BrightnessPayload):
+async def set_device_brightness(device_id: str, payload: BrightnessPayload, wait_for_ack: bool = False):
     """Set the brightness of a device"""
     try:
         # Just make sure device exists
@@ -448,41 +455,38 @@ async def set_device_brightness(device_id: str, payload: BrightnessPayload):
         # Use the imported set_brightness function from device.py
         success = await set_brightness(
             device_id, 
-            payload.brightness
+            payload.brightness,
+            wait_for_ack=wait_for_ack
         )
             
         if not success:
-            raise HTTPException(status_code=500, detail=f"Failed to set brightness for device {device_id}")
+            raise HTTPException(status_code=504 if wait_for_ack else 500, detail=f"Failed to set brightness for device {device_id}")
             
         return {"message": f"Brightness set to {payload.brightness}% for device {device_id}"}
     except HTTPException:
         raise
+    except QueueFullError as e:
+        raise queue_full(e)
     except Exception as e:
         logger.error(f"Error setting brightness for device {device_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/brightness_multiple")
-async def set_brightness_multiple_bulb_duo(payload: BulkBrightnessPayload):
+async def set_brightness_multiple_bulb_duo(payload: BulkBrightnessPayload, wait_for_ack: bool = False):
     """Set the brightness for multiple devices at once"""
     try:
         # Extract brightness value from payload
         brightness = payload.brightness
         
-        # Validate that devices exist
-        valid_device_ids = []
-        for device_id in payload.device_ids:
-            try:
-                _ = await get_bulb_duo(device_id)
-                valid_device_ids.append(device_id)
-            except HTTPException:
-                # Skip invalid devices
-                continue
+        # Validate that devices exist with one batched lookup
+        devices = await device_repository.get_many(payload.device_ids)
+        valid_device_ids = [device_id for device_id, device in devices.items() if device]
         
         if not valid_device_ids:
             raise HTTPException(status_code=404, detail="No valid devices found")
         
         # Use the bulk operation
-        results_dict = await set_brightness_multiple(valid_device_ids, brightness)
+        results_dict = await set_brightness_multiple(valid_device_ids, brightness, at=payload.at, wait_for_ack=wait_for_ack)
             
         # Format results
         results = [
@@ -506,12 +510,18 @@ async def set_brightness_multiple_bulb_duo(payload: BulkBrightnessPayload):
             "results": results
         }
         
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise queue_full(e)
+    except ScheduleTooFarError as e:
+        raise schedule_too_far(e)
     except Exception as e:
         logger.error(f"Error in set_brightness_multiple_bulb_duo: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/color_multiple")
-async def set_color_multiple_bulb_duo(payload: BulkColorPayload):
+async def set_color_multiple_bulb_duo(payload: BulkColorPayload, wait_for_ack: bool = False):
     """Set the same color for multiple devices at once"""
     try:
         # Extract color values
@@ -521,22 +531,16 @@ async def set_color_multiple_bulb_duo(payload: BulkColorPayload):
         gain = payload.gain
         white = payload.white
         
-        # Validate that devices exist
-        valid_device_ids = []
-        for device_id in payload.device_ids:
-            try:
-                _ = await get_bulb_duo(device_id)
-                valid_device_ids.append(device_id)
-            except HTTPException:
-                # Skip invalid devices
-                continue
+        # Validate that devices exist with one batched lookup
+        devices = await device_repository.get_many(payload.device_ids)
+        valid_device_ids = [device_id for device_id, device in devices.items() if device]
         
         if not valid_device_ids:
             raise HTTPException(status_code=404, detail="No valid devices found")
         
         # Use the bulk operation if available
         if 'set_color_multiple' in globals():
-            results_dict = await set_color_multiple(valid_device_ids, red, green, blue, gain, white)
+            results_dict = await set_color_multiple(valid_device_ids, red, green, blue, gain, white, at=payload.at, wait_for_ack=wait_for_ack)
             
             # Format results
             results = [
@@ -611,6 +615,12 @@ async def set_color_multiple_bulb_duo(payload: BulkColorPayload):
             "results": results
         }
         
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        raise queue_full(e)
+    except ScheduleTooFarError as e:
+        raise schedule_too_far(e)
     except Exception as e:
         logger.error(f"Error in set_color_multiple_bulb_duo: {e}")
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
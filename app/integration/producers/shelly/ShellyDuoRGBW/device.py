@@ -1,10 +1,14 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Callable, Optional, Tuple
+import asyncio
+import functools
 import logging
 from app.integration.base_device import BaseDevice
 import paho.mqtt.client as mqtt
 from app.services.mqtt_service import mqtt_service
-from app.services.command_queue_service import command_queue
-from app.core.devices_manager import load_devices, update_device_status
+from app.services.command_queue_service import command_queue, CommandLane
+from app.repositories.device_repository import device_repository
+from app.services.ack_tracker import ack_tracker
+from app.integration.producers.shelly.common import get_command_topic, get_set_topic
 import json
 
 
@@ -58,12 +62,42 @@ class ShellyColorBulb(BaseDevice):
         
     # Add other required methods here
 
+def _brightness_field(device: Dict[str, Any]) -> str:
+    """Status field holding the brightness: color mode reports it as 'gain'"""
+    return "gain" if device.get("mode") == "color" else "brightness"
+
+def _publish_command(device: Dict[str, Any], topic: str, payload: str, command: str, expected: Dict[str, Any]):
+    """Publish a command and register the status values that will acknowledge it"""
+    result = mqtt_service.safe_publish(topic, payload)
+    if result.rc == mqtt.MQTT_ERR_SUCCESS:
+        ack_tracker.expect(device["device_id"], command, expected)
+    return result
+
+async def _send(device_id: str, build: Callable[..., Tuple[str, str, Dict[str, Any]]], *args) -> bool:
+    """Build and publish one device's command with the same builders as the fan-out"""
+    try:
+        device = await device_repository.get(device_id)
+
+        if not device:
+            logger.error(f"Device {device_id} not found")
+            return False
+
+        topic, payload, state = build(device, *args)
+        if not _publish_prepared(device, build, topic, payload, state):
+            return False
+
+        logger.info(f"Successfully published {_ACK_FIELDS[build][0]} command to {topic}")
+        await device_repository.update(device_id, state)
+        return True
+    except Exception as e:
+        logger.error(f"Error in {build.__name__} for {device_id}: {e}")
+        return False
+
 async def getStatus(device_id: str) -> Dict[str, Any]:
     """Get status for a device"""
     try:
         # Find the device first
-        devices = load_devices()
-        device = next((d for d in devices if d["device_id"] == device_id), None)
+        device = await device_repository.get(device_id)
         
         if not device:
             logger.error(f"Device {device_id} not found")
@@ -88,344 +122,227 @@ async def getStatus(device_id: str) -> Dict[str, Any]:
         logger.error(f"Error in getStatus: {e}")
         return None
 
-async def turn_on(device_id: str) -> bool:
-    """Turn on a device"""
-    try:
-        devices = load_devices()
-        device = next((d for d in devices if d["device_id"] == device_id), None)
-        
-        if not device:
-            logger.error(f"Device {device_id} not found")
-            return False
-            
-        shelly_id = device.get("shelly_id", device_id)
-        topic = f"shellies/{shelly_id}/color/0/command"
-        payload = "on"
-        
-        # Use the safe_publish method instead
-        result = mqtt_service.safe_publish(topic, payload)
-        
-        if result.rc != mqtt.MQTT_ERR_SUCCESS:
-            logger.error(f"Failed to publish to {topic}. Error: {result.rc}")
-            return False
-            
-        logger.info(f"Successfully published turn on command to {topic}")
-        update_device_status(device_id, {"ison": True})
-        return True
-    except Exception as e:
-        logger.error(f"Error in turn_on: {e}")
-        return False
+async def turn_on(device_id: str, wait_for_ack: bool = False) -> bool:
+    """Turn on a device (queued in the interactive lane, ahead of automation commands)"""
+    return await _queue_single(device_id, _turn_on, [], "switch", wait_for_ack)
 
-async def turn_off(device_id: str) -> bool:
-    """Turn off a device"""
-    try:
-        devices = load_devices()
-        device = next((d for d in devices if d["device_id"] == device_id), None)
-        
-        if not device:
-            logger.error(f"Device {device_id} not found")
-            return False
-            
-        shelly_id = device.get("shelly_id", device_id)
-        topic = f"shellies/{shelly_id}/color/0/command"
-        payload = "off"
-        
-        # Use the safe_publish method instead
-        result = mqtt_service.safe_publish(topic, payload)
-        
-        if result.rc != mqtt.MQTT_ERR_SUCCESS:
-            logger.error(f"Failed to publish to {topic}. Error: {result.rc}")
-            return False
-            
-        logger.info(f"Successfully published turn off command to {topic}")
-        update_device_status(device_id, {"ison": False})
-        return True
-    except Exception as e:
-        logger.error(f"Error in turn_off: {e}")
-        return False
+async def _turn_on(device_id: str) -> bool:
+    """Publish the turn on command for a device"""
+    return await _send(device_id, _switch_command, True)
 
+async def turn_off(device_id: str, wait_for_ack: bool = False) -> bool:
+    """Turn off a device (queued in the interactive lane, ahead of automation commands)"""
+    return await _queue_single(device_id, _turn_off, [], "switch", wait_for_ack)
 
-async def set_color_multiple(device_ids: List[str], red: int, green: int, blue: int, gain: int = 100, white: int = 0) -> Dict[str, bool]:
-    """Set the same color for multiple devices through the command queue"""
-    async def execute_set_color(device_id: str, red: int, green: int, blue: int, gain: int = 100, white: int = 0) -> bool:
-        try:
-            # Find the device
-            devices = load_devices()
-            device = next((d for d in devices if d["device_id"] == device_id), None)
-            
-            if not device:
-                logger.error(f"Device {device_id} not found")
-                return False
-                
-            # Get shelly_id from the device
-            shelly_id = device.get("shelly_id", device_id)
-            
-            # Create the topic and payload
-            topic = f"shellies/{shelly_id}/color/0/set"
-            payload = json.dumps({
-                "mode": "color",
-                "red": red,
-                "green": green, 
-                "blue": blue,
-                "gain": gain,
-                "white": white
-            })
-            
-            # Send the command
-            result = mqtt_service.safe_publish(topic, payload)
-            
-            if result.rc != mqtt.MQTT_ERR_SUCCESS:
-                logger.error(f"Failed to publish to {topic}. Error: {result.rc}")
-                return False
-                
-            logger.info(f"Successfully published color command to {topic}")
-            
-            # Update device status
-            update_device_status(device_id, {
-                "mode": "color",
-                "red": red,
-                "green": green,
-                "blue": blue,
-                "gain": gain,
-                "white": white
-            })
-            
-            return True
-        except Exception as e:
-            logger.error(f"Error in set_color: {e}")
-            return False
-    
-    single_device_mode = isinstance(device_ids, str)
-    if single_device_mode:
-        device_ids = [device_ids]
-    
-    results = await command_queue.add_bulk_command(
-        device_ids=device_ids,   
-        command_func=execute_set_color,
-        command_args=[None, red, green, blue, gain, white],
-        bypass_queue=True
-    )
+async def _turn_off(device_id: str) -> bool:
+    """Publish the turn off command for a device"""
+    return await _send(device_id, _switch_command, False)
 
-    if single_device_mode and device_ids:
-        return results.get(device_ids[0], False)
-    
-    return results
 
-async def set_white_multiple(device_ids: List[str], white: int, gain: int = 100, red: int = 0, green: int = 0, blue: int = 0, brightness: int = 100, temp: int = 4750) -> Dict[str, bool]:
-    """Set white for multiple devices"""
-    async def set_white(device_id: str, white: int, gain: int = 100, red: int = 0, green: int = 0, blue: int = 0, brightness: int = 100, temp: int = 4750) -> bool:
-        """Set white for a device"""
-        try:
-            # Find the device
-            devices = load_devices()
-            device = next((d for d in devices if d["device_id"] == device_id), None)
-            
-            if not device:
-                logger.error(f"Device {device_id} not found")
-                return False
-                
-            # Get shelly_id from the device
-            shelly_id = device.get("shelly_id", device_id)
-            
-            # Create the topic and payload
-            topic = f"shellies/{shelly_id}/color/0/set"
-            payload = json.dumps({
-                "mode": "white",
-                "white": white,
-                "gain": gain,
-                "red": red,
-                "green": green,
-                "blue": blue,
-                "brightness": brightness,
-                "temp": temp
-            })
-            
-            # Send the command
-            result = mqtt_service.safe_publish(topic, payload)
-            
-            if result.rc != mqtt.MQTT_ERR_SUCCESS:
-                logger.error(f"Failed to publish to {topic}. Error: {result.rc}")
-                return False
-                
-            logger.info(f"Successfully published white command to {topic}")
-            
-            # Update device status
-            update_device_status(device_id, {
-                "mode": "white",
-                "white": white,
-                "gain": gain,
-                "red": red,
-                "green": green,
-                "blue": blue, 
-                "brightness": brightness,
-                "temp": temp
-            })
-            
-            return True
-        except Exception as e:
-            logger.error(f"Error in set_white: {e}")
-            return False
-        
-    single_device_mode = isinstance(device_ids, str)
-    if single_device_mode:
-        device_ids = [device_ids]
+async def _set_color(device_id: str, red: int, green: int, blue: int, gain: int = 100, white: int = 0) -> bool:
+    """Set color for a device"""
+    return await _send(device_id, _color_command, red, green, blue, gain, white)
 
-    results = await command_queue.add_bulk_command(
-        device_ids=device_ids,   
-        command_func=set_white,
-        command_args=[None, white, gain, red, green, blue, brightness, temp],
-        bypass_queue=True
-    )
+async def _set_white(device_id: str, white: int, gain: int = 100, red: int = 0, green: int = 0, blue: int = 0, brightness: int = 100, temp: int = 4750) -> bool:
+    """Set white for a device"""
+    return await _send(device_id, _white_command, white, gain, red, green, blue, brightness, temp)
 
-    if single_device_mode and device_ids:
-        return results.get(device_ids[0], False)
-    
-    return results
+async def _set_temperature(device_id: str, temp: int) -> bool:
+    """Set temperature for a device"""
+    return await _send(device_id, _temperature_command, temp)
 
-async def set_temperature_multiple(device_ids: List[str], temp: int) -> Dict[str, bool]:
-    """Set the same color temperature for multiple devices"""
-    async def set_temperature(device_id: str, temp: int) -> bool:
-        """Set temperature for a device"""
-        try:
-            # Find the device
-            devices = load_devices()
-            device = next((d for d in devices if d["device_id"] == device_id), None)
-            
-            if not device:
-                logger.error(f"Device {device_id} not found")
-                return False
-                
-            # Validate temperature range
-            valid_temp = max(3000, min(6465, temp))
-            if valid_temp != temp:
-                logger.warning(f"Temperature {temp}K adjusted to {valid_temp}K (valid range: 2700-6500K)")
-            
-            # Get shelly_id from the device
-            shelly_id = device.get("shelly_id", device_id)
-            
-            # Create the topic and payload
-            topic = f"shellies/{shelly_id}/color/0/set"
-            
-            # Log the exact payload we're sending
-            payload_dict = {
-                "mode": "white",
-                "temp": valid_temp
-            }
-            payload = json.dumps(payload_dict)
-            
-            logger.info(f"Setting temperature for {device_id} with payload: {payload_dict}")
-            
-            # Send the command
-            result = mqtt_service.safe_publish(topic, payload)
-            
-            if result.rc != mqtt.MQTT_ERR_SUCCESS:
-                logger.error(f"Failed to publish to {topic}. Error: {result.rc}")
-                return False
-                
-            logger.info(f"Successfully published temperature command to {topic}")
-            
-            # Update device status
-            update_device_status(device_id, {"temp": valid_temp})
-            
-            return True
-        except Exception as e:
-            logger.error(f"Error in set_temperature: {e}")
-            return False
-    single_device_mode = isinstance(device_ids, str)
-    if single_device_mode:
-        device_ids = [device_ids]
+async def _set_brightness(device_id: str, brightness: int) -> bool:
+    """Set brightness for a device (0-100)"""
+    return await _send(device_id, _brightness_command, brightness)
 
-    results = await command_queue.add_bulk_command(
-        device_ids=device_ids,   
-        command_func=set_temperature,
-        command_args=[None, temp],
-        bypass_queue=True
-    )
+# Queued commands that the durable command queue can persist and replay
+command_queue.register_command("shelly.duorgbw.turn_on", _turn_on)
+command_queue.register_command("shelly.duorgbw.turn_off", _turn_off)
+command_queue.register_command("shelly.duorgbw.set_color", _set_color)
+command_queue.register_command("shelly.duorgbw.set_white", _set_white)
+command_queue.register_command("shelly.duorgbw.set_temperature", _set_temperature)
+command_queue.register_command("shelly.duorgbw.set_brightness", _set_brightness)
 
-    if single_device_mode and device_ids:
-        return results.get(device_ids[0], False)
-    
-    return results
+# Command builders, shared by the single-device commands (_send) and the
+# fan-out: bulk commands are built for every device first and then published
+# in one burst (see _fan_out), instead of awaiting each device in turn
+
+def _shelly_id(device: Dict[str, Any]) -> str:
+    return device.get("shelly_id") or device["device_id"]
+
+def _switch_command(device: Dict[str, Any], on: bool) -> Tuple[str, str, Dict[str, Any]]:
+    """Build a turn on/off command"""
+    return get_command_topic(_shelly_id(device)), "on" if on else "off", {"ison": on}
+
+def _color_command(device: Dict[str, Any], red: int, green: int, blue: int, gain: int = 100, white: int = 0) -> Tuple[str, str, Dict[str, Any]]:
+    """Build a color mode command"""
+    state = {
+        "mode": "color",
+        "red": red,
+        "green": green,
+        "blue": blue,
+        "gain": gain,
+        "white": white
+    }
+    return get_set_topic(_shelly_id(device)), json.dumps(state), state
+
+def _white_command(device: Dict[str, Any], white: int, gain: int = 100, red: int = 0, green: int = 0, blue: int = 0, brightness: int = 100, temp: int = 4750) -> Tuple[str, str, Dict[str, Any]]:
+    """Build a white mode command"""
+    state = {
+        "mode": "white",
+        "white": white,
+        "gain": gain,
+        "red": red,
+        "green": green,
+        "blue": blue,
+        "brightness": brightness,
+        "temp": temp
+    }
+    return get_set_topic(_shelly_id(device)), json.dumps(state), state
+
+def _temperature_command(device: Dict[str, Any], temp: int) -> Tuple[str, str, Dict[str, Any]]:
+    """Build a color temperature command"""
+    valid_temp = max(3000, min(6465, temp))
+    if valid_temp != temp:
+        logger.warning(f"Temperature {temp}K adjusted to {valid_temp}K (valid range: 2700-6500K)")
+    payload = json.dumps({"mode": "white", "temp": valid_temp})
+    return get_set_topic(_shelly_id(device)), payload, {"temp": valid_temp}
 
-async def set_brightness_multiple(device_ids: List[str], brightness: int) -> Dict[str, bool]:
-    """Set the same brightness for multiple devices"""
-    async def set_brightness(device_id: str, brightness: int) -> bool:
-        """Set brightness for a device (0-100) - simplified version"""
+def _brightness_command(device: Dict[str, Any], brightness: int) -> Tuple[str, str, Dict[str, Any]]:
+    """Build a brightness command (0-100, sent as gain in color mode)"""
+    state = {_brightness_field(device): max(0, min(100, brightness))}
+    return get_set_topic(_shelly_id(device)), json.dumps(state), state
+
+# Command type and the reported status fields that confirm it, per builder
+# (None: every field the builder set, as it depends on the device mode)
+_ACK_FIELDS = {
+    _switch_command: ("switch", ("ison",)),
+    _color_command: ("color", ("mode", "red", "green", "blue")),
+    _white_command: ("white", ("mode", "brightness", "temp")),
+    _temperature_command: ("temperature", ("temp",)),
+    _brightness_command: ("brightness", None),
+}
+
+async def _fan_out(device_ids: List[str], build: Callable[..., Tuple[str, str, Dict[str, Any]]], *args, at: Optional[float] = None, wait_for_ack: bool = False) -> Dict[str, bool]:
+    """Send the same command to many devices at once.
+
+    All devices are looked up and every topic/payload is built first; each
+    publish is queued behind the device's pending commands and they all go
+    out in one burst (at ``at`` if given), so a whole room changes together
+    instead of bulb by bulb. With ``wait_for_ack`` a device
+    only counts as successful once its status report confirms the change.
+    """
+    results: Dict[str, bool] = {}
+    publishes = {}
+    states = {}
+    queue_ids = {}  # Publishes are queued under the canonical ID, like single commands
+
+    devices = await device_repository.get_many(device_ids)
+    for device_id, device in devices.items():
+        if not device:
+            logger.error(f"Device {device_id} not found")
+            results[device_id] = False
+            continue
         try:
-            # Find the device
-            devices = load_devices()
-            device = next((d for d in devices if d["device_id"] == device_id), None)
-            
-            if not device:
-                logger.error(f"Device {device_id} not found")
-                return False
-                
-            # Ensure brightness is within valid range
-            brightness = max(0, min(100, brightness))
-                
-            # Get shelly_id from the device
-            shelly_id = device.get("shelly_id", device_id)
-            
-            # Create the topic and payload - just sending brightness for all modes
-            topic = f"shellies/{shelly_id}/color/0/set"
-            
-            # Simple approach - send both parameters that could affect brightness
-            payload = {
-                "brightness": brightness,
-            }
-            
-            # Send the command
-            result = mqtt_service.safe_publish(topic, json.dumps(payload))
-            
-            if result.rc != mqtt.MQTT_ERR_SUCCESS:
-                logger.error(f"Failed to publish to {topic}. Error: {result.rc}")
-                return False
-                
-            logger.info(f"Successfully published brightness command to {topic} with payload: {payload}")
-            
-            # Update device status with both brightness parameters
-            update_device_status(device_id, {
-                "brightness": brightness,
-            })
-            
-            return True
+            topic, payload, states[device_id] = build(device, *args)
         except Exception as e:
-            logger.error(f"Error in set_brightness: {e}")
-            return False
-        
+            logger.error(f"Error in {build.__name__} for {device_id}: {e}")
+            results[device_id] = False
+            continue
+        queue_ids[device_id] = device.get("device_id") or device_id
+        publishes[queue_ids[device_id]] = functools.partial(_publish_prepared, device, build, topic, payload, states[device_id])
+
+    by_queue, spread = await command_queue.fan_out(publishes, at=at)
+    published = {device_id: by_queue.get(queue_id, False) for device_id, queue_id in queue_ids.items()}
+    results.update(published)
+    logger.info(f"Fan-out {build.__name__} to {len(publishes)} devices, spread {spread * 1000:.2f}ms")
+
+    succeeded = {device_id: states[device_id] for device_id, ok in published.items() if ok}
+    if succeeded:
+        await device_repository.update_many(succeeded)
+
+    if wait_for_ack and succeeded:
+        command = _ACK_FIELDS[build][0]
+        acked = await asyncio.gather(*(ack_tracker.wait(queue_ids[device_id], command) for device_id in succeeded))
+        results.update(zip(succeeded, acked))
+
+    # Keep the caller's order
+    return {device_id: results.get(device_id, False) for device_id in device_ids}
+
+def _publish_prepared(device: Dict[str, Any], build: Callable, topic: str, payload: str, state: Dict[str, Any]) -> bool:
+    """Publish an already built command (no awaits, so a fan-out burst is not interleaved)"""
+    command, fields = _ACK_FIELDS[build]
+    result = _publish_command(device, topic, payload, command, {field: state[field] for field in fields or state})
+    if result.rc != mqtt.MQTT_ERR_SUCCESS:
+        logger.error(f"Failed to publish to {topic}. Error: {result.rc}")
+        return False
+    return True
+
+async def _multiple(device_ids: List[str], build: Callable[..., Tuple[str, str, Dict[str, Any]]], *args, at: Optional[float] = None, wait_for_ack: bool = False):
+    """Fan out a command; a single device ID string returns a single bool"""
     single_device_mode = isinstance(device_ids, str)
     if single_device_mode:
         device_ids = [device_ids]
-    
-    results = await command_queue.add_bulk_command(
-        device_ids=device_ids,
-        command_func=set_brightness,
-        command_args=[None, brightness],
-        bypass_queue=True
-    )
+
+    results = await _fan_out(device_ids, build, *args, at=at, wait_for_ack=wait_for_ack)
 
     if single_device_mode and device_ids:
         return results.get(device_ids[0], False)
-    
     return results
 
+async def turn_on_multiple(device_ids: List[str], at: Optional[float] = None, wait_for_ack: bool = False) -> Dict[str, bool]:
+    """Turn on multiple devices together"""
+    return await _multiple(device_ids, _switch_command, True, at=at, wait_for_ack=wait_for_ack)
+
+async def turn_off_multiple(device_ids: List[str], at: Optional[float] = None, wait_for_ack: bool = False) -> Dict[str, bool]:
+    """Turn off multiple devices together"""
+    return await _multiple(device_ids, _switch_command, False, at=at, wait_for_ack=wait_for_ack)
+
+async def set_color_multiple(device_ids: List[str], red: int, green: int, blue: int, gain: int = 100, white: int = 0, at: Optional[float] = None, wait_for_ack: bool = False) -> Dict[str, bool]:
+    """Set the same color for multiple devices together"""
+    return await _multiple(device_ids, _color_command, red, green, blue, gain, white, at=at, wait_for_ack=wait_for_ack)
+
+async def set_white_multiple(device_ids: List[str], white: int, gain: int = 100, red: int = 0, green: int = 0, blue: int = 0, brightness: int = 100, temp: int = 4750, at: Optional[float] = None, wait_for_ack: bool = False) -> Dict[str, bool]:
+    """Set white for multiple devices together"""
+    return await _multiple(device_ids, _white_command, white, gain, red, green, blue, brightness, temp, at=at, wait_for_ack=wait_for_ack)
+
+async def set_temperature_multiple(device_ids: List[str], temp: int, at: Optional[float] = None, wait_for_ack: bool = False) -> Dict[str, bool]:
+    """Set the same color temperature for multiple devices together"""
+    return await _multiple(device_ids, _temperature_command, temp, at=at, wait_for_ack=wait_for_ack)
+
+async def set_brightness_multiple(device_ids: List[str], brightness: int, at: Optional[float] = None, wait_for_ack: bool = False) -> Dict[str, bool]:
+    """Set the same brightness for multiple devices together"""
+    return await _multiple(device_ids, _brightness_command, brightness, at=at, wait_for_ack=wait_for_ack)
+
+
+async def _queue_single(device_id: str, command_func, command_args: List[Any], coalesce_key: str, wait_for_ack: bool = False) -> bool:
+    """Run a single-device command through the device's queue.
+
+    Pending commands with the same coalesce key are replaced, so a burst of
+    slider updates only sends the latest value. The coalesce key doubles as
+    the command type for ``wait_for_ack``.
+    """
+    queue_id = await device_repository.resolve(device_id) or device_id
+    success = await command_queue.run_command(
+        queue_id, command_func, [device_id, *command_args],
+        priority=CommandLane.INTERACTIVE, coalesce_key=coalesce_key
+    )
+    if success and wait_for_ack:
+        return await ack_tracker.wait(queue_id, coalesce_key)
+    return success
 
-async def set_color(device_id: str, red: int, green: int, blue: int, gain: int = 100) -> bool:
-    """Compatibility function that calls set_color_multiple for a single device"""
-    results = await set_color_multiple(device_id, red, green, blue, gain)
-    return results if isinstance(results, bool) else results.get(device_id, False)
+async def set_color(device_id: str, red: int, green: int, blue: int, gain: int = 100, white: int = 0, wait_for_ack: bool = False) -> bool:
+    """Set the color of a single device (coalesced with pending color commands)"""
+    return await _queue_single(device_id, _set_color, [red, green, blue, gain, white], "color", wait_for_ack)
 
-async def set_white(device_id: str, white: int, gain: int = 100, red: int = 0, green: int = 0, blue: int = 0, brightness: int = 100, temp: int = 4750) -> bool:
-    """Compatibility function that calls set_white_multiple for a single device"""
-    results = await set_white_multiple(device_id, white, gain, red, green, blue, brightness, temp)
-    return results if isinstance(results, bool) else results.get(device_id, False)
+async def set_white(device_id: str, white: int, gain: int = 100, red: int = 0, green: int = 0, blue: int = 0, brightness: int = 100, temp: int = 4750, wait_for_ack: bool = False) -> bool:
+    """Set the white level of a single device (coalesced with pending white commands)"""
+    return await _queue_single(device_id, _set_white, [white, gain, red, green, blue, brightness, temp], "white", wait_for_ack)
 
-async def set_temperature(device_id: str, temp: int) -> bool:
-    """Compatibility function that calls set_temperature_multiple for a single device"""
-    results = await set_temperature_multiple(device_id, temp)
-    return results if isinstance(results, bool) else results.get(device_id, False)
+async def set_temperature(device_id: str, temp: int, wait_for_ack: bool = False) -> bool:
+    """Set the color temperature of a single device (coalesced with pending temperature commands)"""
+    return await _queue_single(device_id, _set_temperature, [temp], "temperature", wait_for_ack)
 
-async def set_brightness(device_id: str, brightness: int) -> bool:
-    """Compatibility function that calls set_brightness_multiple for a single device"""
-    results = await set_brightness_multiple(device_id, brightness)
-    return results if isinstance(results, bool) else results.get(device_id, False)
\ No newline at end of file
+async def set_brightness(device_id: str, brightness: int, wait_for_ack: bool = False) -> bool:
+    """Set the brightness of a single device (coalesced with pending brightness commands)"""
+    return await _queue_single(device_id, _set_brightness, [brightness], "brightness", wait_for_ack)
\ No newline at end of file
@@ -32,6 +32,7 @@ class BulkColorPayload(BaseModel):
     blue: int = Field(..., ge=0, le=255, description="Blue component (0-255)")
     gain: int = Field(100, ge=0, le=100, description="Color intensity (0-100)")
     white: int = 0
+    at: Optional[float] = Field(None, description="Unix time at which all devices are switched together (default: now)")
 
 class TemperaturePayload(BaseModel):
     temperature: int = Field(..., ge=2700, le=6500)
@@ -54,6 +55,7 @@ class BulkWhitePayload(BaseModel):
     blue: int = 0
     brightness: int = 100
     temp: int = 4750
+    at: Optional[float] = Field(None, description="Unix time at which all devices are switched together (default: now)")
 
 class TemperaturePayload(BaseModel):
     temp: int = Field(..., ge=2700, le=6500, description="Color temperature in Kelvin (2700-6500)")
@@ -61,6 +63,7 @@ class TemperaturePayload(BaseModel):
 class BulkTemperaturePayload(BaseModel):
     device_ids: List[str]
     temp: int = Field(..., ge=2700, le=6500, description="Color temperature in Kelvin (2700-6500)")
+    at: Optional[float] = Field(None, description="Unix time at which all devices are switched together (default: now)")
 
 class BrightnessPayload(BaseModel):
     brightness: int = Field(..., ge=0, le=100, description="Brightness percentage (0-100)")
@@ -68,6 +71,8 @@ class BrightnessPayload(BaseModel):
 class BulkBrightnessPayload(BaseModel):
     device_ids: List[str]
     brightness: int = Field(..., ge=0, le=100, description="Brightness percentage (0-100)")
+    at: Optional[float] = Field(None, description="Unix time at which all devices are switched together (default: now)")
 
 class DeviceIDs(BaseModel):
-    device_ids: List[str]
\ No newline at end of file
+    device_ids: List[str]
+    at: Optional[float] = Field(None, description="Unix time at which all devices are switched together (default: now)")
\ No newline at end of file
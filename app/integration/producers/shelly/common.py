@@ -1,4 +1,6 @@
 """Shared functionality for Shelly devices"""
+import json
+from typing import Any, Dict, List, Optional
 
 MQTT_TOPIC_PREFIX = "shellies"
 
@@ -24,4 +26,67 @@ def get_energy_topic(shelly_id: str) -> str:
 
 def get_online_topic(shelly_id: str) -> str:
     """Get the online status topic for a Shelly device"""
-    return f"{MQTT_TOPIC_PREFIX}/{shelly_id}/online"
\ No newline at end of file
+    return f"{MQTT_TOPIC_PREFIX}/{shelly_id}/online"
+
+# Broadcast topics shared by all Shelly devices on the broker
+COMMAND_ALL_TOPIC = f"{MQTT_TOPIC_PREFIX}/command"  # Accepts "announce" and "update"
+ANNOUNCE_TOPIC = f"{MQTT_TOPIC_PREFIX}/announce"
+
+# Topic filters for the reports published by Shelly devices
+STATUS_TOPIC_FILTER = f"{MQTT_TOPIC_PREFIX}/+/color/0/status"
+POWER_TOPIC_FILTER = f"{MQTT_TOPIC_PREFIX}/+/light/0/power"
+ENERGY_TOPIC_FILTER = f"{MQTT_TOPIC_PREFIX}/+/light/0/energy"
+ONLINE_TOPIC_FILTER = f"{MQTT_TOPIC_PREFIX}/+/online"
+
+DEVICE_FILTER_PREFIX = f"{MQTT_TOPIC_PREFIX}/+/"  # Filters with the device ID as a wildcard
+
+def get_subscription_topics(shelly_id: str, topic_filters: List[str]) -> List[str]:
+    """Per-device filters (``shellies/+/...``) narrowed to one Shelly device"""
+    device_prefix = f"{MQTT_TOPIC_PREFIX}/{shelly_id}/"
+    return [
+        device_prefix + topic_filter[len(DEVICE_FILTER_PREFIX):]
+        for topic_filter in topic_filters
+        if topic_filter.startswith(DEVICE_FILTER_PREFIX)
+    ]
+
+STATUS_FIELDS = ("ison", "mode", "brightness", "temp", "red", "green", "blue", "white", "gain")
+STATE_FIELDS = STATUS_FIELDS + ("power", "energy", "online")  # Everything the state machine tracks
+
+def parse_status(payload: bytes) -> Optional[Dict[str, Any]]:
+    """Parse a color/0/status JSON report into device status fields"""
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    status = {field: data[field] for field in STATUS_FIELDS if field in data}
+    if "power" in data:
+        status["power"] = data["power"]
+    return status
+
+def parse_meter(payload: bytes) -> Optional[float]:
+    """Parse a light/0/power or light/0/energy reading (a bare number)"""
+    try:
+        return float(payload)
+    except ValueError:
+        return None
+
+def parse_online(payload: bytes) -> Optional[bool]:
+    """Parse an online report ("true"/"false")"""
+    value = payload.strip().lower()
+    if value == b"true":
+        return True
+    if value == b"false":
+        return False
+    return None
+
+def parse_announce(payload: bytes) -> Optional[Dict[str, Any]]:
+    """Parse an announce report ({"id": <shelly_id>, "ip": ..., "fw_ver": ...})"""
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not data.get("id"):
+        return None
+    return data
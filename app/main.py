@@ -7,28 +7,23 @@ from fastapi.middleware.cors import CORSMiddleware
 
 # Import routers
 from app.api.routes.devices import router as devices_router
+from app.api.routes.metrics import router as metrics_router
 from app.integration.producers.shelly.ShellyDuoRGBW.api import router as shelly_duorgbw_router
 
 # Import services
-from app.services.mqtt_service import init_mqtt_client, stop_mqtt_client, MQTTService
+from app.services.mqtt_service import init_mqtt_client, stop_mqtt_client
 
 from app.integration.registry import device_registry
 from app.services.command_queue_service import command_queue
-from app.services.websocket_service import ConnectionManager
+from app.core.device_store import device_store
+from app.core.io_executor import loop_lag_monitor, run_io, shutdown_io_executor
+from app.repositories.device_repository import device_repository
+from app.services.websocket_service import manager
+from app.services.warm_start import warm_start
+from app.services.telemetry_service import telemetry_service
 # Import settings
 from app.core.config import settings
 
-from app.services.device_state_machine import DeviceStateMachine
-
-# Creează instanța state machine
-state_machine = DeviceStateMachine()
-
-# Creează instanța managerului de conexiuni WebSocket
-manager = ConnectionManager(state_machine)
-
-# Creează instanța serviciului MQTT
-mqtt_service = MQTTService(state_machine)
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -55,12 +50,11 @@ app.add_middleware(
 
 # Include routers
 app.include_router(devices_router, prefix="/devices", tags=["devices"])
+app.include_router(metrics_router)
 # Include the DuoRGBW router with both prefixes
 app.include_router(shelly_duorgbw_router, prefix="/shelly/duorgbw", tags=["devices"])
 app.include_router(shelly_duorgbw_router, prefix="/shelly/colorbulb", tags=["devices"])
 
-manager = ConnectionManager()
-
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for real-time device updates"""
@@ -72,9 +66,8 @@ async def websocket_endpoint(websocket: WebSocket):
 
         if not devices:
             # Dacă nu există dispozitive în registru, încearcă să le încarci din JSON
-            from app.core.devices_manager import load_devices
-            json_devices = load_devices()
-            await websocket.send_json({"type": "initial_devices", "data": json_devices})
+            json_devices = await device_repository.get_all()
+            await websocket.send_json({"type": "initial_devices", "data": json_devices, "ready": warm_start.ready})
         else:
             # Trimite dispozitivele din registru
             for device in devices:
@@ -85,7 +78,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     "device_type": device.device_type,
                     **status
                 })
-            await websocket.send_json({"type": "initial_devices", "data": registry_devices})
+            await websocket.send_json({"type": "initial_devices", "data": registry_devices, "ready": warm_start.ready})
 
         # Menține conexiunea deschisă și procesează mesajele primite
         while True:
@@ -126,7 +119,8 @@ def root():
         "api_name": settings.PROJECT_NAME,
         "version": "1.0.0",
         "documentation": "/docs",
-        "status": "operational"
+        "status": "operational",
+        "state_ready": warm_start.ready
     }
 
 @app.on_event("startup")
@@ -143,12 +137,28 @@ async def startup_event():
     """Initialize services when the application starts"""
     logger.info("Starting up the application")
     
+    # Track event loop lag so blocking calls show up in /metrics/loop
+    loop_lag_monitor.start()
+    
+    # Load devices into memory once and start the write-behind flusher
+    await run_io(device_store.load)
+    await device_store.start()
+    
+    # Restore the persisted power/energy rollups and snapshot them periodically
+    await telemetry_service.start()
+    
+    # Serve the last persisted state right away and refresh it from the devices on connect
+    await warm_start.start()
+    
     # Initialize the MQTT client
     init_mqtt_client()
     
     # Set command delay (optional, default 400ms)
     command_queue.set_command_delay(0.4)
     
+    # Start the command workers and replay commands persisted before a restart
+    await command_queue.start()
+    
     # Print registered routes for debugging
     print("\n=== REGISTERED ROUTES ===")
     for route in app.routes:
@@ -165,5 +175,14 @@ async def shutdown_event():
     # Stop the command queue service
     await command_queue.shutdown()
     
+    await warm_start.stop()
+    
     # Stop the MQTT client
-    stop_mqtt_client()
\ No newline at end of file
+    await stop_mqtt_client()
+    
+    # Write the final telemetry snapshot and flush pending device changes to disk
+    await telemetry_service.stop()
+    await device_store.stop()
+    
+    await loop_lag_monitor.stop()
+    shutdown_io_executor()
\ No newline at end of file
@@ -1,46 +1,64 @@
-import json
-import os
-from typing import List, Dict, Any, Optional
-from app.core.config import settings
+# app/repositories/device_repository.py
+import time
+from typing import List, Dict, Any, Optional, Iterable
+from app.core.device_store import DeviceStore, device_store
 from app.core.logging import logger
 
 class DeviceRepository:
-    def __init__(self, file_path: str = settings.DEVICES_JSON_PATH):
-        self.file_path = file_path
-        
-    def load_devices(self) -> List[Dict[str, Any]]:
-        try:
-            if not os.path.exists(self.file_path):
-                logger.warning(f"Devices file not found: {self.file_path}, creating empty file")
-                self.save_devices([])
-                
-            with open(self.file_path, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"Failed to load devices: {e}")
-            return []
-            
-    def save_devices(self, devices: List[Dict[str, Any]]) -> bool:
-        try:
-            with open(self.file_path, 'w') as f:
-                json.dump(devices, f, indent=4)
-            return True
-        except Exception as e:
-            logger.error(f"Failed to save devices: {e}")
-            return False
-            
-    def get_device_by_id(self, device_id: str) -> Optional[Dict[str, Any]]:
-        devices = self.load_devices()
-        return next((d for d in devices if d.get("device_id") == device_id or d.get("shelly_id") == device_id), None)
-        
-    def update_device(self, device_id: str, updates: Dict[str, Any]) -> bool:
-        devices = self.load_devices()
-        
-        for i, device in enumerate(devices):
-            if device.get("device_id") == device_id or device.get("shelly_id") == device_id:
-                devices[i] = {**device, **updates}
-                logger.info(f"Updating device {device_id} with details {updates}")
-                return self.save_devices(devices)
-                
-        logger.error(f"Device not found for update: {device_id}")
-        return False
\ No newline at end of file
+    """Single async access point for device records.
+
+    Routes, device integrations and the state machine all go through this
+    repository, so caching, batching and persistence live in one place (the
+    in-memory ``DeviceStore`` and its write-behind backend).
+    """
+
+    def __init__(self, store: DeviceStore = device_store):
+        self._store = store
+
+    async def get_all(self) -> List[Dict[str, Any]]:
+        """Get copies of all devices (safe for the caller to modify)"""
+        return self._store.all()
+
+    async def get(self, device_id: str) -> Optional[Dict[str, Any]]:
+        """Get a device by device ID or Shelly ID"""
+        return self._store.get(device_id)
+
+    async def get_many(self, device_ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Get several devices at once, keyed by the requested IDs (None if missing)"""
+        return {device_id: self._store.get(device_id) for device_id in device_ids}
+
+    async def resolve(self, device_id: str) -> Optional[str]:
+        """Resolve a device ID or Shelly ID to the device ID"""
+        return self._store.resolve(device_id)
+
+    async def update(self, device_id: str, updates: Dict[str, Any]) -> bool:
+        """Merge updates into a device and refresh its last_seen timestamp"""
+        updated = self._store.update(device_id, {**updates, "last_seen": int(time.time())})
+        if not updated:
+            logger.warning(f"Device not found for update: {device_id}")
+        return updated
+
+    async def update_many(self, updates: Dict[str, Dict[str, Any]]) -> Dict[str, bool]:
+        """Apply several device updates in one batch"""
+        now = int(time.time())
+        results = {
+            device_id: self._store.update(device_id, {**device_updates, "last_seen": now})
+            for device_id, device_updates in updates.items()
+        }
+        missing = [device_id for device_id, updated in results.items() if not updated]
+        if missing:
+            logger.warning(f"Devices not found for update: {missing}")
+        return results
+
+    async def add(self, device: Dict[str, Any]) -> Dict[str, Any]:
+        """Insert or replace a device"""
+        self._store.put(device)
+        return device
+
+    async def save_all(self, devices: List[Dict[str, Any]]) -> bool:
+        """Replace all devices"""
+        self._store.replace_all(devices)
+        return True
+
+# Create a singleton instance
+device_repository = DeviceRepository()
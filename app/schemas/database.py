@@ -1,30 +1,70 @@
-from sqlalchemy import create_engine, Column, Integer, String
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, String, Boolean, Float, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from pydantic import BaseModel
 from typing import List, Optional
 
+from app.core.config import settings
+
 Base = declarative_base()
 
 
-DATABASE_URL = "sqlite:///./smart_home.db"
+DATABASE_URL = settings.DATABASE_URL
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 
 
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Use WAL so readers never block the writer and commits stay cheap"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
-class Device(Base):
+class DeviceModel(Base):
     __tablename__ = "devices"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     device_id = Column(String, unique=True, index=True)
+    shelly_id = Column(String, index=True)
     status = Column(String, default="off")
+    ison = Column(Boolean)
+    online = Column(Boolean)
+    last_seen = Column(Integer)
+    source = Column(String)
+    has_timer = Column(Boolean)
+    timer_started = Column(Integer)
+    timer_duration = Column(Integer)
+    timer_remaining = Column(Integer)
+    mode = Column(String)
+    red = Column(Integer)
+    green = Column(Integer)
+    blue = Column(Integer)
+    white = Column(Integer)
+    gain = Column(Integer)
+    temp = Column(Integer)
+    brightness = Column(Integer)
+    effect = Column(Integer)
+    power = Column(Float)
+    energy = Column(Float)
+    extra = Column(Text)  # JSON object with fields that have no dedicated column
 
 def init_db():
     Base.metadata.create_all(bind=engine)
 
+    # Add columns introduced after the table was first created
+    existing = {column["name"] for column in inspect(engine).get_columns(DeviceModel.__tablename__)}
+    with engine.begin() as conn:
+        for column in DeviceModel.__table__.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {DeviceModel.__tablename__} ADD COLUMN {column.name} {column_type}"))
+
 class Device(BaseModel):
     name: str
     device_id: str
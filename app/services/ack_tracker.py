@@ -0,0 +1,166 @@
+# app/services/ack_tracker.py
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.rate_limiter import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+class _PendingAck:
+    """A published command waiting for a status report with the expected values"""
+
+    __slots__ = ("device_id", "command", "expected", "sent", "future", "timer")
+
+    def __init__(self, device_id: str, command: str, expected: Dict[str, Any], future: asyncio.Future):
+        self.device_id = device_id
+        self.command = command
+        self.expected = expected
+        self.sent = time.monotonic()
+        self.future = future
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def matches(self, status: Dict[str, Any]) -> bool:
+        return all(status.get(field) == value for field, value in self.expected.items())
+
+def _percentiles(samples) -> Dict[str, Any]:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"samples": 0}
+
+    def percentile(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 1)
+
+    return {
+        "samples": len(ordered),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+class AckTracker:
+    """Correlates published commands with the device status reports that confirm them.
+
+    Each publish registers the field values it should produce (for example
+    ``{"ison": True}``). Incoming status messages resolve the matching pending
+    commands; commands not confirmed within ``COMMAND_ACK_TIMEOUT`` resolve
+    as not acknowledged. Latencies feed the per-device rate limiter.
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, deque] = {}  # {device_id: pending acks, oldest first}
+        self._outcomes: Dict[Tuple[str, str], bool] = {}  # Last outcome per (device, command)
+        self._timeout = settings.COMMAND_ACK_TIMEOUT
+        self._window = settings.COMMAND_ACK_WINDOW
+        self._by_device: Dict[str, deque] = {}
+        self._by_command: Dict[str, deque] = {}
+        self._counters = {"expected": 0, "acked": 0, "timed_out": 0}
+        self._sequence = 0  # Commands published so far, across all devices
+        self._last_command: Dict[str, int] = {}  # {device_id: sequence number of its latest command}
+
+    def expect(self, device_id: str, command: str, expected: Dict[str, Any]) -> asyncio.Future:
+        """Register a published command; the future resolves True on ack, False on timeout"""
+        loop = asyncio.get_running_loop()
+        entry = _PendingAck(device_id, command, expected, loop.create_future())
+        entry.timer = loop.call_later(self._timeout, self._expire, entry)
+        self._pending.setdefault(device_id, deque()).append(entry)
+        self._counters["expected"] += 1
+        self._sequence += 1
+        self._last_command[device_id] = self._sequence
+        return entry.future
+
+    def command_sequence(self, device_id: str) -> int:
+        """Sequence number of the latest command published to a device (0 if none).
+
+        Sequence numbers only grow, so any new command changes the value, even
+        after the device was forgotten.
+        """
+        return self._last_command.get(device_id, 0)
+
+    def resolve(self, device_id: str, status: Dict[str, Any]) -> int:
+        """Resolve pending commands confirmed by a status report; returns how many"""
+        pending = self._pending.get(device_id)
+        if not pending:
+            return 0
+
+        matched = [entry for entry in pending if entry.matches(status)]
+        if not matched:
+            return 0
+
+        resolved = 0
+        newest = {}
+        for entry in matched:
+            newest[entry.command] = entry
+            latency = time.monotonic() - entry.sent
+            self._record(device_id, entry.command, latency)
+            self._finish(entry, True)
+            resolved += 1
+
+        # Older commands of the same type were overridden by a confirmed newer one
+        for entry in list(pending):
+            confirmed = newest.get(entry.command)
+            if confirmed is not None and entry.sent < confirmed.sent:
+                self._finish(entry, True)
+                resolved += 1
+        return resolved
+
+    async def wait(self, device_id: str, command: str) -> bool:
+        """Wait for the latest command of this type to be acknowledged (or time out)"""
+        pending = self._pending.get(device_id) or ()
+        latest = next((entry for entry in reversed(pending) if entry.command == command), None)
+        if latest is None:
+            return self._outcomes.get((device_id, command), False)
+        return await asyncio.shield(latest.future)
+
+    def _record(self, device_id: str, command: str, latency: float):
+        self._counters["acked"] += 1
+        self._by_device.setdefault(device_id, deque(maxlen=self._window)).append(latency)
+        self._by_command.setdefault(command, deque(maxlen=self._window)).append(latency)
+        rate_limiter.observe_latency(device_id, latency)
+
+    def _expire(self, entry: _PendingAck):
+        if entry.future.done():
+            return
+        self._counters["timed_out"] += 1
+        logger.warning(f"Command '{entry.command}' to device {entry.device_id} not acknowledged within {self._timeout}s")
+        rate_limiter.record_timeout(entry.device_id)
+        self._finish(entry, False)
+
+    def _finish(self, entry: _PendingAck, acked: bool):
+        pending = self._pending.get(entry.device_id)
+        if pending is not None:
+            try:
+                pending.remove(entry)
+            except ValueError:
+                pass
+            if not pending:
+                del self._pending[entry.device_id]
+        if entry.timer is not None:
+            entry.timer.cancel()
+        self._outcomes[(entry.device_id, entry.command)] = acked
+        if not entry.future.done():
+            entry.future.set_result(acked)
+
+    def forget(self, device_id: str) -> None:
+        """Drop an idle device's latency samples and outcomes (kept while acks are pending)"""
+        if device_id in self._pending:
+            return
+        self._by_device.pop(device_id, None)
+        self._last_command.pop(device_id, None)
+        for key in [key for key in self._outcomes if key[0] == device_id]:
+            del self._outcomes[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get command-to-ack latency percentiles per device and per command type"""
+        return {
+            **self._counters,
+            "pending": sum(len(pending) for pending in self._pending.values()),
+            "devices": {device_id: _percentiles(samples) for device_id, samples in self._by_device.items()},
+            "commands": {command: _percentiles(samples) for command, samples in self._by_command.items()},
+        }
+
+# Create a singleton instance
+ack_tracker = AckTracker()
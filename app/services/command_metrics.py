@@ -0,0 +1,185 @@
+# app/services/command_metrics.py
+import time
+from bisect import bisect_left
+from typing import Dict, Any, List, Optional
+
+# Upper bounds (seconds) shared by all command histograms
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class _Histogram:
+    """Fixed-bucket histogram with cumulative totals and a rolling recent window.
+
+    Recording is one bisect and a few increments. The recent window keeps two
+    sets of bucket counts that rotate every ``window`` seconds, so percentiles
+    cover the last one to two windows.
+    """
+
+    __slots__ = ("counts", "sum", "count", "window", "_current", "_previous", "_rotated")
+
+    def __init__(self, window: float):
+        self.counts = [0] * (len(BUCKETS) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.window = window
+        self._current = [0] * (len(BUCKETS) + 1)
+        self._previous = [0] * (len(BUCKETS) + 1)
+        self._rotated = time.monotonic()
+
+    def observe(self, value: float, now: float):
+        if now - self._rotated >= self.window:
+            self._previous = self._current if now - self._rotated < 2 * self.window else [0] * len(self._current)
+            self._current = [0] * len(self._current)
+            self._rotated = now
+        i = bisect_left(BUCKETS, value)
+        self.counts[i] += 1
+        self._current[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def recent(self) -> Dict[str, Any]:
+        """Approximate percentiles (bucket upper bounds) over the recent window"""
+        counts = [a + b for a, b in zip(self._current, self._previous)]
+        total = sum(counts)
+        if not total:
+            return {"samples": 0}
+
+        def percentile(p: float) -> Optional[float]:
+            target = p * total
+            seen = 0
+            for i, n in enumerate(counts):
+                seen += n
+                if seen >= target:
+                    return round(BUCKETS[i] * 1000, 1) if i < len(BUCKETS) else None
+            return None
+
+        return {
+            "samples": total,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+        }
+
+class _CommandSeries:
+    """Wait and execution time histograms plus outcome counters for one scope"""
+
+    __slots__ = ("wait", "execution", "executed", "failed", "errors")
+
+    def __init__(self, window: float):
+        self.wait = _Histogram(window)
+        self.execution = _Histogram(window)
+        self.executed = 0
+        self.failed = 0  # Command returned a falsy result
+        self.errors = 0  # Command raised
+
+    def record(self, wait: float, execution: float, result: Any, error: bool, now: float):
+        self.wait.observe(wait, now)
+        self.execution.observe(execution, now)
+        self.executed += 1
+        if error:
+            self.errors += 1
+        elif not result:
+            self.failed += 1
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "executed": self.executed,
+            "failed": self.failed,
+            "errors": self.errors,
+            "error_rate": round((self.failed + self.errors) / self.executed, 4) if self.executed else 0.0,
+            "wait": self.wait.recent(),
+            "execution": self.execution.recent(),
+        }
+
+class CommandMetrics:
+    """Per-device and global command queue instrumentation"""
+
+    def __init__(self, window: float = 60.0):
+        self._window = window
+        self.total = _CommandSeries(window)
+        self.devices: Dict[str, _CommandSeries] = {}
+
+    def record(self, device_id: str, wait: float, execution: float, result: Any, error: bool = False):
+        """Record one executed command (wait = enqueue to start, execution = run time)"""
+        now = time.monotonic()
+        series = self.devices.get(device_id)
+        if series is None:
+            series = self.devices[device_id] = _CommandSeries(self._window)
+        series.record(wait, execution, result, error, now)
+        self.total.record(wait, execution, result, error, now)
+
+    def forget(self, device_id: str):
+        """Drop an idle device's series (the global totals keep its history)"""
+        self.devices.pop(device_id, None)
+
+    def summary(self, queue_stats: Dict[str, Any]) -> Dict[str, Any]:
+        """JSON view: global and per-device histograms merged with queue depth"""
+        depths = queue_stats.get("devices", {})
+        devices = {}
+        for device_id in set(self.devices) | set(depths):
+            series = self.devices.get(device_id)
+            devices[device_id] = {
+                "depth": depths.get(device_id, {}).get("depth", 0),
+                **(series.summary() if series is not None else {}),
+            }
+        return {
+            "depth": queue_stats.get("total_depth", 0),
+            **self.total.summary(),
+            "queue": {key: value for key, value in queue_stats.items() if key != "devices"},
+            "devices": devices,
+        }
+
+    def prometheus(self, queue_stats: Dict[str, Any]) -> str:
+        """Prometheus text exposition format (per-device series; aggregate with sum())"""
+        lines: List[str] = []
+
+        def label(device_id: str) -> str:
+            escaped = device_id.replace("\\", "\\\\").replace('"', '\\"')
+            return f'device="{escaped}"'
+
+        def histogram(name: str, help_text: str, attr: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for device_id, series in self.devices.items():
+                hist = getattr(series, attr)
+                base = label(device_id)
+                cumulative = 0
+                for bound, n in zip((*BUCKETS, "+Inf"), hist.counts):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{{{base},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{base}}} {hist.sum}")
+                lines.append(f"{name}_count{{{base}}} {hist.count}")
+
+        def counter(name: str, help_text: str, attr: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for device_id, series in self.devices.items():
+                lines.append(f"{name}{{{label(device_id)}}} {getattr(series, attr)}")
+
+        histogram("command_wait_seconds", "Time from enqueue to execution start", "wait")
+        histogram("command_execution_seconds", "Command execution time", "execution")
+        counter("commands_executed_total", "Commands executed", "executed")
+        counter("commands_failed_total", "Commands that returned a failure", "failed")
+        counter("commands_errors_total", "Commands that raised an exception", "errors")
+
+        lines.append("# HELP command_queue_total_depth Pending commands across all devices")
+        lines.append("# TYPE command_queue_total_depth gauge")
+        lines.append(f"command_queue_total_depth {queue_stats.get('total_depth', 0)}")
+        lines.append("# HELP command_queue_depth Pending commands per device")
+        lines.append("# TYPE command_queue_depth gauge")
+        for device_id, stats in queue_stats.get("devices", {}).items():
+            lines.append(f"command_queue_depth{{{label(device_id)}}} {stats['depth']}")
+
+        lines.append("# HELP commands_expired_total Commands dropped after their deadline")
+        lines.append("# TYPE commands_expired_total counter")
+        for lane, n in queue_stats.get("expired", {}).items():
+            lines.append(f'commands_expired_total{{lane="{lane}"}} {n}')
+
+        lines.append("# HELP command_queue_overflows_total Commands hitting a queue depth limit, by outcome")
+        lines.append("# TYPE command_queue_overflows_total counter")
+        for policy, n in queue_stats.get("overflows", {}).items():
+            lines.append(f'command_queue_overflows_total{{policy="{policy}"}} {n}')
+
+        return "\n".join(lines) + "\n"
+
+# Create a singleton instance
+command_metrics = CommandMetrics()
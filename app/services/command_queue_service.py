@@ -1,13 +1,165 @@
 # app/services/command_queue_service.py
 import asyncio
 import logging
-from typing import Dict, Any, List, Callable, Optional, Awaitable
+import functools
+import math
+import uuid
+from collections import deque
+from enum import IntEnum
+from typing import Dict, Any, List, Callable, Optional, Awaitable, Tuple
 import time
 
+from app.core.command_journal import CommandJournal
+from app.core.config import settings
+from app.core.exceptions import QueueFullError, ScheduleTooFarError
+from app.core.io_executor import run_io
+from app.services.ack_tracker import ack_tracker
+from app.services.command_metrics import command_metrics
+from app.services.rate_limiter import rate_limiter
+
 logger = logging.getLogger(__name__)
 
+def _cancel_barrier(barrier: asyncio.Future, _future: asyncio.Future):
+    if not barrier.done():
+        barrier.cancel()
+
+OVERFLOW_POLICIES = ("reject", "drop_oldest", "drop_newest", "coalesce")
+
+class CommandLane(IntEnum):
+    """Priority classes for queued commands (lower value = served first)"""
+    INTERACTIVE = 0  # Direct user actions (taps in the UI)
+    AUTOMATION = 1  # Scenes, schedules, ramps
+    BACKGROUND = 2  # Polling, housekeeping
+
+class PriorityCommandQueue:
+    """Per-device command queue with one FIFO lane per CommandLane.
+
+    get_nowait() serves the highest-priority non-empty lane. To prevent starvation,
+    a lower lane whose oldest command has waited longer than
+    ``starvation_timeout`` seconds is served first, at most once per
+    ``starvation_timeout`` so higher lanes keep precedence under load.
+
+    Commands with a ``coalesce_key`` are last-write-wins: a pending command
+    with the same key is updated in place, so there is at most one queued
+    command per (device, key).
+    """
+
+    def __init__(self, starvation_timeout: float):
+        self._lanes = [deque() for _ in CommandLane]
+        self._starvation_timeout = starvation_timeout
+        self._last_promotion = 0.0
+        self._pending_by_key: Dict[str, Dict[str, Any]] = {}  # {coalesce_key: queued command}
+        self.promotions = 0  # Commands served early because their lane was starving
+        self.superseded = 0  # Commands replaced by a newer one with the same coalesce key
+        self.expired = 0  # Commands dropped because their deadline passed
+
+    def qsize(self) -> int:
+        return sum(len(lane) for lane in self._lanes)
+
+    def empty(self) -> bool:
+        return not any(self._lanes)
+
+    def put_nowait(self, command: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a command; returns the queued entry (an existing one if coalesced)"""
+        key = command.get("coalesce_key")
+        if key is not None:
+            existing = self._pending_by_key.get(key)
+            if existing is not None:
+                self._supersede(existing, command)
+                return existing
+            self._pending_by_key[key] = command
+
+        self._lanes[command["lane"]].append(command)
+        return command
+
+    def _supersede(self, existing: Dict[str, Any], command: Dict[str, Any]):
+        """Replace a pending command's target with a newer one, keeping its place in line"""
+        existing["func"] = command["func"]
+        existing["args"] = command["args"]
+        existing["kwargs"] = command["kwargs"]
+        existing["id"] = command["id"]
+        existing["deadline"] = command["deadline"]
+        if command["lane"] < existing["lane"]:
+            # A more urgent caller promotes the pending command to its lane
+            self._lanes[existing["lane"]].remove(existing)
+            existing["lane"] = command["lane"]
+            existing["priority"] = int(command["lane"])
+            self._lanes[existing["lane"]].append(existing)
+        self.superseded += 1
+
+    def pop_oldest(self) -> Optional[Dict[str, Any]]:
+        """Remove the oldest command of the lowest-priority non-empty lane"""
+        for lane in reversed(self._lanes):
+            if lane:
+                command = lane.popleft()
+                self._forget(command)
+                return command
+        return None
+
+    def supersede_latest(self, command: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Replace the newest pending command running the same function, if any"""
+        for lane in self._lanes:
+            for existing in reversed(lane):
+                if existing["func"] is command["func"]:
+                    self._supersede(existing, command)
+                    return existing
+        return None
+
+    def _forget(self, command: Dict[str, Any]):
+        key = command.get("coalesce_key")
+        if key is not None and self._pending_by_key.get(key) is command:
+            del self._pending_by_key[key]
+
+    def get_nowait(self) -> Dict[str, Any]:
+        lane = self._select_lane()
+        if lane is None:
+            raise asyncio.QueueEmpty
+        command = lane.popleft()
+        self._forget(command)
+        return command
+
+    def _select_lane(self) -> Optional[deque]:
+        first = next((lane for lane in self._lanes if lane), None)
+        if first is None:
+            return None
+
+        # Serve the longest-waiting lower lane if it has starved
+        now = time.time()
+        if now - self._last_promotion < self._starvation_timeout:
+            return first
+        starved = None
+        for lane in self._lanes:
+            if lane and lane is not first and now - lane[0]["timestamp"] >= self._starvation_timeout:
+                if starved is None or lane[0]["timestamp"] < starved[0]["timestamp"]:
+                    starved = lane
+        if starved is not None:
+            self._last_promotion = now
+            self.promotions += 1
+            return starved
+        return first
+
 class CommandQueueService:
-    """Service for managing command queues for devices"""
+    """Service for managing command queues for devices.
+
+    Commands run on a fixed pool of ``COMMAND_WORKERS`` workers shared by all
+    devices. A device with queued commands is put on a ready queue; workers
+    take devices round-robin, run one command per turn and re-queue the device
+    if it has more. A device is never run by two workers at once (per-device
+    ordering) and is only made ready when its rate limiter allows (spacing).
+    Empty queues are dropped after ``COMMAND_QUEUE_IDLE_TTL``, so memory scales
+    with active devices rather than every device ever seen.
+
+    Queues are bounded per device (``COMMAND_QUEUE_MAX_DEPTH``) and in total
+    (``COMMAND_QUEUE_MAX_TOTAL``); see ``add_command`` for overflow policies.
+
+    ``fan_out`` queues one command per device behind a barrier: a device
+    whose fan-out command comes up is held (without occupying a worker) until
+    every device has reached it, then all publishes go out in one burst.
+
+    With ``COMMAND_QUEUE_DURABLE``, commands whose function was registered
+    with ``register_command`` are also written (in batches) to a CommandJournal
+    and replayed on ``start()`` after a restart, unless they have expired.
+    """
     _instance = None
     
     def __new__(cls):
@@ -21,14 +173,106 @@ class CommandQueueService:
             return
             
         self._initialized = True
-        self._device_queues: Dict[str, asyncio.Queue] = {}
-        self._processing_tasks: Dict[str, asyncio.Task] = {}
+        self._device_queues: Dict[str, PriorityCommandQueue] = {}
+        self._ready: Optional[asyncio.Queue] = None  # Device IDs with a command ready to run
+        self._scheduled: set = set()  # Devices on the ready queue or waiting for a token
+        self._active: set = set()  # Devices whose command is running right now
+        self._held: Dict[str, Dict[str, Any]] = {}  # {device_id: fan-out command waiting at its barrier}
+        self._fan_out_max_delay = settings.COMMAND_FAN_OUT_MAX_DELAY
+        self._idle_since: Dict[str, float] = {}
+        self._total_depth = 0
+        self._max_depth = settings.COMMAND_QUEUE_MAX_DEPTH
+        self._max_total = settings.COMMAND_QUEUE_MAX_TOTAL
+        self._overflow = settings.COMMAND_QUEUE_OVERFLOW
+        self._overflow_counts = {policy: 0 for policy in OVERFLOW_POLICIES}
+        self._workers: List[asyncio.Task] = []
+        self._reaper: Optional[asyncio.Task] = None
+        self._worker_count = settings.COMMAND_WORKERS
+        self._idle_ttl = settings.COMMAND_QUEUE_IDLE_TTL
         self._command_delay = 0.4  # 400ms între comenzi consecutive
         self._running = True
+        self._starvation_timeout = settings.COMMAND_STARVATION_TIMEOUT
+        self._ttl = {
+            CommandLane.INTERACTIVE: settings.COMMAND_TTL_INTERACTIVE,
+            CommandLane.AUTOMATION: settings.COMMAND_TTL_AUTOMATION,
+            CommandLane.BACKGROUND: settings.COMMAND_TTL_BACKGROUND,
+        }
+        self._expired = {lane.name.lower(): 0 for lane in CommandLane}
+        self._registry: Dict[str, Callable[..., Awaitable[Any]]] = {}  # {name: command function}
+        self._command_names: Dict[Callable[..., Awaitable[Any]], str] = {}
+        self._journal = CommandJournal(settings.COMMAND_QUEUE_FILE, fsync=settings.COMMAND_QUEUE_FSYNC) if settings.COMMAND_QUEUE_DURABLE else None
+        self._journal_buffer: List[Dict[str, Any]] = []
+        self._journal_task: Optional[asyncio.Task] = None
+        self._stats = {"superseded": 0, "reaped": 0, "replayed": 0, "fan_outs": 0, "fan_out_last_spread": 0.0, "fan_out_max_spread": 0.0}
+        
+    def register_command(self, name: str, command_func: Callable[..., Awaitable[Any]]):
+        """Register a command function under a stable name so it can be persisted and replayed"""
+        self._registry[name] = command_func
+        self._command_names[command_func] = name
+    
+    async def start(self):
+        """Start the worker pool and replay commands left pending by the previous run"""
+        self._ensure_workers()
+        if self._journal is None:
+            return
         
+        records = await run_io(self._journal.replay)
+        now = time.time()
+        for record in records:
+            command_func = self._registry.get(record["name"])
+            lane = CommandLane(record["lane"])
+            if command_func is None:
+                logger.warning(f"Dropping persisted command with unknown function {record['name']}")
+                self._journal_buffer.append({"op": "done", "id": record["entry_id"]})
+                continue
+            if record["deadline"] is not None and now > record["deadline"]:
+                self._expired[lane.name.lower()] += 1
+                self._journal_buffer.append({"op": "done", "id": record["entry_id"]})
+                continue
+            command = {
+                **record,
+                "func": command_func,
+                "lane": lane,
+                "id": id(command_func),
+                "future": asyncio.get_running_loop().create_future(),
+                "durable": True,
+                "barrier": None,
+            }
+            del command["name"]
+            
+            # Same depth limits and overflow policy as add_command
+            device_id = record["device_id"]
+            queue = self._device_queues.get(device_id)
+            coalesces = queue is not None and command["coalesce_key"] is not None and command["coalesce_key"] in queue._pending_by_key
+            if not coalesces:
+                try:
+                    full = self._check_overflow(device_id, command, self._overflow)
+                except QueueFullError as e:
+                    logger.warning(f"Dropping persisted command for device {device_id}: {e}")
+                    full = command
+                if full is not None:
+                    # Dropped or merged into a pending command
+                    self._journal_buffer.append({"op": "done", "id": record["entry_id"]})
+                    continue
+            queued = self._enqueue(device_id, command)
+            if queued is not command:
+                # Merged into a pending command with the same key: persist its new target
+                self._journal_buffer.append({"op": "done", "id": record["entry_id"]})
+                self._journal_buffer.append({"op": "add", "id": queued["entry_id"], "command": self._journal_record(device_id, queued)})
+            self._stats["replayed"] += 1
+        
+        if records:
+            logger.info(f"Replayed {self._stats['replayed']} of {len(records)} persisted commands")
+        self._journal_task = asyncio.create_task(self._journal_loop())
+    
     def set_command_delay(self, delay_seconds: float):
-        """Set the delay between consecutive commands"""
+        """Set the initial delay between consecutive commands.
+
+        Each device then adapts its own rate to how fast it acknowledges
+        commands (see AdaptiveRateLimiter).
+        """
         self._command_delay = max(0.1, min(2.0, delay_seconds))  # Limitați între 100ms și 2s
+        rate_limiter.set_initial_rate(1 / self._command_delay)
         logger.info(f"Command delay set to {self._command_delay} seconds")
         
     async def add_command(self, 
@@ -36,29 +280,188 @@ class CommandQueueService:
                          command_func: Callable[..., Awaitable[bool]], 
                          command_args: List[Any] = None, 
                          command_kwargs: Dict[str, Any] = None,
-                         priority: int = 0):
-        """Add a command to a device's queue"""
-        # Ensure the device has a queue
-        if device_id not in self._device_queues:
-            self._device_queues[device_id] = asyncio.Queue()
-            # Start a processing task for this device
-            self._processing_tasks[device_id] = asyncio.create_task(
-                self._process_device_queue(device_id)
-            )
-            
+                         priority: int = CommandLane.INTERACTIVE,
+                         coalesce_key: Optional[str] = None,
+                         ttl: Optional[float] = None,
+                         overflow: Optional[str] = None,
+                         barrier: Optional[asyncio.Future] = None) -> asyncio.Future:
+        """Add a command to a device's queue.
+
+        ``priority`` is a CommandLane (values outside the range are clamped).
+        A command not started within ``ttl`` seconds (default: the lane's
+        COMMAND_TTL_* setting, 0 = never) is dropped and resolves False.
+        
+        When the device or global depth limit is reached, ``overflow``
+        (default COMMAND_QUEUE_OVERFLOW) decides: "reject" raises
+        QueueFullError, "drop_oldest" discards the oldest lowest-priority
+        command, "drop_newest" discards this command and "coalesce" merges it
+        into the newest pending command with the same function (rejecting if
+        there is none). Dropped commands resolve False. Commands that coalesce
+        by ``coalesce_key`` never add depth and are always accepted.
+        If ``coalesce_key`` is given and a command with the same key is still
+        pending for the device, that command is updated with the new target
+        instead (last write wins) and both callers share its result.
+        ``barrier`` is used by ``fan_out``.
+        Returns a future resolved with the command's result once it has run.
+        """
         # Create command object
+        lane = CommandLane(max(CommandLane.INTERACTIVE, min(CommandLane.BACKGROUND, int(priority))))
+        now = time.time()
+        ttl = self._ttl[lane] if ttl is None else ttl
         command = {
             "func": command_func,
             "args": command_args or [],
             "kwargs": command_kwargs or {},
-            "timestamp": time.time(),
-            "priority": priority,  # Lower values = higher priority
-            "id": id(command_func)  # Unique identifier for the command
+            "timestamp": now,
+            "deadline": now + ttl if ttl else None,
+            "priority": int(lane),  # Lower values = higher priority
+            "lane": lane,
+            "id": id(command_func),  # Unique identifier for the command
+            "coalesce_key": coalesce_key,
+            "entry_id": uuid.uuid4().hex,
+            "future": asyncio.get_running_loop().create_future(),
+            "durable": self._journal is not None and command_func in self._command_names,
+            "barrier": barrier,
         }
         
+        # Enforce depth limits unless the command just replaces a pending one
+        queue = self._device_queues.get(device_id)
+        coalesces = queue is not None and coalesce_key is not None and coalesce_key in queue._pending_by_key
+        if not coalesces:
+            full = self._check_overflow(device_id, command, overflow or self._overflow)
+            if full is not None:
+                return full["future"]
+        
         # Add to the device's queue
-        await self._device_queues[device_id].put(command)
-        logger.debug(f"Command added to queue for device {device_id}")
+        queued = self._enqueue(device_id, command)
+        if queued["durable"]:
+            self._journal_buffer.append({"op": "add", "id": queued["entry_id"], "command": self._journal_record(device_id, queued)})
+        return queued["future"]
+    
+    def _enqueue(self, device_id: str, command: Dict[str, Any]) -> Dict[str, Any]:
+        """Put a command on the device's queue; returns the queued entry"""
+        self._ensure_workers()
+        
+        # Ensure the device has a queue
+        if device_id not in self._device_queues:
+            self._device_queues[device_id] = PriorityCommandQueue(self._starvation_timeout)
+        
+        queued = self._device_queues[device_id].put_nowait(command)
+        if queued is command:
+            self._total_depth += 1
+        if queued is not command:
+            self._stats["superseded"] += 1
+            logger.debug(f"Pending '{command['coalesce_key']}' command for device {device_id} superseded")
+            # The pending entry now runs the newer command's function
+            if queued["durable"] and not command["durable"]:
+                self._journal_done(queued)
+            queued["durable"] = command["durable"]
+        else:
+            logger.debug(f"Command added to {command['lane'].name.lower()} lane for device {device_id}")
+            self._idle_since.pop(device_id, None)
+            self._schedule(device_id)
+        return queued
+    
+    def _check_overflow(self, device_id: str, command: Dict[str, Any], policy: str) -> Optional[Dict[str, Any]]:
+        """Apply the overflow policy if a depth limit is reached.
+
+        Returns the command that now stands for the new one (dropped or merged),
+        or None if the new command should be queued normally.
+        """
+        queue = self._device_queues.get(device_id)
+        depth = queue.qsize() if queue is not None else 0
+        if depth >= self._max_depth:
+            scope, victim_queue, limit, current = "device", queue, self._max_depth, depth
+        elif self._total_depth >= self._max_total:
+            # Make room in the deepest queue
+            victim_queue = max(self._device_queues.values(), key=lambda q: q.qsize(), default=None)
+            scope, limit, current = "global", self._max_total, self._total_depth
+        else:
+            return None
+        
+        if policy == "drop_oldest" and victim_queue is not None and not victim_queue.empty():
+            self._overflow_counts["drop_oldest"] += 1
+            self._release(victim_queue.pop_oldest())
+            logger.warning(f"Command queue {scope} limit {limit} reached, dropped oldest command")
+            return None
+        
+        if policy == "drop_newest":
+            self._overflow_counts["drop_newest"] += 1
+            logger.warning(f"Command queue {scope} limit {limit} reached, dropped new command for device {device_id}")
+            command["future"].set_result(False)
+            return command
+        
+        if policy == "coalesce" and queue is not None:
+            merged = queue.supersede_latest(command)
+            if merged is not None:
+                self._overflow_counts["coalesce"] += 1
+                self._stats["superseded"] += 1
+                if merged["durable"]:
+                    self._journal_buffer.append({"op": "add", "id": merged["entry_id"], "command": self._journal_record(device_id, merged)})
+                return merged
+        
+        # Reject: tell the caller roughly when the device queue will have room
+        retry_after = math.ceil(current / rate_limiter.rate(device_id)) if scope == "device" else 1
+        self._overflow_counts["reject"] += 1
+        raise QueueFullError(device_id, current, limit, retry_after, scope)
+    
+    def _release(self, command: Dict[str, Any]):
+        """Account for a command removed without running and release its waiter"""
+        self._total_depth -= 1
+        self._journal_done(command)
+        if not command["future"].done():
+            command["future"].set_result(False)
+    
+    def _journal_record(self, device_id: str, command: Dict[str, Any]) -> Dict[str, Any]:
+        """Serializable form of a queued command"""
+        return {
+            "entry_id": command["entry_id"],
+            "device_id": device_id,
+            "name": self._command_names[command["func"]],
+            "args": command["args"],
+            "kwargs": command["kwargs"],
+            "lane": int(command["lane"]),
+            "priority": command["priority"],
+            "timestamp": command["timestamp"],
+            "deadline": command["deadline"],
+            "coalesce_key": command["coalesce_key"],
+        }
+    
+    def _journal_done(self, command: Dict[str, Any]):
+        if command.get("durable"):
+            self._journal_buffer.append({"op": "done", "id": command["entry_id"]})
+    
+    async def _journal_loop(self):
+        """Write buffered journal records in batches"""
+        while self._running:
+            try:
+                await asyncio.sleep(settings.COMMAND_QUEUE_FLUSH_INTERVAL)
+                await self._flush_journal()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error writing command journal: {e}")
+    
+    async def _flush_journal(self):
+        if not self._journal_buffer:
+            return
+        records, self._journal_buffer = self._journal_buffer, []
+        await run_io(self._journal.append, records)
+        if self._journal.should_compact(settings.COMMAND_QUEUE_COMPACT_THRESHOLD):
+            await run_io(self._journal.compact)
+        
+    async def run_command(self,
+                          device_id: str,
+                          command_func: Callable[..., Awaitable[bool]],
+                          command_args: List[Any] = None,
+                          command_kwargs: Dict[str, Any] = None,
+                          priority: int = CommandLane.INTERACTIVE,
+                          coalesce_key: Optional[str] = None,
+                          ttl: Optional[float] = None,
+                          overflow: Optional[str] = None) -> Any:
+        """Queue a command for a device and wait for its result"""
+        future = await self.add_command(device_id, command_func, command_args, command_kwargs, priority, coalesce_key, ttl, overflow)
+        return await future
         
     async def add_bulk_command(self,
                               device_ids: List[str],
@@ -66,7 +469,8 @@ class CommandQueueService:
                               command_args: List[Any] = None,
                               command_kwargs: Dict[str, Any] = None,
                               sequential: bool = True,
-                              bypass_queue: bool = False):  # Parameter for direct execution
+                              bypass_queue: bool = False,  # Parameter for direct execution
+                              priority: int = CommandLane.INTERACTIVE):
         """Add the same command to multiple devices' queues with coordination"""
         base_timestamp = time.time()
         results = {}
@@ -101,12 +505,9 @@ class CommandQueueService:
             
             return results
         
-        # Original queue-based implementation
-        for index, device_id in enumerate(device_ids):
-            # If sequential processing is requested, add increasing delays
-            delay_factor = index if sequential else 0
-            priority = delay_factor
-            
+        # Original queue-based implementation; commands for one lane are served
+        # FIFO, so devices are processed in the order given
+        for device_id in device_ids:
             # Create a copy of args for this device
             args_copy = list(command_args) if command_args else []
             # Replace None with device_id if that's the pattern
@@ -128,62 +529,286 @@ class CommandQueueService:
         logger.info(f"Bulk command added for {len(device_ids)} devices")
         return {device_id: True for device_id in device_ids}  # Return pending results
             
-    async def _process_device_queue(self, device_id: str):
-        """Process commands for a specific device"""
-        logger.info(f"Started command queue processor for device {device_id}")
-        
-        last_command_time = 0
-        
+    async def fan_out(self,
+                      publishes: Dict[str, Callable[[], bool]],
+                      at: Optional[float] = None,
+                      priority: int = CommandLane.INTERACTIVE) -> Tuple[Dict[str, bool], float]:
+        """Run prepared publishes for many devices in one tight burst.
+
+        ``publishes`` maps device IDs to synchronous callables whose topic and
+        payload are already built. Each is queued on its device like any other
+        command (depth limits, TTL, rate limiting), so it runs after the
+        device's earlier commands. A device that reaches its fan-out command
+        waits there; once all have, the burst runs without yielding to the
+        event loop. With ``at`` (Unix time, at most COMMAND_FAN_OUT_MAX_DELAY
+        ahead, else ScheduleTooFarError) the burst is held until that instant.
+        Devices still busy when the lane's TTL runs out are left out.
+
+        If any device rejects the command (QueueFullError), nothing is
+        published. Returns per-device results and the spread in seconds
+        between the first and last publish.
+        """
+        if at is not None and at - time.time() > self._fan_out_max_delay:
+            raise ScheduleTooFarError(at, self._fan_out_max_delay)
+
+        loop = asyncio.get_running_loop()
+        barriers: Dict[str, asyncio.Future] = {}
+        released = False
+        try:
+            for device_id, publish in publishes.items():
+                barrier = barriers[device_id] = loop.create_future()
+                future = await self.add_command(device_id, publish, priority=priority, barrier=barrier)
+                # Dropped, expired or cleared before reaching the barrier
+                future.add_done_callback(functools.partial(_cancel_barrier, barrier))
+
+            # Devices that do not reach the barrier within the lane's TTL miss the burst
+            if barriers:
+                lane = CommandLane(max(CommandLane.INTERACTIVE, min(CommandLane.BACKGROUND, int(priority))))
+                _, late = await asyncio.wait(barriers.values(), timeout=self._ttl[lane] or None)
+                for barrier in late:
+                    barrier.cancel()
+                if late:
+                    logger.warning(f"{len(late)} of {len(barriers)} devices missed the fan-out barrier")
+            if at is not None:
+                delay = at - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                elif delay < -1:
+                    logger.warning(f"Fan-out scheduled {-delay:.2f}s in the past, publishing now")
+
+            results = {}
+            first = last = None
+            started = time.time()
+            for device_id, publish in publishes.items():
+                barrier = barriers[device_id]
+                if barrier.cancelled() or barrier.result()["future"].done() or not self._running:
+                    results[device_id] = False
+                    continue
+                last = time.perf_counter()
+                if first is None:
+                    first = last
+                try:
+                    results[device_id] = bool(publish())
+                except Exception as e:
+                    logger.error(f"Error publishing fan-out command for device {device_id}: {e}")
+                    results[device_id] = False
+
+            for device_id, barrier in barriers.items():
+                if not barrier.cancelled():
+                    self._release_held(device_id, barrier.result(), results[device_id], started)
+            released = True
+        finally:
+            if not released:
+                # Rejected or cancelled: withdraw every command of the burst
+                for device_id, barrier in barriers.items():
+                    if not barrier.done():
+                        barrier.cancel()
+                    elif not barrier.cancelled():
+                        self._release_held(device_id, barrier.result(), False, time.time())
+
+        spread = last - first if first is not None else 0.0
+        self._stats["fan_outs"] += 1
+        self._stats["fan_out_last_spread"] = spread
+        self._stats["fan_out_max_spread"] = max(self._stats["fan_out_max_spread"], spread)
+        return results, spread
+
+    def _release_held(self, device_id: str, command: Dict[str, Any], result: bool, started: float):
+        """Resolve a fan-out command held at its barrier and let the device continue"""
+        if self._held.get(device_id) is command:
+            del self._held[device_id]
+        if command["future"].done():
+            return
+        command_metrics.record(device_id, started - command["timestamp"], time.time() - started, result, False)
+        command["future"].set_result(result)
+        queue = self._device_queues.get(device_id)
+        if queue is None:
+            return
+        if not queue.empty():
+            self._schedule(device_id)
+        else:
+            self._idle_since[device_id] = time.time()
+            
+    def _ensure_workers(self):
+        """Start the shared worker pool on first use (needs a running loop)"""
+        if self._ready is not None:
+            return
+        self._ready = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self._worker_count)]
+        self._reaper = asyncio.create_task(self._reap_idle_queues())
+        logger.info(f"Started command worker pool with {self._worker_count} workers")
+    
+    def _schedule(self, device_id: str):
+        """Make a device ready once its rate limiter allows the next command"""
+        if not self._running or device_id in self._scheduled or device_id in self._active or device_id in self._held:
+            return
+        self._scheduled.add(device_id)
+        delay = rate_limiter.delay(device_id)
+        if delay:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, device_id)
+        else:
+            self._ready.put_nowait(device_id)
+    
+    async def _worker(self, index: int):
+        """Run one command at a time for whichever device is ready next"""
         while self._running:
             try:
-                # Get the next command
-                command = await self._device_queues[device_id].get()
-                
-                # Calculate delay to ensure minimum time between commands
-                time_since_last = time.time() - last_command_time
-                if time_since_last < self._command_delay:
-                    await asyncio.sleep(self._command_delay - time_since_last)
+                device_id = await self._ready.get()
+                self._scheduled.discard(device_id)
+                queue = self._device_queues.get(device_id)
+                if queue is None or queue.empty():
+                    continue
                 
-                # Execute the command
-                func = command["func"]
-                args = command["args"]
-                kwargs = command["kwargs"]
+                # A token may have been taken since the device was scheduled
+                if rate_limiter.delay(device_id):
+                    self._schedule(device_id)
+                    continue
                 
-                logger.debug(f"Executing command for device {device_id}")
+                self._active.add(device_id)
                 try:
-                    result = await func(*args, **kwargs)
-                    logger.debug(f"Command result for device {device_id}: {result}")
-                except Exception as e:
-                    logger.error(f"Error executing command for device {device_id}: {e}")
+                    held = await self._run_next(device_id, queue)
+                finally:
+                    self._active.discard(device_id)
                 
-                # Mark command as done
-                self._device_queues[device_id].task_done()
+                # fan_out releases the device once the whole burst is published
+                if held:
+                    continue
                 
-                # Update last command time
-                last_command_time = time.time()
+                # Back of the line if the device has more work (round-robin)
+                if not queue.empty():
+                    self._schedule(device_id)
+                else:
+                    self._idle_since[device_id] = time.time()
                 
             except asyncio.CancelledError:
-                logger.info(f"Command queue processor for device {device_id} cancelled")
                 break
             except Exception as e:
-                logger.error(f"Error in command queue processor for device {device_id}: {e}")
-                # Add a small delay to prevent tight loops on persistent errors
-                await asyncio.sleep(1)
+                logger.error(f"Error in command worker {index}: {e}")
+    
+    async def _run_next(self, device_id: str, queue: PriorityCommandQueue) -> bool:
+        """Execute the device's next unexpired command and resolve its future.
+
+        Returns True if the command is a fan-out command now held at its barrier.
+        """
+        while True:
+            command = queue.get_nowait()
+            self._total_depth -= 1
+            if command["deadline"] is None or time.time() <= command["deadline"]:
+                break
+            self._drop_expired(device_id, queue, command)
+            if queue.empty():
+                return False
+        
+        barrier = command["barrier"]
+        if barrier is not None:
+            if barrier.done():
+                # The fan-out was withdrawn
+                if not command["future"].done():
+                    command["future"].set_result(False)
+                return False
+            rate_limiter.consume(device_id)
+            self._held[device_id] = command
+            barrier.set_result(command)
+            return True
+        
+        rate_limiter.consume(device_id)
+        future = command["future"]
+        
+        logger.debug(f"Executing command for device {device_id}")
+        started = time.time()
+        error = False
+        try:
+            result = await command["func"](*command["args"], **command["kwargs"])
+            logger.debug(f"Command result for device {device_id}: {result}")
+        except asyncio.CancelledError:
+            # Shutdown interrupted the command; a durable one stays in the journal
+            if not future.done():
+                future.set_result(False)
+            raise
+        except Exception as e:
+            logger.error(f"Error executing command for device {device_id}: {e}")
+            result = False
+            error = True
+        command_metrics.record(device_id, started - command["timestamp"], time.time() - started, result, error)
+        if not future.done():
+            future.set_result(result)
+        
+        # Mark command as done
+        self._journal_done(command)
+        return False
+    
+    def _drop_expired(self, device_id: str, queue: PriorityCommandQueue, command: Dict[str, Any]):
+        """Discard a command whose deadline passed before it could run"""
+        queue.expired += 1
+        self._expired[command["lane"].name.lower()] += 1
+        age = time.time() - command["timestamp"]
+        logger.warning(f"Dropped expired {command['lane'].name.lower()} command for device {device_id} (queued {age:.1f}s ago)")
+        if not command["future"].done():
+            command["future"].set_result(False)
+        self._journal_done(command)
+    
+    async def _reap_idle_queues(self):
+        """Drop device queues that have been empty for longer than the idle TTL"""
+        while self._running:
+            try:
+                await asyncio.sleep(self._idle_ttl / 2)
+                cutoff = time.time() - self._idle_ttl
+                for device_id, since in list(self._idle_since.items()):
+                    queue = self._device_queues.get(device_id)
+                    if since > cutoff or device_id in self._active or device_id in self._scheduled or device_id in self._held:
+                        continue
+                    if queue is not None and not queue.empty():
+                        continue
+                    self._device_queues.pop(device_id, None)
+                    del self._idle_since[device_id]
+                    # Per-device state elsewhere goes with the queue
+                    rate_limiter.forget(device_id)
+                    ack_tracker.forget(device_id)
+                    command_metrics.forget(device_id)
+                    self._stats["reaped"] += 1
+                    logger.debug(f"Dropped idle command queue for device {device_id}")
+            except asyncio.CancelledError:
+                break
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue depth and coalescing counters per device and in total"""
+        devices = {
+            device_id: {
+                "depth": queue.qsize(),
+                "superseded": queue.superseded,
+                "promotions": queue.promotions,
+                "expired": queue.expired,
+            }
+            for device_id, queue in self._device_queues.items()
+        }
+        return {
+            "workers": len(self._workers),
+            "queues": len(self._device_queues),
+            "ready": self._ready.qsize() if self._ready is not None else 0,
+            "active": len(self._active),
+            "held": len(self._held),
+            "reaped": self._stats["reaped"],
+            "replayed": self._stats["replayed"],
+            "total_depth": self._total_depth,
+            "limits": {"device": self._max_depth, "total": self._max_total, "overflow": self._overflow},
+            "overflows": dict(self._overflow_counts),
+            "superseded": self._stats["superseded"],
+            "expired": dict(self._expired),
+            "fan_out": {
+                "count": self._stats["fan_outs"],
+                "last_spread_ms": round(self._stats["fan_out_last_spread"] * 1000, 3),
+                "max_spread_ms": round(self._stats["fan_out_max_spread"] * 1000, 3),
+            },
+            "devices": devices,
+        }
     
     async def clear_queue(self, device_id: str):
         """Clear all pending commands for a device"""
-        if device_id in self._device_queues:
-            # Create a new queue to replace the existing one
-            old_queue = self._device_queues[device_id]
-            self._device_queues[device_id] = asyncio.Queue()
-            
-            # Clear the old queue
-            while not old_queue.empty():
-                try:
-                    old_queue.get_nowait()
-                    old_queue.task_done()
-                except asyncio.QueueEmpty:
-                    break
+        queue = self._device_queues.get(device_id)
+        if queue is not None:
+            # Drain the queue; waiters see the command as not executed
+            while not queue.empty():
+                self._release(queue.get_nowait())
+            self._idle_since[device_id] = time.time()
             
             logger.info(f"Command queue cleared for device {device_id}")
     
@@ -191,17 +816,33 @@ class CommandQueueService:
         """Shutdown the command queue service"""
         self._running = False
         
-        # Cancel all processing tasks
-        for device_id, task in self._processing_tasks.items():
+        # Cancel the worker pool
+        tasks = [task for task in (*self._workers, self._reaper, self._journal_task) if task is not None]
+        for task in tasks:
             if not task.done():
                 task.cancel()
                 
         # Wait for tasks to finish
-        for device_id, task in self._processing_tasks.items():
+        for task in tasks:
             try:
                 await task
             except asyncio.CancelledError:
                 pass
+        
+        # Pending durable commands stay in the journal for the next start
+        if self._journal is not None:
+            await self._flush_journal()
+        
+        # Release anyone still waiting on a queued or held command
+        for command in self._held.values():
+            if not command["future"].done():
+                command["future"].set_result(False)
+        self._held.clear()
+        for queue in self._device_queues.values():
+            while not queue.empty():
+                command = queue.get_nowait()
+                if not command["future"].done():
+                    command["future"].set_result(False)
             
         logger.info("Command queue service shut down")
 
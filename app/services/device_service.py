@@ -1,36 +1,34 @@
 # app/services/device_service.py
 from typing import List, Dict, Any, Optional
 import logging
-from app.repositories.device_repository import DeviceRepository
+from app.repositories.device_repository import device_repository
 from app.services.mqtt_service import mqtt_service
-from app.services.websocket_service import manager
 from app.integration.registry import device_registry
 
 logger = logging.getLogger(__name__)
 
 class DeviceService:
     def __init__(self):
-        self._device_repository = DeviceRepository()
-        # Register WebSocket broadcast as a callback for MQTT status updates
+        self._device_repository = device_repository
+        # Keep the registry in sync with MQTT status updates
+        # (WebSocket clients are served by the periodic broadcast in ConnectionManager)
         mqtt_service.register_status_callback(self._on_device_status_update)
         
-    async def _on_device_status_update(self, device_id: str, status: Dict[str, Any]):
-        # Update device in registry if it exists
-        device = device_registry.get_device(device_id)
-        if device:
-            device.update_status(status)
+    async def _on_device_status_update(self, changes: Dict[str, Dict[str, Any]]):
+        # Update devices in registry if they exist
+        for device_id, status in changes.items():
+            device = device_registry.get_device(device_id)
+            if device:
+                device.update_status(status)
         
-        # Broadcast status to WebSocket clients
-        await manager.broadcast_device_status(device_id, status)
+    async def get_all_devices(self) -> List[Dict[str, Any]]:
+        return await self._device_repository.get_all()
         
-    def get_all_devices(self) -> List[Dict[str, Any]]:
-        return self._device_repository.load_devices()
+    async def get_device_by_id(self, device_id: str) -> Optional[Dict[str, Any]]:
+        return await self._device_repository.get(device_id)
         
-    def get_device_by_id(self, device_id: str) -> Optional[Dict[str, Any]]:
-        return self._device_repository.get_device_by_id(device_id)
-        
-    def update_device(self, device_id: str, updates: Dict[str, Any]) -> bool:
-        return self._device_repository.update_device(device_id, updates)
+    async def update_device(self, device_id: str, updates: Dict[str, Any]) -> bool:
+        return await self._device_repository.update(device_id, updates)
 
 # Singleton instance
 device_service = DeviceService()
\ No newline at end of file
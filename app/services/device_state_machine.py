@@ -1,7 +1,14 @@
 import asyncio
 import logging
-from typing import Dict, Any
-import json
+from typing import Dict, Any, List, Tuple, Callable, Awaitable
+import inspect
+
+from app.core.device_store import device_store
+from app.core.topic_trie import TopicTrie
+from app.integration.producers.shelly import common as shelly
+from app.repositories.device_repository import device_repository
+from app.services.ack_tracker import ack_tracker
+from app.services.telemetry_service import telemetry_service
 
 logger = logging.getLogger(__name__)
 
@@ -9,14 +16,83 @@ class DeviceStateMachine:
     def __init__(self):
         self.devices: Dict[str, Dict[str, Any]] = {}
         self.lock = asyncio.Lock()  # Pentru a preveni accesul concurent
+        self.listeners: List[Callable[[Dict[str, Dict[str, Any]]], Awaitable[None]]] = []
+        self._staged: Dict[str, Dict[str, Any]] = {}  # Modificările lotului în curs, pe dispozitiv
+        # Amprenta ultimului payload pe topic: (lungime, hash, ultima comandă trimisă dispozitivului)
+        self._fingerprints: Dict[str, Tuple[int, int, int]] = {}
+        self._dedup = {"messages": 0, "duplicates": 0}
+
+        # Fiecare tip de topic are parserul lui (fără potriviri pe subșiruri)
+        self.topics = TopicTrie()
+        self.topics.add(shelly.STATUS_TOPIC_FILTER, self._on_status)
+        self.topics.add(f"{shelly.MQTT_TOPIC_PREFIX}/+/light/+/status", self._on_status)
+        self.topics.add(shelly.POWER_TOPIC_FILTER, self._on_meter)
+        self.topics.add(shelly.ENERGY_TOPIC_FILTER, self._on_meter)
+        self.topics.add(shelly.ONLINE_TOPIC_FILTER, self._on_online)
+        self.topics.add(f"{shelly.MQTT_TOPIC_PREFIX}/+/sensor/+", self._on_sensor)
+        self.topics.add(shelly.ANNOUNCE_TOPIC, self._on_announce)
+        # Citirile repetate de putere/energie sunt eșantioane pentru seria de timp: fără deduplicare
+        self._undeduplicated = TopicTrie()
+        self._undeduplicated.add(shelly.POWER_TOPIC_FILTER, True)
+        self._undeduplicated.add(shelly.ENERGY_TOPIC_FILTER, True)
+
+    def add_listener(self, callback: Callable[[Dict[str, Dict[str, Any]]], Awaitable[None]]):
+        """Înregistrează un callback apelat cu setul de modificări {device_id: status} al fiecărui lot"""
+        self.listeners.append(callback)
+
+    def seed(self, states: Dict[str, Dict[str, Any]]) -> int:
+        """Pornire la cald: preia starea persistată pentru dispozitivele care nu au raportat încă"""
+        seeded = 0
+        for device_id, status in states.items():
+            if device_id not in self.devices:
+                self.devices[device_id] = dict(status)
+                seeded += 1
+        return seeded
 
     async def update_device(self, device_id: str, status: Dict[str, Any]):
         """Actualizează starea unui dispozitiv"""
+        await self._apply({device_id: status})
+
+    def _stage(self, device_id: str, status: Dict[str, Any]):
+        """Adaugă o actualizare la setul de modificări al lotului curent"""
+        staged = self._staged.get(device_id)
+        if staged is None:
+            self._staged[device_id] = dict(status)
+        else:
+            staged.update(status)
+
+    async def _apply(self, changes: Dict[str, Dict[str, Any]]):
+        """Aplică un set de modificări sub o singură achiziție a lock-ului"""
+        if not changes:
+            return
         async with self.lock:
-            if device_id not in self.devices:
-                self.devices[device_id] = {}
-            self.devices[device_id].update(status)
+            for device_id, status in changes.items():
+                device = self.devices.get(device_id)
+                if device is None:
+                    self.devices[device_id] = dict(status)
+                else:
+                    device.update(status)
+        if len(changes) == 1:
+            device_id, status = next(iter(changes.items()))
             logger.info(f"Updated state for device {device_id}: {status}")
+        else:
+            logger.info(f"Updated state for {len(changes)} devices")
+            logger.debug(f"State changes: {changes}")
+
+        # Persistă câmpurile raportate prin repository (valorile lipsă nu suprascriu starea)
+        reported = {}
+        for device_id, status in changes.items():
+            fields = {key: value for key, value in status.items() if value is not None}
+            if fields and await device_repository.resolve(device_id):
+                reported[device_id] = fields
+        if reported:
+            await device_repository.update_many(reported)
+
+        for callback in self.listeners:
+            try:
+                await callback(changes)
+            except Exception as e:
+                logger.error(f"State change listener failed: {e}")
 
     async def get_device_status(self, device_id: str) -> Dict[str, Any]:
         """Obține statusul unui dispozitiv"""
@@ -28,38 +104,117 @@ class DeviceStateMachine:
         async with self.lock:
             return self.devices.copy()
 
+    async def handle_messages(self, messages: List[Tuple[str, bytes]]):
+        """Procesează un lot de mesaje MQTT în ordinea sosirii și aplică modificările o singură dată"""
+        repeated = set()
+        for topic, payload in messages:
+            try:
+                if self._undeduplicated.match(topic):
+                    await self._dispatch(topic, payload)
+                    continue
+                self._dedup["messages"] += 1
+                device_id = self._device_id(topic)
+                # Payload identic pe același topic: doar last_seen se actualizează. O comandă
+                # trimisă între timp schimbă amprenta, ca raportul următor să fie procesat complet.
+                fingerprint = (len(payload), hash(payload), ack_tracker.command_sequence(device_id))
+                if self._fingerprints.get(topic) == fingerprint:
+                    self._dedup["duplicates"] += 1
+                    repeated.add(device_id)
+                    continue
+                if await self._dispatch(topic, payload):
+                    self._fingerprints[topic] = fingerprint
+            except Exception as e:
+                logger.error(f"Unexpected error processing message for topic {topic}: {e}")
+
+        changes, self._staged = self._staged, {}
+        await self._apply(changes)
+
+        seen = [device_id for device_id in repeated if device_id not in changes and await device_repository.resolve(device_id)]
+        if seen:
+            await device_repository.update_many({device_id: {} for device_id in seen})
+
     async def handle_message(self, topic: str, payload: bytes):
         """Procesează mesajele primite de la MQTT și actualizează starea dispozitivelor"""
-        try:
-            payload_json = json.loads(payload.decode())
-            device_id = topic.split("/")[1]  # Extrage ID-ul dispozitivului din topic
-
-            # Determină tipul dispozitivului pe baza topicului
-            if "light" in topic:
-                status_data = {
-                    "ison": payload_json.get("ison", False),
-                    "brightness": payload_json.get("brightness"),
-                    "temp": payload_json.get("temp"),
-                    "red": payload_json.get("red"),
-                    "green": payload_json.get("green"),
-                    "blue": payload_json.get("blue"),
-                }
-                logger.info(f"Processed light status for {device_id}: {status_data}")
-                await self.update_device(device_id, status_data)
-
-            elif "sensor" in topic:
-                status_data = {
-                    "temperature": payload_json.get("temperature"),
-                    "humidity": payload_json.get("humidity"),
-                    "motion": payload_json.get("motion", False),
-                }
-                logger.info(f"Processed sensor status for {device_id}: {status_data}")
-                await self.update_device(device_id, status_data)
-
-            else:
-                logger.warning(f"Unhandled topic type for {topic}")
-
-        except json.JSONDecodeError:
-            logger.error(f"Failed to decode JSON for topic {topic}. Raw payload: {payload}")
-        except Exception as e:
-            logger.error(f"Unexpected error processing message for topic {topic}: {e}")
\ No newline at end of file
+        await self.handle_messages([(topic, payload)])
+
+    async def _dispatch(self, topic: str, payload: bytes) -> bool:
+        """Rulează handler-ele topicului; False dacă nu există niciunul sau unul a eșuat"""
+        handlers = self.topics.match(topic)
+        if not handlers:
+            logger.debug(f"Unhandled topic {topic}")
+            return False
+        handled = True
+        for handler in handlers:
+            try:
+                result = handler(topic, payload)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                handled = False
+                logger.error(f"Unexpected error processing message for topic {topic}: {e}")
+        return handled
+
+    def get_dedup_stats(self) -> Dict[str, Any]:
+        messages = self._dedup["messages"]
+        return {
+            **self._dedup,
+            "hit_rate": round(self._dedup["duplicates"] / messages, 4) if messages else 0.0,
+            "topics": len(self._fingerprints),
+        }
+
+    def register_topic(self, topic_filter: str, handler: Callable[[str, bytes], Any]):
+        """Înregistrează un handler (sync sau async) pentru un filtru de topic MQTT"""
+        self.topics.add(topic_filter, handler)
+
+    def _device_id(self, topic: str) -> str:
+        # Rezolvă dispozitivul după prefixul topicului (shellies/<shelly_id>) fără scanare
+        return device_store.resolve_topic(topic) or topic.split("/")[1]
+
+    def _on_status(self, topic: str, payload: bytes):
+        """Raport color/0/status (sau light/N/status) în format JSON"""
+        status = shelly.parse_status(payload)
+        if status is None:
+            logger.error(f"Failed to decode status for topic {topic}. Raw payload: {payload}")
+            return
+        device_id = self._device_id(topic)
+        # Raportul de status confirmă comenzile trimise care așteaptă aceste valori
+        ack_tracker.resolve(device_id, status)
+        self._stage(device_id, status)
+
+    def _on_meter(self, topic: str, payload: bytes):
+        """Citiri de putere/energie (număr simplu) merg în seria de timp"""
+        value = shelly.parse_meter(payload)
+        if value is None:
+            logger.error(f"Invalid meter reading for topic {topic}: {payload}")
+            return
+        device_id = self._device_id(topic)
+        metric = topic.rsplit("/", 1)[-1]
+        telemetry_service.record(device_id, metric, value)
+        self._stage(device_id, {metric: value})
+
+    def _on_online(self, topic: str, payload: bytes):
+        online = shelly.parse_online(payload)
+        if online is None:
+            logger.error(f"Invalid online report for topic {topic}: {payload}")
+            return
+        self._stage(self._device_id(topic), {"online": online})
+
+    def _on_sensor(self, topic: str, payload: bytes):
+        """Senzori: sensor/<mărime> cu valoare numerică"""
+        value = shelly.parse_meter(payload)
+        if value is None:
+            logger.error(f"Invalid sensor reading for topic {topic}: {payload}")
+            return
+        self._stage(self._device_id(topic), {topic.rsplit("/", 1)[-1]: value})
+
+    def _on_announce(self, topic: str, payload: bytes):
+        """Răspuns la "announce": dispozitivul este online"""
+        announce = shelly.parse_announce(payload)
+        if announce is None:
+            logger.error(f"Invalid announce for topic {topic}: {payload}")
+            return
+        shelly_id = announce["id"]
+        self._stage(device_store.resolve(shelly_id) or shelly_id, {"online": True})
+
+# Create a singleton instance
+state_machine = DeviceStateMachine()
@@ -0,0 +1,115 @@
+# app/services/mqtt_asyncio.py
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import paho.mqtt.client as mqtt
+
+from app.core.io_executor import run_io
+
+logger = logging.getLogger(__name__)
+
+class AsyncioMQTTDriver:
+    """Drives a paho client's socket from the asyncio loop instead of ``loop_start()``.
+
+    paho's socket callbacks register the connection with ``add_reader`` /
+    ``add_writer``, so ``loop_read`` / ``loop_write`` (and therefore
+    ``on_message``) run on the event loop thread. A housekeeping task calls
+    ``loop_misc`` for keepalive pings and reconnects with backoff; only the
+    blocking TCP connect itself is done in the I/O executor.
+    """
+
+    MISC_INTERVAL = 1.0
+
+    def __init__(self, client: mqtt.Client, min_reconnect_delay: float = 1.0, max_reconnect_delay: float = 30.0):
+        self.client = client
+        self._min_delay = min_reconnect_delay
+        self._max_delay = max_reconnect_delay
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"connects": 0, "connect_failures": 0, "reads": 0, "writes": 0}
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def start(self):
+        """Start connecting; ``connect_async()`` must have been called on the client"""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread = threading.get_ident()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 1.0):
+        """Send DISCONNECT, wait briefly for it to be flushed and stop housekeeping"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        self.client.disconnect()
+        deadline = self._loop.time() + timeout
+        while self.client.socket() is not None and self._loop.time() < deadline:
+            await asyncio.sleep(0.01)
+
+    def _in_loop(self, func, *args):
+        # Socket callbacks fire on the loop thread, except during the connect done in the executor
+        if threading.get_ident() == self._loop_thread:
+            func(*args)
+        else:
+            self._loop.call_soon_threadsafe(func, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._in_loop(self._loop.add_reader, sock, self._read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        # Called before paho closes the socket, so the fd is still valid here
+        self._in_loop(self._loop.remove_reader, sock)
+        self._in_loop(self._loop.remove_writer, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._in_loop(self._loop.add_writer, sock, self._write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._in_loop(self._loop.remove_writer, sock)
+
+    def _read(self):
+        self._stats["reads"] += 1
+        self.client.loop_read()
+
+    def _write(self):
+        self._stats["writes"] += 1
+        self.client.loop_write()
+
+    async def _connect(self) -> bool:
+        try:
+            await run_io(self.client.reconnect)
+        except (OSError, mqtt.WebsocketConnectionError) as e:
+            self._stats["connect_failures"] += 1
+            logger.warning(f"MQTT connection attempt failed: {e}")
+            return False
+        self._stats["connects"] += 1
+        return True
+
+    async def _run(self):
+        delay = self._min_delay
+        while True:
+            if self.client.socket() is None:
+                if await self._connect():
+                    delay = self._min_delay
+                else:
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self._max_delay)
+                    continue
+            self.client.loop_misc()
+            await asyncio.sleep(self.MISC_INTERVAL)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self._stats)
@@ -0,0 +1,150 @@
+# app/services/mqtt_bridge.py
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+Message = Tuple[str, bytes]  # (topic, payload)
+
+class MQTTIngestBridge:
+    """Hands MQTT messages from paho's network thread to the asyncio loop.
+
+    ``submit()`` is called on the paho thread (or on the loop itself when
+    the asyncio transport is used) and only appends the raw
+    (topic, payload) to a bounded buffer under a lock. The loop is woken
+    with ``call_soon_threadsafe`` only when the buffer goes from empty to
+    non-empty, and a single consumer task drains it in batches of up to
+    ``MQTT_INGEST_BATCH`` messages, after waiting ``MQTT_INGEST_WINDOW``
+    for a burst to accumulate. When the buffer is full the oldest
+    message is dropped: newer device state supersedes older.
+    """
+
+    def __init__(self, handler: Callable[[List[Message]], Awaitable[None]],
+                 capacity: int = None, batch_size: int = None, window: float = None):
+        self._handler = handler
+        self._capacity = capacity or settings.MQTT_INGEST_BUFFER
+        self._batch_size = batch_size or settings.MQTT_INGEST_BATCH
+        self._window = settings.MQTT_INGEST_WINDOW if window is None else window
+        self._buffer: deque = deque()
+        self._lock = threading.Lock()
+        self._signalled = False  # A wakeup is pending on the loop
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._in_overflow = False
+        self._stats = {
+            "received": 0,
+            "processed": 0,
+            "dropped": 0,  # Messages discarded because the buffer was full
+            "overflows": 0,  # Times the buffer filled up
+            "errors": 0,
+            "batches": 0,
+            "max_batch": 0,
+            "high_water": 0,
+            "max_handle_time": 0.0,
+        }
+
+    def start(self):
+        """Start draining on the running loop"""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread = threading.get_ident()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._drain())
+            logger.info(f"MQTT ingest bridge started (buffer={self._capacity}, batch={self._batch_size})")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._loop = None
+
+    def submit(self, topic: str, payload: bytes) -> bool:
+        """Queue a message from any thread; returns False if the bridge is not running"""
+        loop = self._loop
+        if loop is None:
+            return False
+
+        with self._lock:
+            self._stats["received"] += 1
+            if len(self._buffer) >= self._capacity:
+                self._buffer.popleft()
+                self._stats["dropped"] += 1
+                if not self._in_overflow:
+                    self._in_overflow = True
+                    self._stats["overflows"] += 1
+            self._buffer.append((topic, payload))
+            if len(self._buffer) > self._stats["high_water"]:
+                self._stats["high_water"] = len(self._buffer)
+            wake = not self._signalled
+            self._signalled = True
+
+        if wake:
+            if threading.get_ident() == self._loop_thread:
+                # Already on the loop (asyncio transport mode): no cross-thread wakeup needed
+                self._wakeup.set()
+                return True
+            try:
+                loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                # Loop closed during shutdown
+                return False
+        return True
+
+    def _take_batch(self) -> List[Message]:
+        with self._lock:
+            n = min(self._batch_size, len(self._buffer))
+            batch = [self._buffer.popleft() for _ in range(n)]
+            if not self._buffer:
+                self._signalled = False
+                if self._in_overflow:
+                    logger.warning(f"MQTT ingest buffer overflowed, {self._stats['dropped']} messages dropped so far")
+                self._in_overflow = False
+            return batch
+
+    async def _drain(self):
+        while True:
+            try:
+                await self._wakeup.wait()
+                if self._window > 0 and len(self._buffer) < self._batch_size:
+                    # Let the rest of a burst (e.g. replies to a group command) arrive
+                    await asyncio.sleep(self._window)
+                self._wakeup.clear()
+                while True:
+                    batch = self._take_batch()
+                    if not batch:
+                        break
+                    started = time.perf_counter()
+                    try:
+                        await self._handler(batch)
+                    except Exception as e:
+                        self._stats["errors"] += 1
+                        logger.error(f"Error handling MQTT batch of {len(batch)} messages: {e}")
+                    elapsed = time.perf_counter() - started
+                    self._stats["processed"] += len(batch)
+                    self._stats["batches"] += 1
+                    self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+                    self._stats["max_handle_time"] = max(self._stats["max_handle_time"], elapsed)
+                    # Let other tasks run between batches
+                    await asyncio.sleep(0)
+            except asyncio.CancelledError:
+                break
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["buffered"] = len(self._buffer)
+        stats["capacity"] = self._capacity
+        stats["max_handle_ms"] = round(stats.pop("max_handle_time") * 1000, 3)
+        return stats
@@ -1,17 +1,35 @@
+import asyncio
 import logging
 import json
-import asyncio
-from typing import Dict, Any, Callable
+from typing import Dict, Any, Callable, List, Awaitable, Optional, Set
+
+import paho.mqtt.client as mqtt
 
 # Import necessary modules and avoid circular imports
 from app.core.config import settings
-from app.services.device_state_machine import DeviceStateMachine
+from app.core.device_store import device_store
+from app.integration.producers.shelly.common import DEVICE_FILTER_PREFIX, MQTT_TOPIC_PREFIX, get_subscription_topics
+from app.services.device_state_machine import DeviceStateMachine, state_machine
+from app.services.mqtt_asyncio import AsyncioMQTTDriver
+from app.services.mqtt_bridge import MQTTIngestBridge, Message
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
 class MQTTService:
-    """Service for handling MQTT communication with devices"""
+    """Service for handling MQTT communication with devices.
+
+    With ``MQTT_TRANSPORT_MODE = "thread"`` paho runs its network loop on its
+    own thread (``loop_start``); with ``"asyncio"`` the socket is driven by
+    the event loop itself (AsyncioMQTTDriver). Either way incoming messages
+    are handed to the state machine through an MQTTIngestBridge.
+
+    With ``MQTT_NARROW_SUBSCRIPTIONS`` only the topics of devices in the
+    device store are subscribed (instead of ``shellies/#``): every registered
+    ``shellies/+/...`` handler filter is subscribed once per known device and
+    other filters as they are. The subscriptions follow the store as devices
+    are added, removed or renamed, and new handlers as they are registered.
+    """
     _instance = None
 
     def __new__(cls, *args, **kwargs):
@@ -27,62 +45,160 @@ class MQTTService:
         self._initialized = True
         self.state_machine = state_machine
         self.client = self._create_mqtt_client()
-        self.handlers: Dict[str, Callable[[str, bytes], None]] = {}
+        self.bridge = MQTTIngestBridge(self._handle_batch)
+        self.transport_mode = settings.MQTT_TRANSPORT_MODE
+        if self.transport_mode not in ("thread", "asyncio"):
+            logger.warning(f"Unknown MQTT_TRANSPORT_MODE {self.transport_mode!r}, using 'thread'")
+            self.transport_mode = "thread"
+        self.driver = AsyncioMQTTDriver(self.client) if self.transport_mode == "asyncio" else None
+        self.subscriptions: Set[str] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sync_scheduled = False
+        self._connect_listeners: List[Callable[[], None]] = []
+        device_store.add_index_listener(self._schedule_subscription_sync)
 
     def _create_mqtt_client(self):
         """Create and configure the MQTT client"""
-        import paho.mqtt.client as mqtt
-        client = mqtt.Client(settings.MQTT_CLIENT_ID)
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=settings.MQTT_CLIENT_ID)
         client.on_connect = self.on_connect
         client.on_message = self.on_message
         client.on_disconnect = self.on_disconnect
+        client.reconnect_delay_set(min_delay=1, max_delay=30)
         return client
 
-    def register_handler(self, topic_prefix: str, handler: Callable[[str, bytes], None]):
-        """Register a handler for a specific topic prefix"""
-        self.handlers[topic_prefix] = handler
+    def register_handler(self, topic_filter: str, handler: Callable[[str, bytes], Any]):
+        """Register a handler (sync or async) for a topic filter; ``+`` and ``#`` are supported"""
+        self.state_machine.register_topic(topic_filter, handler)
+        self._schedule_subscription_sync()
+
+    def register_status_callback(self, callback: Callable[[Dict[str, Dict[str, Any]]], Awaitable[None]]):
+        """Call ``callback(changes)`` with the ``{device_id: status}`` change set of each ingest batch"""
+        self.state_machine.add_listener(callback)
+
+    def add_connect_listener(self, callback: Callable[[], None]):
+        """Call ``callback()`` on the event loop after each (re)connect, once subscriptions are sent"""
+        self._connect_listeners.append(callback)
 
     def connect(self):
-        """Connect to the MQTT broker"""
-        self.client.connect(settings.MQTT_BROKER_HOST, settings.MQTT_BROKER_PORT, settings.MQTT_KEEPALIVE)
-        self.client.loop_start()
-        logger.info("Connected to MQTT broker")
+        """Connect to the MQTT broker (paho keeps reconnecting in the background)"""
+        self._loop = asyncio.get_running_loop()
+        self.bridge.start()
+        self.client.connect_async(settings.MQTT_BROKER_HOST, settings.MQTT_BROKER_PORT, settings.MQTT_KEEPALIVE)
+        if self.driver:
+            self.driver.start()
+        else:
+            self.client.loop_start()
+        logger.info(f"Connecting to MQTT broker at {settings.MQTT_BROKER_HOST}:{settings.MQTT_BROKER_PORT} ({self.transport_mode} mode)")
 
-    def disconnect(self):
+    async def disconnect(self):
         """Disconnect from the MQTT broker"""
-        self.client.loop_stop()
-        self.client.disconnect()
+        if self.driver:
+            await self.driver.stop()
+        else:
+            self.client.disconnect()
+            self.client.loop_stop()
+        await self.bridge.stop()
         logger.info("Disconnected from MQTT broker")
 
     def on_connect(self, client, userdata, flags, rc):
         """Callback for when the client connects to the broker"""
         if rc == 0:
             logger.info("MQTT connected successfully")
-            # Subscribe to all necessary topics
-            self.client.subscribe("shellies/#")
+            # Subscriptions do not survive a new session; redo them on the event loop
+            self._loop.call_soon_threadsafe(self._resubscribe)
         else:
             logger.error(f"MQTT connection failed with code {rc}")
 
+    def _desired_subscriptions(self) -> Set[str]:
+        if not settings.MQTT_NARROW_SUBSCRIPTIONS:
+            return {f"{MQTT_TOPIC_PREFIX}/#"}
+        topic_filters = self.state_machine.topics.filters()
+        topics = {topic_filter for topic_filter in topic_filters if not topic_filter.startswith(DEVICE_FILTER_PREFIX)}
+        for shelly_id in device_store.shelly_ids():
+            topics.update(get_subscription_topics(shelly_id, topic_filters))
+        return topics
+
+    def _schedule_subscription_sync(self):
+        """Device store listener; may run on the I/O executor thread"""
+        if self._loop is None or self._sync_scheduled:
+            return
+        self._sync_scheduled = True
+        self._loop.call_soon_threadsafe(self._sync_subscriptions)
+
+    def _resubscribe(self):
+        self.subscriptions.clear()
+        self._sync_subscriptions()
+        for callback in self._connect_listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"MQTT connect listener failed: {e}")
+
+    def _sync_subscriptions(self):
+        """Subscribe to missing topics and unsubscribe from stale ones"""
+        self._sync_scheduled = False
+        if not self.client.is_connected():
+            return
+        desired = self._desired_subscriptions()
+        added = desired - self.subscriptions
+        removed = self.subscriptions - desired
+        if added:
+            rc, _ = self.client.subscribe([(topic, 0) for topic in sorted(added)])
+            if rc == mqtt.MQTT_ERR_SUCCESS:
+                self.subscriptions |= added
+            else:
+                logger.error(f"Failed to subscribe to {len(added)} topics (rc={rc})")
+        if removed:
+            rc, _ = self.client.unsubscribe(sorted(removed))
+            if rc == mqtt.MQTT_ERR_SUCCESS:
+                self.subscriptions -= removed
+        if added or removed:
+            logger.info(f"MQTT subscriptions: +{len(added)} -{len(removed)}, {len(self.subscriptions)} active")
+
     def on_disconnect(self, client, userdata, rc):
         """Callback for when the client disconnects from the broker"""
         if rc != 0:
             logger.warning("Unexpected MQTT disconnection. Reconnecting...")
-            self.connect()
 
     def on_message(self, client, userdata, msg):
-        """Callback for processing incoming MQTT messages"""
-        topic = msg.topic
-        payload = msg.payload
-
-        logger.info(f"Received MQTT message on topic {topic}: {payload}")
-
-        # Ignore null payloads
-        if payload.decode().strip().lower() == "null":
-            logger.warning(f"Ignoring null payload for topic {topic}")
-            return
-
-        # Process the message using DeviceStateMachine
-        asyncio.create_task(self.state_machine.handle_message(topic, payload))
+        """Callback for incoming MQTT messages (runs on the paho network thread)"""
+        # Only hand the raw message over; all processing happens on the event loop
+        self.bridge.submit(msg.topic, msg.payload)
+
+    async def _handle_batch(self, messages: List[Message]):
+        """Process a batch of messages drained from the ingest bridge"""
+        accepted = []
+        for topic, payload in messages:
+            # Ignore null payloads
+            if payload.strip().lower() == b"null":
+                logger.warning(f"Ignoring null payload for topic {topic}")
+                continue
+            accepted.append((topic, payload))
+
+        # Process the messages using DeviceStateMachine
+        await self.state_machine.handle_messages(accepted)
+
+    def safe_publish(self, topic: str, payload: Any, qos: int = 0, retain: bool = False) -> mqtt.MQTTMessageInfo:
+        """Publish without raising; check ``rc`` on the result"""
+        try:
+            return self.client.publish(topic, payload, qos=qos, retain=retain)
+        except Exception as e:
+            logger.error(f"Failed to publish message to {topic}: {e}")
+            info = mqtt.MQTTMessageInfo(0)
+            info.rc = mqtt.MQTT_ERR_UNKNOWN
+            return info
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {
+            "connected": self.client.is_connected(),
+            "transport": self.transport_mode,
+            "subscriptions": len(self.subscriptions),
+            "ingest": self.bridge.get_stats(),
+            "dedup": self.state_machine.get_dedup_stats(),
+        }
+        if self.driver:
+            stats["driver"] = self.driver.get_stats()
+        return stats
 
     async def publish(self, topic: str, payload: Dict[str, Any]):
         """Publish a message to a specific topic"""
@@ -91,4 +207,16 @@ class MQTTService:
             self.client.publish(topic, payload_str)
             logger.info(f"Published message to {topic}: {payload}")
         except Exception as e:
-            logger.error(f"Failed to publish message to {topic}: {e}")
\ No newline at end of file
+            logger.error(f"Failed to publish message to {topic}: {e}")
+
+# Create singleton instances
+mqtt_service = MQTTService(state_machine)
+mqtt_client = mqtt_service.client
+
+def init_mqtt_client():
+    """Start the MQTT client; must be called from the running event loop"""
+    mqtt_service.connect()
+
+async def stop_mqtt_client():
+    """Stop the MQTT client and its ingest bridge"""
+    await mqtt_service.disconnect()
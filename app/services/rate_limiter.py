@@ -0,0 +1,134 @@
+# app/services/rate_limiter.py
+import logging
+import time
+from typing import Dict, Any, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class _DeviceBucket:
+    """Token bucket and acknowledgement latency state for one device"""
+
+    __slots__ = ("rate", "tokens", "updated", "latency", "last_latency",
+                 "acks", "timeouts", "backoffs")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.latency: Optional[float] = None  # Smoothed (EWMA) ack latency in seconds
+        self.last_latency: Optional[float] = None
+        self.acks = 0
+        self.timeouts = 0
+        self.backoffs = 0
+
+class AdaptiveRateLimiter:
+    """Per-device token bucket whose rate follows measured acknowledgement latency.
+
+    Command-to-acknowledgement latencies come from the AckTracker.
+    Acknowledgements faster than ``RATE_LIMIT_TARGET_LATENCY`` raise the rate
+    additively; slow or missing ones cut it multiplicatively, so responsive
+    bulbs run at full speed and overloaded or weak-signal ones back off on
+    their own.
+    """
+
+    SMOOTHING = 0.2  # EWMA weight of a new latency sample
+    INCREASE = 0.5  # Commands/s added per fast acknowledgement
+    DECREASE = 0.7  # Rate multiplier on a slow acknowledgement
+    TIMEOUT_DECREASE = 0.5  # Rate multiplier on a lost acknowledgement
+
+    def __init__(self):
+        self._buckets: Dict[str, _DeviceBucket] = {}
+        self._initial_rate = settings.RATE_LIMIT_INITIAL
+        self._min_rate = settings.RATE_LIMIT_MIN
+        self._max_rate = settings.RATE_LIMIT_MAX
+        self._capacity = settings.RATE_LIMIT_BURST
+        self._target_latency = settings.RATE_LIMIT_TARGET_LATENCY
+
+    def set_initial_rate(self, rate: float):
+        """Set the starting rate for devices seen from now on"""
+        self._initial_rate = max(self._min_rate, min(self._max_rate, rate))
+
+    def _bucket(self, device_id: str) -> _DeviceBucket:
+        bucket = self._buckets.get(device_id)
+        if bucket is None:
+            bucket = self._buckets[device_id] = _DeviceBucket(self._initial_rate, self._capacity)
+        return bucket
+
+    def _refill(self, bucket: _DeviceBucket) -> None:
+        now = time.monotonic()
+        bucket.tokens = min(self._capacity, bucket.tokens + (now - bucket.updated) * bucket.rate)
+        bucket.updated = now
+
+    def rate(self, device_id: str) -> float:
+        """Current commands per second allowed for the device"""
+        return self._bucket(device_id).rate
+
+    def delay(self, device_id: str) -> float:
+        """Seconds until the device has a token available (0 if it has one now)"""
+        bucket = self._bucket(device_id)
+        self._refill(bucket)
+        if bucket.tokens >= 1:
+            return 0.0
+        return (1 - bucket.tokens) / bucket.rate
+
+    def consume(self, device_id: str) -> None:
+        """Take one token for a command that is about to run"""
+        bucket = self._bucket(device_id)
+        self._refill(bucket)
+        bucket.tokens -= 1
+
+    def observe_latency(self, device_id: str, latency: float) -> None:
+        """Feed one acknowledgement latency sample into the device's rate"""
+        bucket = self._bucket(device_id)
+        bucket.acks += 1
+        bucket.last_latency = latency
+        if bucket.latency is None:
+            bucket.latency = latency
+        else:
+            bucket.latency += self.SMOOTHING * (latency - bucket.latency)
+
+        if latency > self._target_latency:
+            self._set_rate(device_id, bucket, bucket.rate * self.DECREASE)
+        elif bucket.latency <= self._target_latency:
+            self._set_rate(device_id, bucket, bucket.rate + self.INCREASE)
+
+    def record_timeout(self, device_id: str) -> None:
+        """Back off a device that did not acknowledge a command in time"""
+        bucket = self._bucket(device_id)
+        bucket.timeouts += 1
+        self._set_rate(device_id, bucket, bucket.rate * self.TIMEOUT_DECREASE)
+
+    def _set_rate(self, device_id: str, bucket: _DeviceBucket, rate: float) -> None:
+        self._refill(bucket)
+        rate = max(self._min_rate, min(self._max_rate, rate))
+        if rate < bucket.rate:
+            bucket.backoffs += 1
+            logger.debug(f"Backing off device {device_id}: {bucket.rate:.2f} -> {rate:.2f} commands/s")
+        bucket.rate = rate
+
+    def forget(self, device_id: str) -> None:
+        """Drop an idle device's bucket; it starts again at the initial rate"""
+        self._buckets.pop(device_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the current rate and acknowledgement latency per device"""
+        def ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            device_id: {
+                "rate": round(bucket.rate, 3),
+                "interval_ms": ms(1 / bucket.rate),
+                "latency_ms": ms(bucket.latency),
+                "last_latency_ms": ms(bucket.last_latency),
+                "acks": bucket.acks,
+                "timeouts": bucket.timeouts,
+                "backoffs": bucket.backoffs,
+            }
+            for device_id, bucket in self._buckets.items()
+        }
+
+# Create a singleton instance
+rate_limiter = AdaptiveRateLimiter()
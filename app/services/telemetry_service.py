@@ -0,0 +1,304 @@
+# app/services/telemetry_service.py
+import asyncio
+import json
+import logging
+import os
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Any, List, Optional
+
+from app.core.config import settings
+from app.core.io_executor import run_io
+
+logger = logging.getLogger(__name__)
+
+# Rollup tiers: name -> bucket width in seconds
+ROLLUP_TIERS = {"1m": 60, "1h": 3600, "1d": 86400}
+
+# Tiers written to TELEMETRY_FILE; raw samples and 1m buckets only live in memory
+PERSISTED_TIERS = ("1h", "1d")
+
+TRACKED_METRICS = ("power", "energy")
+
+class _Rollup:
+    """Fixed-width buckets stored as parallel arrays (one column per statistic)"""
+
+    __slots__ = ("width", "start", "count", "sum", "min", "max", "first", "last")
+
+    COLUMNS = ("start", "count", "sum", "min", "max", "first", "last")
+
+    def __init__(self, width: int):
+        self.width = width
+        self.start = array('d')
+        self.count = array('d')
+        self.sum = array('d')
+        self.min = array('d')
+        self.max = array('d')
+        self.first = array('d')
+        self.last = array('d')
+
+    def add(self, ts: float, value: float):
+        bucket = ts - ts % self.width
+        if self.start and self.start[-1] == bucket:
+            i = len(self.start) - 1
+        elif not self.start or bucket > self.start[-1]:
+            self._insert(len(self.start), bucket, value)
+            return
+        else:
+            # Late sample for an older bucket
+            i = bisect_left(self.start, bucket)
+            if i == len(self.start) or self.start[i] != bucket:
+                self._insert(i, bucket, value)
+                return
+        self.count[i] += 1
+        self.sum[i] += value
+        if value < self.min[i]:
+            self.min[i] = value
+        if value > self.max[i]:
+            self.max[i] = value
+        self.last[i] = value
+
+    def _insert(self, i: int, bucket: float, value: float):
+        for column, initial in (
+            (self.start, bucket), (self.count, 1), (self.sum, value),
+            (self.min, value), (self.max, value), (self.first, value), (self.last, value),
+        ):
+            column.insert(i, initial)
+
+    def to_dict(self) -> Dict[str, List[float]]:
+        return {name: getattr(self, name).tolist() for name in self.COLUMNS}
+
+    def merge(self, data: Dict[str, List[float]]):
+        """Add persisted buckets; buckets already in memory are kept as they are"""
+        for row in zip(*(data[name] for name in self.COLUMNS)):
+            i = bisect_left(self.start, row[0])
+            if i < len(self.start) and self.start[i] == row[0]:
+                continue
+            for name, value in zip(self.COLUMNS, row):
+                getattr(self, name).insert(i, value)
+
+    def trim(self, before: float):
+        i = bisect_left(self.start, before)
+        if i:
+            for column in (self.start, self.count, self.sum, self.min, self.max, self.first, self.last):
+                del column[:i]
+
+    def range(self, from_ts: float, to_ts: float) -> range:
+        return range(bisect_left(self.start, from_ts - from_ts % self.width), bisect_right(self.start, to_ts))
+
+class _Series:
+    """Raw samples and their rollups for one (device, metric) pair"""
+
+    __slots__ = ("timestamps", "values", "rollups")
+
+    def __init__(self):
+        self.timestamps = array('d')
+        self.values = array('d')
+        self.rollups = {name: _Rollup(width) for name, width in ROLLUP_TIERS.items()}
+
+    def add(self, ts: float, value: float):
+        if not self.timestamps or ts >= self.timestamps[-1]:
+            self.timestamps.append(ts)
+            self.values.append(value)
+        else:
+            i = bisect_right(self.timestamps, ts)
+            self.timestamps.insert(i, ts)
+            self.values.insert(i, value)
+        for rollup in self.rollups.values():
+            rollup.add(ts, value)
+
+    def trim(self, now: float, retention: Dict[str, float]):
+        i = bisect_left(self.timestamps, now - retention["raw"])
+        if i:
+            del self.timestamps[:i]
+            del self.values[:i]
+        for name, rollup in self.rollups.items():
+            rollup.trim(now - retention[name])
+
+class TelemetryService:
+    """In-memory time-series store for power and energy readings.
+
+    Raw samples are kept only for ``TELEMETRY_RAW_RETENTION`` seconds; range
+    queries are answered from 1-minute/1-hour/1-day rollups, each with its own
+    retention.
+
+    The 1-hour and 1-day rollups are snapshotted to ``TELEMETRY_FILE`` every
+    ``TELEMETRY_SNAPSHOT_INTERVAL`` seconds and on shutdown, and loaded back
+    on startup. Raw samples and 1-minute rollups are lost on restart.
+    """
+
+    def __init__(self, file_path: Optional[str] = None):
+        self.file_path = file_path or settings.TELEMETRY_FILE
+        self._snapshot_interval = settings.TELEMETRY_SNAPSHOT_INTERVAL
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self._series: Dict[str, Dict[str, _Series]] = {}  # {device_id: {metric: series}}
+        self._retention = {
+            "raw": settings.TELEMETRY_RAW_RETENTION,
+            "1m": settings.TELEMETRY_1M_RETENTION,
+            "1h": settings.TELEMETRY_1H_RETENTION,
+            "1d": settings.TELEMETRY_1D_RETENTION,
+        }
+        self._last_trim = 0.0
+
+    def record(self, device_id: str, metric: str, value: Any, ts: Optional[float] = None):
+        """Record one reading; non-numeric values are ignored"""
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+        now = time.time()
+        ts = now if ts is None else ts
+
+        series = self._series.setdefault(device_id, {}).get(metric)
+        if series is None:
+            series = self._series[device_id][metric] = _Series()
+        series.add(ts, value)
+
+        # Retention is enforced at most once a minute across all series
+        if now - self._last_trim >= 60:
+            self._last_trim = now
+            for metrics in self._series.values():
+                for s in metrics.values():
+                    s.trim(now, self._retention)
+
+    def record_status(self, device_id: str, status: Dict[str, Any], ts: Optional[float] = None):
+        """Record every tracked metric present in a status update"""
+        for metric in TRACKED_METRICS:
+            if status.get(metric) is not None:
+                self.record(device_id, metric, status[metric], ts)
+
+    @staticmethod
+    def effective_step(step: int) -> int:
+        """Round a bucket size up to a multiple of the finest rollup, so buckets never split a rollup bucket"""
+        finest = min(ROLLUP_TIERS.values())
+        return max(finest, -(-step // finest) * finest)
+
+    def query(self, device_id: str, metric: str, from_ts: float, to_ts: float, step: int) -> List[Dict[str, Any]]:
+        """Aggregate a metric into ``step``-second buckets using the coarsest fitting rollup.
+
+        ``step`` is rounded with ``effective_step`` first.
+        """
+        series = self._series.get(device_id, {}).get(metric)
+        if series is None:
+            return []
+
+        # Coarsest tier whose width divides the step
+        step = self.effective_step(step)
+        tier = "1m"
+        for name, width in ROLLUP_TIERS.items():
+            if step % width == 0:
+                tier = name
+        rollup = series.rollups[tier]
+
+        points: List[Dict[str, Any]] = []
+        previous_last = None
+        for i in rollup.range(from_ts, to_ts):
+            bucket = rollup.start[i] - rollup.start[i] % step
+            if points and points[-1]["ts"] == bucket:
+                point = points[-1]
+                point["count"] += rollup.count[i]
+                point["sum"] += rollup.sum[i]
+                point["min"] = min(point["min"], rollup.min[i])
+                point["max"] = max(point["max"], rollup.max[i])
+                point["last"] = rollup.last[i]
+            else:
+                if points:
+                    previous_last = points[-1]["last"]
+                points.append({
+                    "ts": bucket,
+                    "count": rollup.count[i],
+                    "sum": rollup.sum[i],
+                    "min": rollup.min[i],
+                    "max": rollup.max[i],
+                    "first": rollup.first[i],
+                    "last": rollup.last[i],
+                    # Counter increase includes the gap since the previous bucket
+                    "_base": previous_last if previous_last is not None else rollup.first[i],
+                })
+
+        for point in points:
+            point["count"] = int(point["count"])
+            point["avg"] = point.pop("sum") / point["count"]
+            point["delta"] = point["last"] - point.pop("_base")
+        return points
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Copy the persisted rollup tiers into a JSON-serializable structure"""
+        return {
+            device_id: {
+                metric: {tier: series.rollups[tier].to_dict() for tier in PERSISTED_TIERS}
+                for metric, series in metrics.items()
+            }
+            for device_id, metrics in self._series.items()
+        }
+
+    def save(self, snapshot: Dict[str, Any]) -> bool:
+        """Write a snapshot atomically (blocking; run it through run_io)"""
+        tmp_path = f"{self.file_path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({"version": 1, "series": snapshot}, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+            return True
+        except Exception as e:
+            logger.error(f"Error saving telemetry snapshot: {e}")
+            return False
+
+    def load(self) -> int:
+        """Merge the persisted rollups into memory; returns the number of series loaded"""
+        if not os.path.exists(self.file_path):
+            return 0
+        try:
+            with open(self.file_path, 'r') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading telemetry snapshot: {e}")
+            return 0
+
+        loaded = 0
+        for device_id, metrics in data.get("series", {}).items():
+            for metric, tiers in metrics.items():
+                series = self._series.setdefault(device_id, {}).get(metric)
+                if series is None:
+                    series = self._series[device_id][metric] = _Series()
+                for tier in PERSISTED_TIERS:
+                    if tier in tiers:
+                        series.rollups[tier].merge(tiers[tier])
+                series.trim(time.time(), self._retention)
+                loaded += 1
+        logger.info(f"Loaded {loaded} telemetry series from {self.file_path}")
+        return loaded
+
+    async def save_async(self) -> bool:
+        return await run_io(self.save, self.snapshot())
+
+    async def start(self):
+        """Load the persisted rollups and start the periodic snapshot task"""
+        await run_io(self.load)
+        if self._snapshot_task is None:
+            self._snapshot_task = asyncio.create_task(self._snapshot_loop())
+
+    async def stop(self):
+        """Stop the snapshot task and write a final snapshot"""
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+            try:
+                await self._snapshot_task
+            except asyncio.CancelledError:
+                pass
+            self._snapshot_task = None
+        await self.save_async()
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(self._snapshot_interval)
+            try:
+                await self.save_async()
+            except Exception as e:
+                logger.error(f"Error snapshotting telemetry: {e}")
+
+# Create a singleton instance
+telemetry_service = TelemetryService()
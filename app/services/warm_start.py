@@ -0,0 +1,120 @@
+# app/services/warm_start.py
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional, Set
+
+from app.core.config import settings
+from app.core.device_store import device_store
+from app.integration.producers.shelly.common import COMMAND_ALL_TOPIC, STATE_FIELDS
+from app.services.device_state_machine import state_machine
+from app.services.mqtt_service import mqtt_service
+
+logger = logging.getLogger(__name__)
+
+class WarmStart:
+    """Brings device state up to date quickly after a restart.
+
+    The state machine is first seeded from the persisted device records, so
+    clients see the last known state immediately. After every (re)connect,
+    ``announce`` and ``update`` are published on ``shellies/command`` so all
+    devices report at once, alongside any retained messages. The service is
+    ``ready`` once every known device has reported, or after
+    ``WARM_START_WINDOW`` seconds; the timings show how long it took.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._window = settings.WARM_START_WINDOW
+        self._expected: Set[str] = set()
+        self._reported: Set[str] = set()
+        self._started: Optional[float] = None
+        self._done: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._timings: Dict[str, float] = {}
+        self._timed_out = False
+        self._requests = 0
+
+    def _elapsed_ms(self) -> float:
+        return round((time.monotonic() - self._started) * 1000, 1)
+
+    async def start(self):
+        """Seed the state machine from the snapshot; call before connecting to MQTT"""
+        if self._task is not None:
+            return
+        self._started = time.monotonic()
+        self._done = asyncio.Event()
+
+        states = {
+            device["device_id"]: {field: device[field] for field in STATE_FIELDS if field in device}
+            for device in device_store.all()
+        }
+        seeded = state_machine.seed(states)
+        self._expected = set(states)
+        self._timings["snapshot_ms"] = self._elapsed_ms()
+        logger.info(f"Warm start: seeded {seeded} devices from the persisted snapshot")
+
+        state_machine.add_listener(self._on_changes)
+        mqtt_service.add_connect_listener(self._request_reports)
+        self._task = asyncio.create_task(self._wait())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _request_reports(self):
+        """Ask every device on the broker to announce itself and publish its status"""
+        mqtt_service.safe_publish(COMMAND_ALL_TOPIC, "announce")
+        mqtt_service.safe_publish(COMMAND_ALL_TOPIC, "update")
+        self._requests += 1
+        self._timings.setdefault("requested_ms", self._elapsed_ms())
+
+    async def _on_changes(self, changes: Dict[str, Dict[str, Any]]):
+        if self.ready:
+            return
+        # An announce only marks a device online; wait for an actual state report
+        new = {
+            device_id for device_id in self._expected.intersection(changes).difference(self._reported)
+            if any(field != "online" for field in changes[device_id])
+        }
+        if not new:
+            return
+        self._timings.setdefault("first_report_ms", self._elapsed_ms())
+        self._reported.update(new)
+        if self._reported >= self._expected:
+            self._done.set()
+
+    async def _wait(self):
+        if self._expected:
+            try:
+                await asyncio.wait_for(self._done.wait(), self._window)
+            except asyncio.TimeoutError:
+                self._timed_out = True
+        self.ready = True
+        self._timings["ready_ms"] = self._elapsed_ms()
+        if self._timed_out:
+            logger.warning(
+                f"Warm start: {len(self._reported)}/{len(self._expected)} devices reported "
+                f"within {self._window}s; missing {sorted(self._expected - self._reported)}"
+            )
+        else:
+            logger.info(f"Warm start: all {len(self._expected)} devices reported in {self._timings['ready_ms']} ms")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "timed_out": self._timed_out,
+            "expected": len(self._expected),
+            "reported": len(self._reported),
+            "missing": sorted(self._expected - self._reported),
+            "requests": self._requests,
+            "timings": dict(self._timings),
+        }
+
+# Create a singleton instance
+warm_start = WarmStart()
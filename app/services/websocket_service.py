@@ -2,7 +2,7 @@ from fastapi import WebSocket
 from typing import List, Dict, Any
 import logging
 import asyncio
-from app.services.device_state_machine import DeviceStateMachine
+from app.services.device_state_machine import DeviceStateMachine, state_machine
 
 logger = logging.getLogger(__name__)
 
@@ -62,4 +62,7 @@ class ConnectionManager:
                 logger.info("Broadcast task cancelled")
                 break
             except Exception as e:
-                logger.error(f"Error in broadcast_device_status: {e}")
\ No newline at end of file
+                logger.error(f"Error in broadcast_device_status: {e}")
+
+# Create a singleton instance
+manager = ConnectionManager(state_machine)
@@ -1,38 +1,53 @@
-import time
+import asyncio
 import json
 import logging
-from app.services.mqtt_service import mqtt_client
+from app.services.mqtt_service import mqtt_client, mqtt_service
 
-def get_shelly_status(shelly_id: str):
+async def get_shelly_status(shelly_id: str, timeout: float = 10):
     """
     Trimite o cerere MQTT pentru a obține starea dispozitivului Shelly.
+    Răspunsul este așteptat fără a bloca event loop-ul.
     """
     status_topic = f"shellies/{shelly_id}/color/0/get"
     response_topic = f"shellies/{shelly_id}/color/0/status"
-    status_data = None
+    loop = asyncio.get_running_loop()
+    response = loop.create_future()
+
+    def set_result(status_data):
+        if not response.done():
+            response.set_result(status_data)
 
     def on_message(client, userdata, message):
-        nonlocal status_data
-        if message.topic == response_topic:
+        # Rulează pe thread-ul de rețea paho; predă rezultatul event loop-ului
+        # Callback-ul per topic înlocuiește on_message-ul serviciului, deci
+        # raportul trebuie trimis și către bridge ca starea live să nu-l piardă
+        mqtt_service.bridge.submit(message.topic, message.payload)
+        try:
             status_data = json.loads(message.payload.decode())
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            logging.warning(f"Invalid MQTT status payload from {shelly_id}: {e}")
+            status_data = None
+        else:
             logging.info(f"Received MQTT status for {shelly_id}: {status_data}")
+        loop.call_soon_threadsafe(set_result, status_data)
 
+    # Topicul poate fi deja abonat pentru un dispozitiv cunoscut; atunci nu-l dezabonăm la final
+    managed = response_topic in mqtt_service.subscriptions
     try:
-        mqtt_client.subscribe(response_topic)
-        mqtt_client.on_message = on_message
+        mqtt_client.message_callback_add(response_topic, on_message)
+        if not managed:
+            mqtt_client.subscribe(response_topic)
 
         mqtt_client.publish(status_topic, "")
         logging.info(f"Requested status from Shelly {shelly_id} via MQTT.")
 
-
-        for _ in range(10):
-            if status_data:
-                break
-            time.sleep(1)
-
-        if not status_data:
-            logging.warning(f"No status received from Shelly {shelly_id} after 10 seconds.")
-        return status_data
+        try:
+            return await asyncio.wait_for(response, timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"No status received from Shelly {shelly_id} after {timeout} seconds.")
+            return None
     finally:
-        mqtt_client.unsubscribe(response_topic)
-        logging.info(f"Unsubscribed from {response_topic}")
+        mqtt_client.message_callback_remove(response_topic)
+        if not managed:
+            mqtt_client.unsubscribe(response_topic)
+            logging.info(f"Unsubscribed from {response_topic}")
@@ -0,0 +1,68 @@
+import asyncio
+import uuid
+
+import pytest
+
+from app.services.ack_tracker import AckTracker
+from app.services.rate_limiter import rate_limiter
+
+
+@pytest.fixture
+def tracker():
+    tracker = AckTracker()
+    tracker._timeout = 0.05
+    return tracker
+
+
+def _device():
+    return f"bulb-{uuid.uuid4().hex[:8]}"
+
+
+def test_matching_status_acknowledges_the_command(tracker):
+    device = _device()
+
+    async def scenario():
+        acked = tracker.expect(device, "switch", {"ison": True})
+        assert tracker.resolve(device, {"ison": False, "mode": "white"}) == 0
+        assert not acked.done()
+        assert tracker.resolve(device, {"ison": True, "mode": "white"}) == 1
+        assert await tracker.wait(device, "switch") is True
+        return await acked
+
+    assert asyncio.run(scenario()) is True
+    stats = tracker.get_stats()
+    assert (stats["expected"], stats["acked"], stats["timed_out"], stats["pending"]) == (1, 1, 0, 0)
+    assert stats["devices"][device]["samples"] == 1
+    assert rate_limiter.get_stats()[device]["acks"] == 1
+
+
+def test_confirmed_command_settles_older_ones_of_the_same_type(tracker):
+    device = _device()
+
+    async def scenario():
+        first = tracker.expect(device, "brightness", {"brightness": 10})
+        color = tracker.expect(device, "color", {"red": 255})
+        latest = tracker.expect(device, "brightness", {"brightness": 80})
+        assert tracker.resolve(device, {"brightness": 80}) == 2
+        assert (first.result(), latest.result()) == (True, True)
+        assert not color.done()
+
+    asyncio.run(scenario())
+
+
+def test_unacknowledged_command_times_out(tracker):
+    device = _device()
+
+    async def scenario():
+        tracker.expect(device, "switch", {"ison": True})
+        assert await tracker.wait(device, "switch") is False
+        # The outcome is remembered once nothing is pending
+        assert await tracker.wait(device, "switch") is False
+
+    asyncio.run(scenario())
+    assert tracker.get_stats()["timed_out"] == 1
+    assert rate_limiter.get_stats()[device]["timeouts"] == 1
+
+
+def test_wait_without_a_command(tracker):
+    assert asyncio.run(tracker.wait(_device(), "switch")) is False
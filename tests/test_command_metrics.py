@@ -0,0 +1,68 @@
+import pytest
+
+from app.services.command_metrics import BUCKETS, CommandMetrics, _Histogram
+
+
+def test_histogram_buckets_and_percentiles():
+    histogram = _Histogram(window=60)
+    for value in (0.004, 0.02, 0.02, 0.3, 100):
+        histogram.observe(value, now=0)
+
+    assert histogram.count == 5
+    assert histogram.sum == pytest.approx(100.344)
+    assert histogram.counts[BUCKETS.index(0.005)] == 1
+    assert histogram.counts[BUCKETS.index(0.025)] == 2
+    assert histogram.counts[-1] == 1  # +Inf
+    recent = histogram.recent()
+    assert (recent["samples"], recent["p50_ms"], recent["p95_ms"]) == (5, 25.0, None)
+
+
+def test_recent_window_rotates():
+    histogram = _Histogram(window=10)
+    histogram.observe(0.1, now=histogram._rotated)
+    histogram.observe(0.1, now=histogram._rotated + 11)
+    assert histogram.recent()["samples"] == 2
+    # Two windows later the old samples are gone from the percentiles but not the totals
+    histogram.observe(0.1, now=histogram._rotated + 25)
+    assert histogram.recent()["samples"] == 1
+    assert histogram.count == 3
+
+
+def test_summary_merges_outcomes_and_queue_depth():
+    metrics = CommandMetrics()
+    metrics.record("bulb", 0.01, 0.2, True)
+    metrics.record("bulb", 0.02, 0.2, False)
+    metrics.record("lamp", 0.01, 0.1, None, error=True)
+
+    summary = metrics.summary({"total_depth": 3, "devices": {"bulb": {"depth": 1}, "idle": {"depth": 2}}})
+    assert (summary["depth"], summary["executed"], summary["failed"], summary["errors"]) == (3, 3, 1, 1)
+    assert summary["error_rate"] == pytest.approx(0.6667)
+    assert summary["devices"]["bulb"]["depth"] == 1
+    assert summary["devices"]["bulb"]["executed"] == 2
+    assert summary["devices"]["idle"] == {"depth": 2}
+
+
+def test_prometheus_exposition():
+    metrics = CommandMetrics()
+    metrics.record('bulb "1"', 0.003, 0.2, True)
+    text = metrics.prometheus({
+        "total_depth": 1,
+        "devices": {'bulb "1"': {"depth": 1}},
+        "expired": {"interactive": 2},
+        "overflows": {"reject": 1},
+    })
+    lines = text.splitlines()
+
+    label = 'device="bulb \\"1\\""'
+    assert "# TYPE command_wait_seconds histogram" in lines
+    assert f'command_wait_seconds_bucket{{{label},le="0.005"}} 1' in lines
+    assert f'command_wait_seconds_bucket{{{label},le="+Inf"}} 1' in lines
+    assert f'command_execution_seconds_bucket{{{label},le="0.1"}} 0' in lines
+    assert f'command_execution_seconds_bucket{{{label},le="0.25"}} 1' in lines
+    assert f"command_execution_seconds_count{{{label}}} 1" in lines
+    assert f"commands_executed_total{{{label}}} 1" in lines
+    assert "command_queue_total_depth 1" in lines
+    assert f"command_queue_depth{{{label}}} 1" in lines
+    assert 'commands_expired_total{lane="interactive"} 2' in lines
+    assert 'command_queue_overflows_total{policy="reject"} 1' in lines
+    assert text.endswith("\n")
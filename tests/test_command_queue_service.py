@@ -0,0 +1,552 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+
+from app.core.command_journal import CommandJournal
+from app.core.exceptions import QueueFullError, ScheduleTooFarError
+from app.services.command_metrics import command_metrics
+from app.services.command_queue_service import CommandLane, CommandQueueService, PriorityCommandQueue
+from app.services.rate_limiter import rate_limiter
+
+
+@pytest.fixture
+def new_service(monkeypatch):
+    """Fresh (non-singleton) services; the caller must shut them down"""
+    def make(**attrs):
+        monkeypatch.setattr(CommandQueueService, "_instance", None)
+        service = CommandQueueService()
+        for name, value in attrs.items():
+            setattr(service, name, value)
+        return service
+    return make
+
+
+def _device():
+    # The rate limiter is shared by the whole process, keep its buckets apart
+    return f"dev-{uuid.uuid4().hex[:8]}"
+
+
+def test_fan_out_runs_after_queued_commands(new_service):
+    a, b = _device(), _device()
+    order = []
+
+    async def slow(device_id):
+        await asyncio.sleep(0.05)
+        order.append(("single", device_id))
+        return True
+
+    def publish(device_id):
+        order.append(("fan_out", device_id))
+        return True
+
+    async def scenario():
+        service = new_service()
+        try:
+            single = await service.add_command(a, slow, [a])
+            results, spread = await service.fan_out({a: lambda: publish(a), b: lambda: publish(b)})
+            assert await single is True
+            assert results == {a: True, b: True}
+            assert spread >= 0
+            assert service.get_stats()["held"] == 0
+            # Both devices are free again
+            assert await service.run_command(b, slow, [b]) is True
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
+    assert order[:3] == [("single", a), ("fan_out", a), ("fan_out", b)]
+
+
+def test_fan_out_rejects_far_future_at(new_service):
+    published = []
+
+    async def scenario():
+        service = new_service(_fan_out_max_delay=5.0)
+        try:
+            with pytest.raises(ScheduleTooFarError):
+                await service.fan_out({_device(): lambda: published.append(1)}, at=time.time() + 60)
+            assert service.get_stats()["total_depth"] == 0
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
+    assert published == []
+
+
+def test_fan_out_waits_until_at(new_service):
+    device = _device()
+    sent = []
+
+    async def scenario():
+        service = new_service()
+        try:
+            at = time.time() + 0.2
+            results, _ = await service.fan_out({device: lambda: sent.append(time.time()) or True}, at=at)
+            assert results == {device: True}
+            assert sent[0] >= at
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_withdraws_the_whole_fan_out(new_service):
+    busy, free = _device(), _device()
+    published = []
+
+    async def scenario():
+        service = new_service(_max_depth=1, _overflow="reject")
+        release = asyncio.Event()
+
+        async def blocked():
+            await release.wait()
+            return True
+
+        try:
+            running = await service.add_command(busy, blocked)
+            await asyncio.sleep(0.01)
+            queued = await service.add_command(busy, blocked)
+
+            with pytest.raises(QueueFullError):
+                await service.fan_out({free: lambda: published.append(free), busy: lambda: published.append(busy)})
+
+            # The device that reached its barrier is not left held
+            await asyncio.sleep(0.05)
+            assert service.get_stats()["held"] == 0
+            release.set()
+            assert await running is True
+            assert await queued is True
+            assert await service.run_command(free, blocked) is True
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
+    assert published == []
+
+
+def test_shutdown_resolves_held_commands(new_service):
+    busy, free = _device(), _device()
+
+    async def scenario():
+        service = new_service()
+        release = asyncio.Event()
+
+        async def blocked():
+            await release.wait()
+            return True
+
+        await service.add_command(busy, blocked)
+        await asyncio.sleep(0.01)
+        fan_out = asyncio.create_task(service.fan_out({busy: lambda: True, free: lambda: True}))
+        await asyncio.sleep(0.05)
+        assert service.get_stats()["held"] == 1
+
+        held = service._held[free]["future"]
+        await service.shutdown()
+        assert held.result() is False
+        fan_out.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_cleared_queue_is_reaped(new_service):
+    device = _device()
+
+    async def noop():
+        return True
+
+    async def scenario():
+        service = new_service(_idle_ttl=0.05)
+        try:
+            assert await service.run_command(device, noop) is True
+            # Waits for the rate limiter, so it is still queued when cleared
+            pending = await service.add_command(device, noop)
+            await service.clear_queue(device)
+            assert pending.result() is False
+
+            await asyncio.sleep(0.6)
+            assert device not in service._device_queues
+            assert service.get_stats()["reaped"] == 1
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_reaping_drops_per_device_state(new_service):
+    device = _device()
+
+    async def noop():
+        return True
+
+    async def scenario():
+        service = new_service(_idle_ttl=0.05)
+        try:
+            assert await service.run_command(device, noop) is True
+            assert device in rate_limiter.get_stats()
+            assert device in command_metrics.devices
+
+            await asyncio.sleep(0.2)
+            assert device not in service._device_queues
+            assert device not in rate_limiter.get_stats()
+            assert device not in command_metrics.devices
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
+
+def test_shutdown_resolves_the_running_command(new_service):
+    device = _device()
+
+    async def scenario():
+        service = new_service()
+
+        async def hangs():
+            await asyncio.Event().wait()
+
+        running = await service.add_command(device, hangs)
+        await asyncio.sleep(0.01)
+        await service.shutdown()
+        assert running.result() is False
+
+    asyncio.run(scenario())
+
+
+def test_replay_applies_the_overflow_policy(new_service, tmp_path):
+    device = _device()
+    path = str(tmp_path / "commands.journal")
+    calls = []
+
+    async def hangs(value):
+        await asyncio.Event().wait()
+
+    async def record(value):
+        calls.append(value)
+        return True
+
+    async def first_run():
+        service = new_service(_journal=CommandJournal(path, fsync=False))
+        service.register_command("test.cmd", hangs)
+        await service.start()
+        for value in range(3):
+            await service.add_command(device, hangs, [value])
+        await asyncio.sleep(0.01)
+        await service.shutdown()
+
+    async def second_run():
+        service = new_service(_journal=CommandJournal(path, fsync=False), _max_depth=2, _overflow="reject")
+        service.register_command("test.cmd", record)
+        try:
+            await service.start()
+            assert service.get_stats()["replayed"] == 2
+            # The rate limiter spaces the two replayed commands
+            for _ in range(40):
+                if len(calls) == 2:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await service.shutdown()
+
+    asyncio.run(first_run())
+    asyncio.run(second_run())
+    assert calls == [0, 1]
+    # The rejected command was marked done and is not replayed again
+    assert CommandJournal(path).replay() == []
+
+
+def test_replay_merges_records_with_the_same_coalesce_key(new_service, tmp_path):
+    device = _device()
+    path = str(tmp_path / "commands.journal")
+    calls = []
+
+    async def record(value):
+        calls.append(value)
+        return True
+
+    def entry(entry_id, value):
+        now = time.time()
+        return {"op": "add", "id": entry_id, "command": {
+            "entry_id": entry_id, "device_id": device, "name": "test.cmd", "args": [value], "kwargs": {},
+            "lane": 0, "priority": 0, "timestamp": now, "deadline": now + 60, "coalesce_key": "brightness",
+        }}
+
+    CommandJournal(path, fsync=False).append([entry("a", 1), entry("b", 2)])
+
+    async def scenario():
+        service = new_service(_journal=CommandJournal(path, fsync=False))
+        service.register_command("test.cmd", record)
+        try:
+            await service.start()
+            for _ in range(20):
+                if calls:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
+    # Last write wins, and neither record is left for the next start
+    assert calls == [2]
+    assert CommandJournal(path).replay() == []
+
+
+async def _fill(service, device, depth):
+    """Occupy the device with a running command and queue ``depth`` more behind it"""
+    release = asyncio.Event()
+    calls = []
+
+    async def command(value):
+        await release.wait()
+        calls.append(value)
+        return True
+
+    running = await service.add_command(device, command, ["running"])
+    await asyncio.sleep(0.01)
+    queued = [await service.add_command(device, command, [i]) for i in range(depth)]
+    return release, command, running, queued, calls
+
+
+def test_reject_raises_queue_full_with_retry_after(new_service):
+    device = _device()
+
+    async def scenario():
+        service = new_service(_max_depth=2, _overflow="reject")
+        try:
+            release, command, _, _, _ = await _fill(service, device, 2)
+            with pytest.raises(QueueFullError) as info:
+                await service.add_command(device, command, ["late"])
+            assert (info.value.scope, info.value.depth, info.value.limit) == ("device", 2, 2)
+            # Two commands at the initial 2.5/s rate
+            assert info.value.retry_after == 1
+            assert service.get_stats()["overflows"]["reject"] == 1
+            release.set()
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_global_limit_applies_across_devices(new_service):
+    first, second = _device(), _device()
+
+    async def scenario():
+        service = new_service(_max_total=2, _overflow="reject")
+        try:
+            release, command, _, _, _ = await _fill(service, first, 2)
+            with pytest.raises(QueueFullError) as info:
+                await service.add_command(second, command, ["other"])
+            assert (info.value.scope, info.value.retry_after) == ("global", 1)
+            release.set()
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_drop_oldest_makes_room(new_service):
+    device = _device()
+
+    async def scenario():
+        service = new_service(_max_depth=2, _overflow="drop_oldest")
+        try:
+            release, command, _, queued, calls = await _fill(service, device, 2)
+            newest = await service.add_command(device, command, ["newest"])
+            assert queued[0].result() is False
+            assert service.get_stats()["total_depth"] == 2
+
+            release.set()
+            assert await newest is True
+            assert calls == ["running", 1, "newest"]
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_drop_newest_keeps_the_queue(new_service):
+    device = _device()
+
+    async def scenario():
+        service = new_service(_max_depth=2, _overflow="drop_newest")
+        try:
+            release, command, _, queued, calls = await _fill(service, device, 2)
+            dropped = await service.add_command(device, command, ["newest"])
+            assert dropped.result() is False
+
+            release.set()
+            assert await queued[1] is True
+            assert calls == ["running", 0, 1]
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_coalesce_overflow_updates_the_latest_pending_command(new_service):
+    device = _device()
+
+    async def scenario():
+        service = new_service(_max_depth=2, _overflow="coalesce")
+        try:
+            release, command, _, queued, calls = await _fill(service, device, 2)
+            merged = await service.add_command(device, command, ["newest"])
+            assert merged is queued[1]
+            assert service.get_stats()["overflows"]["coalesce"] == 1
+
+            release.set()
+            assert await merged is True
+            assert calls == ["running", 0, "newest"]
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
+
+
+def _queued(name, lane, age=0.0, coalesce_key=None):
+    return {"name": name, "func": None, "args": [name], "kwargs": {}, "id": 0, "deadline": None,
+            "lane": lane, "priority": int(lane), "timestamp": time.time() - age, "coalesce_key": coalesce_key}
+
+
+def _drain(queue):
+    names = []
+    while not queue.empty():
+        names.append(queue.get_nowait()["name"])
+    return names
+
+
+def test_lanes_are_served_by_priority_then_fifo():
+    queue = PriorityCommandQueue(starvation_timeout=60)
+    queue.put_nowait(_queued("poll", CommandLane.BACKGROUND))
+    queue.put_nowait(_queued("scene-1", CommandLane.AUTOMATION))
+    queue.put_nowait(_queued("tap-1", CommandLane.INTERACTIVE))
+    queue.put_nowait(_queued("scene-2", CommandLane.AUTOMATION))
+    queue.put_nowait(_queued("tap-2", CommandLane.INTERACTIVE))
+
+    assert queue.qsize() == 5
+    assert _drain(queue) == ["tap-1", "tap-2", "scene-1", "scene-2", "poll"]
+    with pytest.raises(asyncio.QueueEmpty):
+        queue.get_nowait()
+
+
+def test_starving_lane_is_promoted_once_per_timeout():
+    queue = PriorityCommandQueue(starvation_timeout=2)
+    queue.put_nowait(_queued("old-poll", CommandLane.BACKGROUND, age=5))
+    queue.put_nowait(_queued("old-scene", CommandLane.AUTOMATION, age=3))
+    queue.put_nowait(_queued("tap-1", CommandLane.INTERACTIVE))
+    queue.put_nowait(_queued("tap-2", CommandLane.INTERACTIVE))
+
+    # The longest-waiting starved lane goes first, then priority order resumes
+    assert _drain(queue) == ["old-poll", "tap-1", "tap-2", "old-scene"]
+    assert queue.promotions == 1
+
+
+def test_priority_outside_the_lanes_is_clamped(new_service):
+    device = _device()
+
+    async def scenario():
+        service = new_service()
+        release = asyncio.Event()
+
+        async def blocked():
+            await release.wait()
+            return True
+
+        try:
+            await service.add_command(device, blocked)
+            await asyncio.sleep(0.01)
+            await service.add_command(device, blocked, priority=99)
+            await service.add_command(device, blocked, priority=-5)
+            queue = service._device_queues[device]
+            assert [command["lane"] for command in (queue.get_nowait(), queue.get_nowait())] == [
+                CommandLane.INTERACTIVE, CommandLane.BACKGROUND]
+            release.set()
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_coalesced_commands_share_one_run_with_the_latest_target(new_service):
+    device = _device()
+
+    async def scenario():
+        service = new_service()
+        release, command, _, _, calls = await _fill(service, device, 0)
+        try:
+            futures = [await service.add_command(device, command, [value], coalesce_key="brightness") for value in (10, 20, 30)]
+            other = await service.add_command(device, command, ["switch"], coalesce_key="switch")
+            assert futures[0] is futures[1] is futures[2]
+            assert service.get_stats()["superseded"] == 2
+            assert service.get_stats()["devices"][device]["depth"] == 2
+
+            release.set()
+            assert await futures[0] is True
+            assert await other is True
+            assert calls == ["running", 30, "switch"]
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_superseding_from_a_more_urgent_lane_promotes_the_command():
+    queue = PriorityCommandQueue(starvation_timeout=60)
+    queue.put_nowait(_queued("scene", CommandLane.AUTOMATION))
+    pending = queue.put_nowait(_queued("ramp", CommandLane.BACKGROUND, coalesce_key="brightness"))
+
+    assert queue.put_nowait(_queued("tap", CommandLane.INTERACTIVE, coalesce_key="brightness")) is pending
+    assert (pending["lane"], pending["args"]) == (CommandLane.INTERACTIVE, ["tap"])
+    assert [queue.get_nowait()["args"] for _ in range(2)] == [["tap"], ["scene"]]
+    # The key is free again once the command left the queue
+    assert queue.put_nowait(_queued("later", CommandLane.BACKGROUND, coalesce_key="brightness"))["name"] == "later"
+
+
+def test_expired_commands_are_dropped_without_using_a_token(new_service):
+    device = _device()
+
+    async def scenario():
+        service = new_service()
+        release, command, _, _, calls = await _fill(service, device, 0)
+        try:
+            stale = await service.add_command(device, command, ["stale"], ttl=0.01)
+            fresh = await service.add_command(device, command, ["fresh"], ttl=60)
+            await asyncio.sleep(0.05)
+
+            released = time.monotonic()
+            release.set()
+            assert await fresh is True
+            # One token wait after the running command, none for the dropped one
+            assert time.monotonic() - released < 0.7
+            assert stale.result() is False
+            assert calls == ["running", "fresh"]
+            stats = service.get_stats()
+            assert stats["expired"]["interactive"] == 1
+            assert stats["devices"][device]["expired"] == 1
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_deadline_follows_the_lane_ttl(new_service):
+    device = _device()
+
+    async def scenario():
+        service = new_service()
+        release, command, _, _, _ = await _fill(service, device, 0)
+        try:
+            for lane in CommandLane:
+                await service.add_command(device, command, [lane.name], priority=lane)
+            await service.add_command(device, command, ["forever"], priority=CommandLane.BACKGROUND, ttl=0)
+            lanes = service._device_queues[device]._lanes
+            for lane in CommandLane:
+                queued = lanes[lane][0]
+                assert queued["deadline"] - queued["timestamp"] == pytest.approx(service._ttl[lane])
+            assert lanes[CommandLane.BACKGROUND][1]["deadline"] is None
+            release.set()
+        finally:
+            await service.shutdown()
+
+    asyncio.run(scenario())
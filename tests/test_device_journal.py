@@ -0,0 +1,107 @@
+import json
+
+from app.core.device_journal import DeviceJournal
+from app.core.json_backend import JsonDeviceBackend
+
+
+def _write_snapshot(path, devices):
+    path.write_text(json.dumps(devices))
+
+
+def test_replay_applies_deltas_in_order(tmp_path):
+    journal = DeviceJournal(str(tmp_path / "devices.journal"), fsync=False)
+    journal.append({"bulb": {"ison": True, "brightness": 10}})
+    journal.append({"bulb": {"brightness": 80}})
+
+    devices = {"bulb": {"device_id": "bulb", "ison": False, "brightness": 100}}
+    assert journal.replay(devices) == 2
+    assert devices["bulb"] == {"device_id": "bulb", "ison": True, "brightness": 80}
+    assert journal.entries == 2
+
+
+def test_replay_skips_devices_missing_from_snapshot(tmp_path):
+    journal = DeviceJournal(str(tmp_path / "devices.journal"), fsync=False)
+    journal.append({"bulb": {"ison": True}, "deleted": {"ison": True}})
+
+    devices = {"bulb": {"device_id": "bulb", "ison": False}}
+    assert journal.replay(devices) == 1
+    assert "deleted" not in devices
+    assert devices["bulb"]["ison"] is True
+
+
+def test_replay_skips_torn_tail(tmp_path):
+    path = tmp_path / "devices.journal"
+    journal = DeviceJournal(str(path), fsync=False)
+    journal.append({"bulb": {"brightness": 40}})
+    with open(path, "a") as f:
+        f.write('{"device_id": "bulb", "delta": {"bright')
+
+    devices = {"bulb": {"device_id": "bulb", "brightness": 100}}
+    assert journal.replay(devices) == 1
+    assert devices["bulb"]["brightness"] == 40
+
+
+def test_replay_without_journal_file(tmp_path):
+    journal = DeviceJournal(str(tmp_path / "missing.journal"), fsync=False)
+    devices = {"bulb": {"device_id": "bulb"}}
+    assert journal.replay(devices) == 0
+    assert devices == {"bulb": {"device_id": "bulb"}}
+
+
+def test_truncate_resets_entries(tmp_path):
+    path = tmp_path / "devices.journal"
+    journal = DeviceJournal(str(path), fsync=False)
+    journal.append({"a": {"ison": True}, "b": {"ison": False}})
+    assert journal.entries == 2
+
+    journal.truncate()
+    assert journal.entries == 0
+    assert path.read_text() == ""
+
+
+def test_load_folds_journal_into_snapshot(tmp_path):
+    snapshot = tmp_path / "devices.json"
+    _write_snapshot(snapshot, [{"device_id": "bulb", "ison": False}])
+    backend = JsonDeviceBackend(str(snapshot), journal_path=str(tmp_path / "devices.journal"))
+    backend.journal.fsync = False
+    backend.journal.append({"bulb": {"ison": True}, "ghost": {"ison": True}})
+
+    devices = backend.load()
+    assert devices == {"bulb": {"device_id": "bulb", "ison": True}}
+    # Replayed entries were compacted into the snapshot and the journal emptied
+    assert json.loads(snapshot.read_text()) == [{"device_id": "bulb", "ison": True}]
+    assert backend.journal.entries == 0
+    assert (tmp_path / "devices.journal").read_text() == ""
+
+
+def test_compact_replaces_snapshot(tmp_path):
+    snapshot = tmp_path / "devices.json"
+    _write_snapshot(snapshot, [{"device_id": "old"}])
+    backend = JsonDeviceBackend(str(snapshot), journal_path=str(tmp_path / "devices.journal"))
+    backend.journal.fsync = False
+    backend.write({"old": {"ison": True}}, {})
+
+    assert backend.compact({"new": {"device_id": "new"}})
+    assert json.loads(snapshot.read_text()) == [{"device_id": "new"}]
+    assert backend.journal.entries == 0
+    assert not backend.changed_externally()
+
+
+def test_store_snapshots_new_devices(tmp_path):
+    from app.core.device_store import DeviceStore
+
+    snapshot = tmp_path / "devices.json"
+    _write_snapshot(snapshot, [{"device_id": "bulb", "ison": False}])
+
+    def open_store():
+        backend = JsonDeviceBackend(str(snapshot), journal_path=str(tmp_path / "devices.journal"))
+        backend.journal.fsync = False
+        return DeviceStore(str(snapshot), backend=backend)
+
+    store = open_store()
+    store.put({"device_id": "lamp", "ison": True})
+    store.update("bulb", {"ison": True})
+
+    reopened = open_store()
+    assert reopened.get("lamp") == {"device_id": "lamp", "ison": True}
+    assert reopened.get("bulb")["ison"] is True
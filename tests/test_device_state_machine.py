@@ -0,0 +1,166 @@
+import asyncio
+import uuid
+
+import pytest
+
+from app.repositories.device_repository import device_repository
+from app.services.ack_tracker import ack_tracker
+from app.services.device_state_machine import DeviceStateMachine
+from app.services.telemetry_service import telemetry_service
+
+
+@pytest.fixture
+def machine(monkeypatch):
+    async def resolve(device_id):
+        return None  # Unknown to the repository: nothing is persisted
+
+    monkeypatch.setattr(device_repository, "resolve", resolve)
+    return DeviceStateMachine()
+
+
+def _topic():
+    return f"test/dedup-{uuid.uuid4().hex[:8]}/state"
+
+
+def test_identical_payloads_are_dispatched_once(machine):
+    topic = _topic()
+    calls = []
+    machine.register_topic("test/+/state", lambda t, payload: calls.append(payload))
+
+    asyncio.run(machine.handle_messages([(topic, b'{"ison": true}'), (topic, b'{"ison": true}')]))
+    asyncio.run(machine.handle_message(topic, b'{"ison": true}'))
+
+    assert calls == [b'{"ison": true}']
+    stats = machine.get_dedup_stats()
+    assert (stats["messages"], stats["duplicates"]) == (3, 2)
+
+
+def test_changed_payload_or_other_topic_is_dispatched(machine):
+    first, second = _topic(), _topic()
+    calls = []
+    machine.register_topic("test/+/state", lambda t, payload: calls.append((t, payload)))
+
+    asyncio.run(machine.handle_messages([
+        (first, b'{"ison": true}'),
+        (second, b'{"ison": true}'),
+        (first, b'{"ison": false}'),
+        (first, b'{"ison": true}'),
+    ]))
+    assert len(calls) == 4
+
+
+def test_command_sent_since_last_report_changes_the_fingerprint(machine):
+    topic = _topic()
+    device_id = topic.split("/")[1]
+    calls = []
+    machine.register_topic("test/+/state", lambda t, payload: calls.append(payload))
+
+    async def scenario():
+        await machine.handle_message(topic, b'{"ison": false}')
+        ack_tracker.expect(device_id, "switch", {"ison": True})
+        # The device repeats its old state after the command: still processed
+        await machine.handle_message(topic, b'{"ison": false}')
+        await machine.handle_message(topic, b'{"ison": false}')
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_failed_handler_does_not_record_a_fingerprint(machine):
+    topic = _topic()
+    calls = []
+
+    def flaky(t, payload):
+        calls.append(payload)
+        if len(calls) == 1:
+            raise ValueError("boom")
+
+    machine.register_topic("test/+/state", flaky)
+    asyncio.run(machine.handle_messages([(topic, b"1"), (topic, b"1"), (topic, b"1")]))
+    assert len(calls) == 2
+
+
+def test_repeated_meter_readings_are_still_recorded(machine, monkeypatch):
+    samples = []
+    monkeypatch.setattr(telemetry_service, "record",
+                        lambda device_id, metric, value: samples.append((device_id, metric, value)))
+    topic = f"shellies/meter-{uuid.uuid4().hex[:8]}/light/0/power"
+
+    asyncio.run(machine.handle_messages([(topic, b"12.5"), (topic, b"12.5"), (topic, b"12.5")]))
+    assert [value for _, _, value in samples] == [12.5, 12.5, 12.5]
+    assert machine.get_dedup_stats()["duplicates"] == 0
+
+
+def test_malformed_topic_does_not_drop_the_batch(machine):
+    topic = _topic()
+    calls = []
+    machine.register_topic("test/+/state", lambda t, payload: calls.append(payload))
+
+    asyncio.run(machine.handle_messages([("garbage", b"x"), (topic, b"1")]))
+    assert calls == [b"1"]
+
+
+class _CountingLock(asyncio.Lock):
+    def __init__(self):
+        super().__init__()
+        self.acquired = 0
+
+    async def acquire(self):
+        self.acquired += 1
+        return await super().acquire()
+
+
+def test_batch_is_applied_once_under_one_lock(machine, monkeypatch):
+    monkeypatch.setattr(telemetry_service, "record", lambda device_id, metric, value: None)
+    persisted, change_sets = [], []
+
+    async def resolve(device_id):
+        return device_id
+
+    async def update_many(updates):
+        persisted.append(updates)
+
+    monkeypatch.setattr(device_repository, "resolve", resolve)
+    monkeypatch.setattr(device_repository, "update_many", update_many)
+
+    async def listener(changes):
+        change_sets.append(changes)
+
+    machine.add_listener(listener)
+    bulb, lamp = f"bulb-{uuid.uuid4().hex[:8]}", f"lamp-{uuid.uuid4().hex[:8]}"
+
+    async def scenario():
+        machine.lock = _CountingLock()
+        await machine.handle_messages([
+            (f"shellies/{bulb}/color/0/status", b'{"ison": true, "brightness": 40}'),
+            (f"shellies/{bulb}/online", b"true"),
+            (f"shellies/{lamp}/light/0/power", b"7.5"),
+            (f"shellies/{bulb}/color/0/status", b'{"ison": true, "brightness": 80}'),
+        ])
+        return machine.lock.acquired
+
+    assert asyncio.run(scenario()) == 1
+    # Later reports in the batch win; every device appears once in one change set
+    assert len(change_sets) == 1
+    assert change_sets[0][bulb]["brightness"] == 80
+    assert change_sets[0][bulb]["online"] is True
+    assert change_sets[0][lamp] == {"power": 7.5}
+    assert len(persisted) == 1 and set(persisted[0]) == {bulb, lamp}
+    assert machine.devices[bulb]["brightness"] == 80
+
+
+def test_empty_batch_takes_no_lock(machine):
+    calls = []
+
+    async def listener(changes):
+        calls.append(changes)
+
+    machine.add_listener(listener)
+
+    async def scenario():
+        machine.lock = _CountingLock()
+        await machine.handle_messages([("garbage", b"x")])
+        return machine.lock.acquired
+
+    assert asyncio.run(scenario()) == 0
+    assert calls == []
@@ -0,0 +1,118 @@
+import asyncio
+import json
+
+import pytest
+
+from app.core.config import settings
+from app.core.device_store import DeviceStore
+from app.core.file_cache import JsonFileCache
+from app.core.json_backend import JsonDeviceBackend
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    path = tmp_path / "devices.json"
+    path.write_text(json.dumps([
+        {"device_id": "bulb", "shelly_id": "shellycolorbulb-1", "ison": False, "brightness": 100},
+        {"device_id": "lamp", "shelly_id": "shellycolorbulb-2", "ison": False},
+    ]))
+    return path
+
+
+def _open_store(snapshot):
+    backend = JsonDeviceBackend(str(snapshot), journal_path=str(snapshot.with_suffix(".journal")))
+    backend.journal.fsync = False
+    return DeviceStore(str(snapshot), backend=backend)
+
+
+def test_file_cache_reparses_only_on_change(tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text("[1]")
+    cache = JsonFileCache()
+
+    first = cache.read(str(path))
+    assert cache.read(str(path)) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    path.write_text("[1, 2]")
+    assert cache.read(str(path)) == [1, 2]
+    assert cache.misses == 2
+
+
+def test_file_cache_forgets_deleted_files(tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text("{}")
+    cache = JsonFileCache()
+    cache.read(str(path))
+
+    path.unlink()
+    with pytest.raises(FileNotFoundError):
+        cache.read(str(path))
+
+
+def test_all_returns_independent_copies(snapshot):
+    store = _open_store(snapshot)
+    devices = store.all()
+    devices[0]["ison"] = True
+    devices.append({"device_id": "bogus"})
+
+    assert store.get(devices[0]["device_id"])["ison"] is False
+    assert len(store.all()) == 2
+
+
+def test_resolves_shelly_ids_and_topics(snapshot):
+    store = _open_store(snapshot)
+    assert store.resolve("shellycolorbulb-2") == "lamp"
+    assert store.resolve_topic("shellies/shellycolorbulb-1/color/0/status") == "bulb"
+    assert store.resolve_topic("shellies/unknown/color/0/status") is None
+
+
+def test_reload_keeps_pending_changes_of_existing_devices_only(snapshot, monkeypatch):
+    monkeypatch.setattr(settings, "DEVICES_WATCH", False)
+
+    async def scenario():
+        store = _open_store(snapshot)
+        await store.start()
+        try:
+            store.update("bulb", {"brightness": 40})
+            store.update("lamp", {"ison": True})
+
+            # External edit: lamp removed, bulb renamed
+            snapshot.write_text(json.dumps([
+                {"device_id": "bulb", "shelly_id": "shellycolorbulb-1", "ison": False, "brightness": 100, "name": "Desk"},
+            ]))
+            assert store.backend.changed_externally()
+            await store.reload_async()
+
+            assert store.get("bulb") == {
+                "device_id": "bulb", "shelly_id": "shellycolorbulb-1",
+                "ison": False, "brightness": 40, "name": "Desk",
+            }
+            assert store.get("lamp") is None
+            assert store.resolve("shellycolorbulb-2") is None
+        finally:
+            await store.stop()
+
+    asyncio.run(scenario())
+
+    reopened = _open_store(snapshot)
+    assert [d["device_id"] for d in reopened.all()] == ["bulb"]
+    assert reopened.get("bulb")["brightness"] == 40
+
+
+def test_reload_waits_for_an_in_flight_flush(snapshot, monkeypatch):
+    monkeypatch.setattr(settings, "DEVICES_WATCH", False)
+
+    async def scenario():
+        store = _open_store(snapshot)
+        await store.start()
+        try:
+            async with store._io_lock:
+                reload = asyncio.create_task(store.reload_async())
+                await asyncio.sleep(0.05)
+                assert not reload.done()
+            await reload
+        finally:
+            await store.stop()
+
+    asyncio.run(scenario())
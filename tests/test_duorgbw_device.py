@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+import paho.mqtt.client as mqtt
+import pytest
+
+from app.integration.producers.shelly.ShellyDuoRGBW import device as duo
+from app.repositories.device_repository import device_repository
+from app.services.ack_tracker import ack_tracker
+from app.services.mqtt_service import mqtt_service
+
+
+class _Published:
+    rc = mqtt.MQTT_ERR_SUCCESS
+
+
+@pytest.fixture
+def bulb(monkeypatch):
+    """A bulb in the repository whose publishes and ack expectations are recorded"""
+    record = {"device_id": "desk", "shelly_id": "shellycolorbulb-AA", "mode": "white"}
+    published, expected, updates = [], [], []
+
+    async def get(device_id):
+        return dict(record) if device_id in ("desk", "shellycolorbulb-AA") else None
+
+    async def update(device_id, fields):
+        updates.append(fields)
+
+    monkeypatch.setattr(device_repository, "get", get)
+    monkeypatch.setattr(device_repository, "update", update)
+    monkeypatch.setattr(mqtt_service, "safe_publish", lambda topic, payload: published.append((topic, payload)) or _Published())
+    monkeypatch.setattr(ack_tracker, "expect", lambda device_id, command, fields: expected.append((device_id, command, fields)))
+    return record, published, expected, updates
+
+
+def test_single_commands_use_the_fan_out_builders(bulb):
+    record, published, expected, updates = bulb
+
+    assert asyncio.run(duo._set_temperature("desk", 9000))
+    topic, payload, state = duo._temperature_command(record, 9000)
+    assert published == [(topic, payload)]
+    assert json.loads(payload) == {"mode": "white", "temp": 6465}
+    assert expected == [("desk", "temperature", {"temp": 6465})]
+    assert updates == [state]
+
+
+def test_brightness_follows_the_mode(bulb):
+    record, published, expected, _ = bulb
+
+    asyncio.run(duo._set_brightness("shellycolorbulb-AA", 140))
+    assert json.loads(published[-1][1]) == {"brightness": 100}
+    assert expected[-1] == ("desk", "brightness", {"brightness": 100})
+
+    record["mode"] = "color"
+    asyncio.run(duo._set_brightness("desk", 40))
+    assert json.loads(published[-1][1]) == {"gain": 40}
+    assert expected[-1] == ("desk", "brightness", {"gain": 40})
+
+
+def test_missing_device_publishes_nothing(bulb):
+    _, published, _, _ = bulb
+    assert asyncio.run(duo._turn_on("unknown")) is False
+    assert published == []
@@ -0,0 +1,101 @@
+import asyncio
+import socket
+import threading
+
+import paho.mqtt.client as mqtt
+
+from app.services.mqtt_asyncio import AsyncioMQTTDriver
+
+
+async def _read_packet(reader):
+    header = (await reader.readexactly(1))[0]
+    length, shift = 0, 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    return header >> 4, await reader.readexactly(length)
+
+
+def _publish_packet(topic: str, payload: bytes) -> bytes:
+    body = len(topic).to_bytes(2, "big") + topic.encode() + payload
+    return bytes([0x30, len(body)]) + body
+
+
+async def _broker(received):
+    """Minimal MQTT 3.1.1 broker: accepts the connection and publishes one message"""
+    async def handle(reader, writer):
+        try:
+            while True:
+                packet_type, _ = await _read_packet(reader)
+                received.append(packet_type)
+                if packet_type == 1:  # CONNECT
+                    writer.write(bytes([0x20, 0x02, 0x00, 0x00]))
+                    writer.write(_publish_packet("shellies/bulb/online", b"true"))
+                elif packet_type == 12:  # PINGREQ
+                    writer.write(bytes([0xD0, 0x00]))
+                elif packet_type == 14:  # DISCONNECT
+                    break
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def _client(messages):
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id="test")
+    client.on_message = lambda c, userdata, msg: messages.append((msg.topic, msg.payload, threading.get_ident()))
+    return client
+
+
+def test_driver_runs_paho_on_the_event_loop():
+    messages, received = [], []
+
+    async def scenario():
+        server = await _broker(received)
+        port = server.sockets[0].getsockname()[1]
+        client = _client(messages)
+        driver = AsyncioMQTTDriver(client)
+        client.connect_async("127.0.0.1", port)
+        driver.start()
+        try:
+            for _ in range(100):
+                if messages:
+                    break
+                await asyncio.sleep(0.02)
+            assert client.is_connected()
+        finally:
+            await driver.stop()
+            server.close()
+            await server.wait_closed()
+        return threading.get_ident(), driver.get_stats()
+
+    loop_thread, stats = asyncio.run(scenario())
+    assert messages == [("shellies/bulb/online", b"true", loop_thread)]
+    assert stats["connects"] == 1
+    assert stats["reads"] >= 1
+    assert received[0] == 1 and received[-1] == 14  # CONNECT ... DISCONNECT
+
+
+def test_driver_retries_failed_connects():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]  # Nothing listens here once closed
+
+    async def scenario():
+        client = _client([])
+        driver = AsyncioMQTTDriver(client, min_reconnect_delay=0.01, max_reconnect_delay=0.02)
+        client.connect_async("127.0.0.1", port)
+        driver.start()
+        await asyncio.sleep(0.2)
+        await driver.stop(timeout=0)
+        return driver.get_stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["connects"] == 0
+    assert stats["connect_failures"] >= 2
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+
+from app.services.mqtt_bridge import MQTTIngestBridge
+
+
+def test_submit_before_start_is_refused():
+    async def handler(batch):
+        pass
+
+    bridge = MQTTIngestBridge(handler, capacity=4, batch_size=2, window=0)
+    assert bridge.submit("shellies/a/status", b"{}") is False
+
+
+def test_drains_in_batches_in_order():
+    batches = []
+
+    async def handler(batch):
+        batches.append(batch)
+
+    async def scenario():
+        bridge = MQTTIngestBridge(handler, capacity=10, batch_size=2, window=0)
+        bridge.start()
+        try:
+            for i in range(5):
+                assert bridge.submit(f"t/{i}", str(i).encode())
+            await asyncio.sleep(0.05)
+            return bridge.get_stats()
+        finally:
+            await bridge.stop()
+
+    stats = asyncio.run(scenario())
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert [topic for batch in batches for topic, _ in batch] == [f"t/{i}" for i in range(5)]
+    assert (stats["processed"], stats["batches"], stats["max_batch"], stats["buffered"]) == (5, 3, 2, 0)
+
+
+def test_full_buffer_drops_oldest():
+    batches = []
+
+    async def handler(batch):
+        batches.append(batch)
+
+    async def scenario():
+        bridge = MQTTIngestBridge(handler, capacity=3, batch_size=10, window=0)
+        bridge.start()
+        try:
+            # Nothing drains until the loop gets control back
+            for i in range(5):
+                bridge.submit("t", str(i).encode())
+            await asyncio.sleep(0.05)
+            return bridge.get_stats()
+        finally:
+            await bridge.stop()
+
+    stats = asyncio.run(scenario())
+    assert batches == [[("t", b"2"), ("t", b"3"), ("t", b"4")]]
+    assert (stats["received"], stats["dropped"], stats["overflows"], stats["high_water"]) == (5, 2, 1, 3)
+
+
+def test_submit_from_another_thread():
+    received = []
+
+    async def handler(batch):
+        received.extend(batch)
+
+    async def scenario():
+        bridge = MQTTIngestBridge(handler, capacity=100, batch_size=10, window=0.01)
+        bridge.start()
+        try:
+            thread = threading.Thread(target=lambda: [bridge.submit("t", bytes([i])) for i in range(20)])
+            thread.start()
+            await asyncio.get_running_loop().run_in_executor(None, thread.join)
+            await asyncio.sleep(0.05)
+        finally:
+            await bridge.stop()
+
+    asyncio.run(scenario())
+    assert [payload for _, payload in received] == [bytes([i]) for i in range(20)]
+
+
+def test_handler_errors_do_not_stop_the_bridge():
+    seen = []
+
+    async def handler(batch):
+        seen.extend(batch)
+        if len(seen) == 1:
+            raise ValueError("bad batch")
+
+    async def scenario():
+        bridge = MQTTIngestBridge(handler, capacity=10, batch_size=1, window=0)
+        bridge.start()
+        try:
+            bridge.submit("t", b"1")
+            await asyncio.sleep(0.01)
+            bridge.submit("t", b"2")
+            await asyncio.sleep(0.01)
+            return bridge.get_stats()
+        finally:
+            await bridge.stop()
+
+    stats = asyncio.run(scenario())
+    assert len(seen) == 2
+    assert stats["errors"] == 1
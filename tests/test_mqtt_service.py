@@ -0,0 +1,81 @@
+import paho.mqtt.client as mqtt
+import pytest
+
+from app.core.config import settings
+from app.core.device_store import device_store
+from app.services.device_state_machine import DeviceStateMachine
+from app.services.mqtt_service import MQTTService
+
+
+class _Client:
+    """Records (un)subscribe calls instead of talking to a broker"""
+
+    def __init__(self):
+        self.subscribed = []
+        self.unsubscribed = []
+
+    def is_connected(self):
+        return True
+
+    def subscribe(self, topics):
+        self.subscribed.append(sorted(topic for topic, _ in topics))
+        return mqtt.MQTT_ERR_SUCCESS, 1
+
+    def unsubscribe(self, topics):
+        self.unsubscribed.append(sorted(topics))
+        return mqtt.MQTT_ERR_SUCCESS, 1
+
+
+@pytest.fixture
+def service(monkeypatch):
+    shelly_ids = ["bulb-1"]
+    monkeypatch.setattr(settings, "MQTT_NARROW_SUBSCRIPTIONS", True)
+    monkeypatch.setattr(device_store, "shelly_ids", lambda: list(shelly_ids))
+    monkeypatch.setattr(MQTTService, "_instance", None)
+    service = MQTTService(DeviceStateMachine())
+    service.client = _Client()
+    service.shelly_ids = shelly_ids
+    return service
+
+
+def test_narrow_subscriptions_cover_every_registered_filter(service):
+    service._sync_subscriptions()
+    assert service.subscriptions == {
+        "shellies/announce",
+        "shellies/bulb-1/color/0/status",
+        "shellies/bulb-1/light/+/status",
+        "shellies/bulb-1/light/0/power",
+        "shellies/bulb-1/light/0/energy",
+        "shellies/bulb-1/online",
+        "shellies/bulb-1/sensor/+",
+    }
+
+
+def test_subscriptions_follow_devices_and_handlers(service):
+    service._sync_subscriptions()
+    service.client.subscribed.clear()
+
+    # Device renamed: only its topics change
+    service.shelly_ids[:] = ["bulb-2"]
+    service._sync_subscriptions()
+    assert all("bulb-1" in topic for topic in service.client.unsubscribed[0])
+    assert all("bulb-2" in topic for topic in service.client.subscribed[0])
+    assert len(service.client.subscribed[0]) == len(service.client.unsubscribed[0]) == 6
+
+    # A new handler is subscribed per device, a broadcast one as is
+    service.client.subscribed.clear()
+    service.register_handler("shellies/+/relay/0", lambda topic, payload: None)
+    service.register_handler("zigbee/#", lambda topic, payload: None)
+    service._sync_subscriptions()
+    assert service.client.subscribed == [["shellies/bulb-2/relay/0", "zigbee/#"]]
+
+    # Nothing to do when nothing changed
+    service.client.subscribed.clear()
+    service._sync_subscriptions()
+    assert service.client.subscribed == []
+
+
+def test_wide_subscription(service, monkeypatch):
+    monkeypatch.setattr(settings, "MQTT_NARROW_SUBSCRIPTIONS", False)
+    service._sync_subscriptions()
+    assert service.subscriptions == {"shellies/#"}
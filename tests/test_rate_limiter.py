@@ -0,0 +1,54 @@
+import pytest
+
+from app.services.rate_limiter import AdaptiveRateLimiter
+
+
+@pytest.fixture
+def limiter():
+    limiter = AdaptiveRateLimiter()
+    limiter._initial_rate = 2.0
+    limiter._min_rate, limiter._max_rate = 0.5, 10.0
+    limiter._capacity = 1.0
+    limiter._target_latency = 0.5
+    return limiter
+
+
+def test_token_bucket_spaces_commands(limiter):
+    assert limiter.delay("bulb") == 0
+    limiter.consume("bulb")
+    assert limiter.delay("bulb") == pytest.approx(0.5, abs=0.01)
+    # Other devices have their own bucket
+    assert limiter.delay("lamp") == 0
+
+
+def test_fast_acks_raise_the_rate_up_to_the_maximum(limiter):
+    limiter.observe_latency("bulb", 0.1)
+    assert limiter.rate("bulb") == pytest.approx(2.5)
+    for _ in range(50):
+        limiter.observe_latency("bulb", 0.1)
+    assert limiter.rate("bulb") == 10.0
+
+
+def test_slow_ack_cuts_the_rate(limiter):
+    limiter.observe_latency("bulb", 2.0)
+    assert limiter.rate("bulb") == pytest.approx(2.0 * AdaptiveRateLimiter.DECREASE)
+    stats = limiter.get_stats()["bulb"]
+    assert (stats["acks"], stats["backoffs"], stats["last_latency_ms"]) == (1, 1, 2000.0)
+
+
+def test_fast_ack_does_not_raise_while_the_average_is_slow(limiter):
+    limiter.observe_latency("bulb", 2.0)
+    rate = limiter.rate("bulb")
+    # The smoothed latency is still above target
+    limiter.observe_latency("bulb", 0.4)
+    assert limiter.rate("bulb") == rate
+
+
+def test_lost_acks_back_off_down_to_the_minimum(limiter):
+    limiter.record_timeout("bulb")
+    assert limiter.rate("bulb") == pytest.approx(1.0)
+    for _ in range(10):
+        limiter.record_timeout("bulb")
+    assert limiter.rate("bulb") == 0.5
+    assert limiter.get_stats()["bulb"]["timeouts"] == 11
+
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.telemetry_service import TelemetryService
+
+# Start of yesterday: within every retention window, and 1m/1h/1d buckets all start here
+T0 = time.time() // 86400 * 86400 - 86400
+
+
+@pytest.fixture
+def telemetry(tmp_path):
+    return TelemetryService(file_path=str(tmp_path / "telemetry.json"))
+
+
+def test_minute_buckets(telemetry):
+    for offset, value in ((0, 10), (20, 30), (59, 20), (60, 5)):
+        telemetry.record("bulb", "power", value, ts=T0 + offset)
+
+    points = telemetry.query("bulb", "power", T0, T0 + 120, 60)
+    assert [p["ts"] for p in points] == [T0, T0 + 60]
+    first = points[0]
+    assert (first["count"], first["min"], first["max"], first["first"], first["last"]) == (3, 10, 30, 10, 20)
+    assert first["avg"] == pytest.approx(20)
+
+
+def test_late_samples_land_in_their_bucket(telemetry):
+    telemetry.record("bulb", "power", 1, ts=T0 + 120)
+    telemetry.record("bulb", "power", 3, ts=T0 + 10)
+    telemetry.record("bulb", "power", 5, ts=T0 + 130)
+
+    points = telemetry.query("bulb", "power", T0, T0 + 180, 60)
+    assert [(p["ts"], p["count"]) for p in points] == [(T0, 1), (T0 + 120, 2)]
+
+
+def test_energy_delta_includes_gap_since_previous_bucket(telemetry):
+    # A monotonically increasing counter sampled every 30 minutes
+    for i, value in enumerate((100, 110, 130, 160)):
+        telemetry.record("bulb", "energy", value, ts=T0 + i * 1800)
+
+    points = telemetry.query("bulb", "energy", T0, T0 + 7200, 3600)
+    assert [p["delta"] for p in points] == [10, 50]
+    assert sum(p["delta"] for p in points) == 160 - 100
+
+
+def test_coarse_step_combines_hour_buckets(telemetry):
+    for hour in range(6):
+        telemetry.record("bulb", "power", hour, ts=T0 + hour * 3600)
+
+    points = telemetry.query("bulb", "power", T0, T0 + 6 * 3600, 3 * 3600)
+    assert [(p["ts"], p["count"], p["max"]) for p in points] == [(T0, 3, 2), (T0 + 3 * 3600, 3, 5)]
+
+
+@pytest.mark.parametrize("step, expected", [(1, 60), (60, 60), (90, 120), (3600, 3600), (5400, 5400)])
+def test_effective_step_is_a_multiple_of_the_finest_tier(step, expected):
+    assert TelemetryService.effective_step(step) == expected
+
+
+def test_uneven_step_never_splits_a_rollup_bucket(telemetry):
+    for offset in range(0, 240, 30):
+        telemetry.record("bulb", "power", 1, ts=T0 + offset)
+
+    points = telemetry.query("bulb", "power", T0, T0 + 240, 90)
+    assert [p["ts"] for p in points] == [T0, T0 + 120]
+    assert [p["count"] for p in points] == [4, 4]
+
+
+def test_unknown_series_is_empty(telemetry):
+    assert telemetry.query("missing", "power", T0, T0 + 60, 60) == []
+    telemetry.record("bulb", "power", "n/a", ts=T0)
+    assert telemetry.query("bulb", "power", T0, T0 + 60, 60) == []
+
+
+def test_snapshot_round_trip_keeps_hour_and_day_rollups(tmp_path):
+    path = str(tmp_path / "telemetry.json")
+    start = T0
+
+    before = TelemetryService(file_path=path)
+    for hour in range(3):
+        before.record("bulb", "energy", 100 + hour, ts=start + hour * 3600)
+    assert before.save(before.snapshot())
+
+    after = TelemetryService(file_path=path)
+    assert after.load() == 1
+    assert after.query("bulb", "energy", start, start + 3 * 3600, 3600) == \
+        before.query("bulb", "energy", start, start + 3 * 3600, 3600)
+    assert after.query("bulb", "energy", start, start + 86400, 86400)[0]["count"] == 3
+    # 1-minute buckets are not persisted
+    assert after.query("bulb", "energy", start, start + 3 * 3600, 60) == []
+
+
+def test_load_keeps_buckets_already_in_memory(tmp_path):
+    path = str(tmp_path / "telemetry.json")
+    now = time.time()
+    hour = now - now % 3600
+
+    persisted = TelemetryService(file_path=path)
+    persisted.record("bulb", "power", 1, ts=hour)
+    persisted.record("bulb", "power", 2, ts=hour - 3600)
+    persisted.save(persisted.snapshot())
+
+    live = TelemetryService(file_path=path)
+    live.record("bulb", "power", 9, ts=hour)
+    live.load()
+    points = live.query("bulb", "power", hour - 3600, hour, 3600)
+    assert [(p["ts"], p["max"]) for p in points] == [(hour - 3600, 2), (hour, 9)]
+
+
+def test_stop_writes_a_final_snapshot(tmp_path):
+    path = str(tmp_path / "telemetry.json")
+
+    async def scenario():
+        service = TelemetryService(file_path=path)
+        await service.start()
+        service.record("bulb", "power", 5)
+        await service.stop()
+
+    asyncio.run(scenario())
+    assert TelemetryService(file_path=path).load() == 1
@@ -0,0 +1,54 @@
+import pytest
+
+from app.core.topic_trie import TopicTrie
+
+
+@pytest.fixture
+def trie():
+    trie = TopicTrie()
+    trie.add("shellies/+/color/0/status", "status")
+    trie.add("shellies/+/online", "online")
+    trie.add("shellies/announce", "announce")
+    trie.add("shellies/#", "all")
+    trie.add("#", "everything")
+    return trie
+
+
+@pytest.mark.parametrize("topic, expected", [
+    ("shellies/bulb-1/color/0/status", {"status", "all", "everything"}),
+    ("shellies/bulb-1/online", {"online", "all", "everything"}),
+    ("shellies/announce", {"announce", "all", "everything"}),
+    # "#" matches the parent level itself
+    ("shellies", {"all", "everything"}),
+    # "+" matches exactly one level
+    ("shellies/bulb-1/color/0/status/extra", {"all", "everything"}),
+    ("shellies/color/0/status", {"all", "everything"}),
+    ("other/topic", {"everything"}),
+])
+def test_wildcard_matching(trie, topic, expected):
+    assert set(trie.match(topic)) == expected
+
+
+def test_wildcards_skip_dollar_topics(trie):
+    assert trie.match("$SYS/broker/uptime") == []
+    trie.add("$SYS/#", "sys")
+    assert trie.match("$SYS/broker/uptime") == ["sys"]
+
+
+def test_remove_invalidates_cached_matches(trie):
+    topic = "shellies/bulb-1/online"
+    assert "online" in trie.match(topic)
+
+    assert trie.remove("shellies/+/online", "online")
+    assert "online" not in trie.match(topic)
+    assert not trie.remove("shellies/+/online", "online")
+    assert not trie.remove("missing/+", "online")
+
+    trie.add("shellies/bulb-1/online", "exact")
+    assert "exact" in trie.match(topic)
+
+
+@pytest.mark.parametrize("topic_filter", ["a/#/b", "a/b#", "a/+b", "a+/b"])
+def test_invalid_filters_are_rejected(topic_filter):
+    with pytest.raises(ValueError):
+        TopicTrie().add(topic_filter, "handler")
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from app.core.device_store import device_store
+from app.integration.producers.shelly.common import COMMAND_ALL_TOPIC
+from app.repositories.device_repository import device_repository
+from app.services.device_state_machine import DeviceStateMachine
+from app.services import warm_start as warm_start_module
+from app.services.mqtt_service import mqtt_service
+from app.services.warm_start import WarmStart
+
+
+@pytest.fixture
+def warm(monkeypatch):
+    """A WarmStart over two persisted bulbs, with a fresh state machine and recorded publishes"""
+    devices = [
+        {"device_id": "desk", "shelly_id": "shellycolorbulb-AA", "ison": True, "brightness": 40, "name": "Desk"},
+        {"device_id": "hall", "shelly_id": "shellycolorbulb-BB", "ison": False},
+    ]
+    machine, published, connect_listeners = DeviceStateMachine(), [], []
+
+    async def resolve(device_id):
+        return None  # Reports are not persisted
+
+    monkeypatch.setattr(device_repository, "resolve", resolve)
+    monkeypatch.setattr(device_store, "all", lambda: [dict(device) for device in devices])
+    monkeypatch.setattr(warm_start_module, "state_machine", machine)
+    monkeypatch.setattr(mqtt_service, "add_connect_listener", connect_listeners.append)
+    monkeypatch.setattr(mqtt_service, "safe_publish", lambda topic, payload: published.append((topic, payload)))
+    warm = WarmStart()
+    warm._window = 0.2
+    return warm, machine, published, connect_listeners
+
+
+def test_ready_once_every_device_reports(warm):
+    warm, machine, published, connect_listeners = warm
+
+    async def scenario():
+        await warm.start()
+        # The snapshot is visible before anything is received
+        assert machine.devices["desk"] == {"ison": True, "brightness": 40}
+        for callback in connect_listeners:
+            callback()
+        await machine._apply({"desk": {"online": True}, "hall": {"ison": True}})
+        await asyncio.sleep(0)
+        assert not warm.ready  # An announce alone does not count as a report
+        await machine._apply({"desk": {"ison": False}})
+        await asyncio.wait_for(warm._task, 1)
+
+    asyncio.run(scenario())
+    assert published == [(COMMAND_ALL_TOPIC, "announce"), (COMMAND_ALL_TOPIC, "update")]
+    stats = warm.get_stats()
+    assert (stats["ready"], stats["timed_out"], stats["reported"], stats["missing"]) == (True, False, 2, [])
+    assert set(stats["timings"]) == {"snapshot_ms", "requested_ms", "first_report_ms", "ready_ms"}
+
+
+def test_window_expiry_reports_missing_devices(warm):
+    warm, machine, _, _ = warm
+
+    async def scenario():
+        await warm.start()
+        await machine._apply({"hall": {"ison": True}})
+        await asyncio.wait_for(warm._task, 1)
+
+    asyncio.run(scenario())
+    stats = warm.get_stats()
+    assert (stats["ready"], stats["timed_out"]) == (True, True)
+    assert (stats["expected"], stats["reported"], stats["missing"]) == (2, 1, ["desk"])
+
+
+def test_ready_immediately_without_known_devices(warm, monkeypatch):
+    warm, _, _, _ = warm
+    monkeypatch.setattr(device_store, "all", lambda: [])
+
+    async def scenario():
+        await warm.start()
+        await asyncio.wait_for(warm._task, 1)
+
+    asyncio.run(scenario())
+    assert warm.ready and not warm.get_stats()["timed_out"]